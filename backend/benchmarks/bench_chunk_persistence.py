@@ -0,0 +1,78 @@
+"""
+Chunk persistence benchmark - per-row ORM adds vs executemany INSERT vs COPY
+
+Needs a PostgreSQL database with the schema applied (DATABASE_URL). Every
+run inserts into a throwaway document inside a transaction that is rolled
+back, so nothing is left behind.
+
+Usage (from backend/):
+    python benchmarks/bench_chunk_persistence.py [chunks]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import SessionLocal  # noqa: E402
+from models import Document, Chunk  # noqa: E402
+from services.chunk_store import ChunkStore  # noqa: E402
+from services.chunker import TextChunker  # noqa: E402
+from bench_chunker import make_corpus  # noqa: E402
+
+
+def orm_insert(db, document_id, chunks):
+    """The original per-row path: one ORM instance and db.add per chunk"""
+    for chunk_data in chunks:
+        db.add(Chunk(
+            document_id=document_id,
+            chunk_index=chunk_data['chunk_index'],
+            chunk_text=chunk_data['chunk_text'],
+            chunk_metadata=chunk_data['metadata']
+        ))
+
+
+def bench(label: str, insert, chunks, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            document = Document(
+                filename="bench.txt",
+                original_filename="bench.txt",
+                file_path="/dev/null",
+                file_size_bytes=0,
+                status="processing"
+            )
+            db.add(document)
+            db.flush()
+
+            start = time.perf_counter()
+            insert(db, document.id, chunks)
+            db.flush()
+            best = min(best, time.perf_counter() - start)
+
+            written = db.query(Chunk).filter(Chunk.document_id == document.id).count()
+            assert written == len(chunks), f"{label}: wrote {written} of {len(chunks)} rows"
+        finally:
+            db.rollback()
+            db.close()
+
+    print(f"{label:<20} {best * 1000:9.1f} ms  {len(chunks) / best:10.0f} rows/s")
+
+
+def main():
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    chunker = TextChunker(chunk_size=1000, chunk_overlap=200, min_chunk_size=100)
+
+    # ~800 new characters per chunk
+    chunks = chunker.chunk_text(make_corpus(target * 800 * 1.5 / (1024 * 1024)), {"document_type": "contract"})[:target]
+    print(f"{len(chunks)} chunks, {sum(len(c['chunk_text']) for c in chunks) / 1e6:.1f} M characters")
+
+    bench("ORM db.add", orm_insert, chunks)
+    bench("executemany", ChunkStore("executemany").insert_chunks, chunks)
+    bench("COPY", ChunkStore("copy").insert_chunks, chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Chunker microbenchmark - legacy rfind-based chunk_text vs the single-pass TextChunker
+
+Usage (from backend/):
+    python benchmarks/bench_chunker.py [size_mb]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.chunker import TextChunker  # noqa: E402
+
+
+def legacy_chunk_text(text, chunk_size=1000, chunk_overlap=200, min_chunk_size=100, metadata=None):
+    """The original EmbeddingService.chunk_text, kept for comparison"""
+    chunks = []
+    text_length = len(text)
+    start = 0
+    chunk_index = 0
+
+    while start < text_length:
+        end = start + chunk_size
+        if end < text_length:
+            search_start = max(start, end - 100)
+            sentence_endings = ['. ', '。', '! ', '！', '? ', '？', '\n\n']
+            best_break = -1
+            for ending in sentence_endings:
+                pos = text.rfind(ending, search_start, end)
+                if pos > best_break:
+                    best_break = pos + len(ending)
+            if best_break > start:
+                end = best_break
+
+        chunk_text = text[start:end].strip()
+        if len(chunk_text) >= min_chunk_size:
+            chunks.append({
+                "chunk_index": chunk_index,
+                "chunk_text": chunk_text,
+                "metadata": {
+                    "chunk_index": chunk_index,
+                    "start_pos": start,
+                    "end_pos": end,
+                    **(metadata or {})
+                }
+            })
+            chunk_index += 1
+
+        start = end - chunk_overlap
+        if start >= text_length:
+            break
+
+    return chunks
+
+
+def make_corpus(size_mb: float) -> str:
+    """Mixed Traditional Chinese / English text with realistic sentence breaks"""
+    random.seed(42)
+    english = ["The contract", "shall remain", "in force", "until terminated", "by either party"]
+    chinese = ["本合約", "自簽訂日起", "生效", "雙方應", "依約履行", "標準作業程序"]
+    endings = [". ", "。", "! ", "？", "\n\n", " ", ""]
+    parts = []
+    total = 0
+    target = int(size_mb * 1024 * 1024)
+    while total < target:
+        word = random.choice(english if random.random() < 0.5 else chinese)
+        part = word + random.choice(endings)
+        parts.append(part)
+        total += len(part.encode("utf-8"))
+    return "".join(parts)
+
+
+def bench(label: str, fn, size_bytes: int, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best * 1000:9.1f} ms  {size_bytes / best / 1e6:8.1f} MB/s  ({len(result)} chunks)")
+    return result
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    text = make_corpus(size_mb)
+    size_bytes = len(text.encode("utf-8"))
+    chunker = TextChunker(chunk_size=1000, chunk_overlap=200, min_chunk_size=100)
+    metadata = {"document_type": "contract"}
+
+    print(f"Corpus: {size_bytes / 1e6:.1f} MB, {len(text)} characters")
+    expected = bench("legacy chunk_text", lambda: legacy_chunk_text(text, metadata=metadata), size_bytes)
+    got = bench("TextChunker.chunk_text", lambda: chunker.chunk_text(text, metadata), size_bytes)
+    pages = [text[i:i + 4000] for i in range(0, len(text), 4000)]
+    streamed = bench("TextChunker.iter_chunks", lambda: list(chunker.iter_chunks(pages, metadata)), size_bytes)
+
+    assert got == expected, "TextChunker output differs from legacy chunk_text"
+    assert streamed == expected, "Streamed output differs from legacy chunk_text"
+    print("Outputs identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+LLM response parsing benchmark - the original json.loads + fenced-block and
+greedy {.*} regex fallbacks vs parse_json_response, on clean, wrapped, large
+and malformed responses
+
+Usage (from backend/):
+    python benchmarks/bench_llm_json.py [size_kb]
+"""
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.llm_json import parse_json_response  # noqa: E402
+
+
+def legacy_parse_llm_response(response):
+    """The original AIExtractor._parse_llm_response"""
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(1))
+
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+
+        raise ValueError("Could not parse JSON from LLM response")
+
+
+def make_metadata(size_kb: float) -> dict:
+    """Extraction output of roughly size_kb kilobytes"""
+    metadata = {
+        "title": "Master Services Agreement",
+        "date": "2024-03-01",
+        "summary": "Agreement between {Acme} and \"Globex\" for consulting services.",
+        "parties": [],
+        "key_terms": [],
+    }
+    i = 0
+    while len(json.dumps(metadata)) < size_kb * 1024:
+        metadata["parties"].append(f"Party {i} Holdings Ltd.")
+        metadata["key_terms"].append({"term": f"Clause {i}", "text": f"Payment within {i % 90} days {{net}}"})
+        i += 1
+    return metadata
+
+
+def make_responses(size_kb: float):
+    metadata = make_metadata(size_kb)
+    body = json.dumps(metadata, ensure_ascii=False)
+    prose = "Note: fields in {braces} were inferred. " * 20
+    return [
+        ("clean", body),
+        ("fenced", f"Here is the result:\n```json\n{body}\n```\nLet me know if you need more."),
+        ("prose around", f"Sure! {prose}\n{body}\n{prose} {{end}}"),
+        ("trailing object", f"{body}\n\nAlternative reading: {body}"),
+        # Truncated output (max_tokens hit): no closing braces anywhere
+        ("truncated", body[: len(body) // 2]),
+        # Many opening braces and nothing valid: quadratic for the greedy regex
+        ("malformed braces", "{ item " * int(size_kb * 150)),
+    ]
+
+
+def bench(fn, response, repeat: int = 5):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = fn(response)
+        except ValueError as e:
+            result = e
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    size_kb = float(sys.argv[1]) if len(sys.argv) > 1 else 256
+    print(f"{'response':<18} {'bytes':>10} {'legacy':>12} {'new':>12}  result")
+
+    for label, response in make_responses(size_kb):
+        legacy_time, legacy_result = bench(legacy_parse_llm_response, response)
+        new_time, new_result = bench(parse_json_response, response)
+
+        if isinstance(new_result, Exception):
+            outcome = "error" if isinstance(legacy_result, Exception) else "error (legacy parsed)"
+        elif isinstance(legacy_result, Exception):
+            outcome = "parsed (legacy failed)"
+        else:
+            outcome = "same" if new_result == legacy_result else "first object (legacy differs)"
+
+        print(
+            f"{label:<18} {len(response):>10} {legacy_time * 1000:>9.2f} ms {new_time * 1000:>9.2f} ms  {outcome}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+PDF extraction benchmark - serial page loop vs the process-pool page ranges
+
+Usage (from backend/):
+    python benchmarks/bench_pdf_extraction.py file.pdf [workers ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.document_processor import DocumentProcessor  # noqa: E402
+
+
+def bench(processor: DocumentProcessor, file_path: str, repeat: int = 3):
+    best = float("inf")
+    pages = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = processor.extract_pdf_pages(file_path)
+        best = min(best, time.perf_counter() - start)
+    return best, pages
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    file_path = sys.argv[1]
+    worker_counts = [int(arg) for arg in sys.argv[2:]] or [2, 4, 8, os.cpu_count() or 1]
+
+    processor = DocumentProcessor()
+    processor.pdf_workers = 1
+    serial, expected = bench(processor, file_path)
+    print(f"{len(expected)} pages with text")
+    print(f"{'serial':<12} {serial * 1000:9.1f} ms")
+
+    for workers in worker_counts:
+        processor = DocumentProcessor()
+        processor.pdf_workers = workers
+        processor.pdf_parallel_min_pages = 0
+        # Warm the pool so process start-up is not timed
+        processor.extract_pdf_pages(file_path)
+
+        elapsed, pages = bench(processor, file_path)
+        assert pages == expected, f"{workers} workers: output differs from serial extraction"
+        print(f"{workers:>2} workers   {elapsed * 1000:9.1f} ms  {serial / elapsed:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Text cleaning + type detection benchmark - the original split/strip/join
+cleaner and per-keyword substring scans vs clean_text and the single-scan
+DocumentTypeClassifier
+
+Usage (from backend/):
+    python benchmarks/bench_text_analysis.py [size_mb]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.document_processor import DocumentTypeClassifier, clean_text  # noqa: E402
+from bench_chunker import make_corpus  # noqa: E402
+
+
+def legacy_clean_text(text):
+    """The original DocumentProcessor._clean_text"""
+    lines = [line.strip() for line in text.split('\n')]
+    lines = [line for line in lines if line]
+    cleaned = '\n'.join(lines)
+    cleaned = re.sub(r' +', ' ', cleaned)
+    return cleaned.strip()
+
+
+def legacy_detect_document_type(text, filename):
+    """The original DocumentProcessor.detect_document_type"""
+    text_lower = text.lower()
+    filename_lower = filename.lower()
+
+    if any(keyword in text_lower for keyword in ['contract', '合約', '協議', 'agreement']):
+        return 'contract'
+    elif any(keyword in text_lower for keyword in ['sop', 'standard operating procedure', '標準作業程序']):
+        return 'sop'
+    elif any(keyword in text_lower for keyword in ['official', '公文', 'memorandum', '函']):
+        return 'official_document'
+    elif any(keyword in text_lower for keyword in ['report', '報告', 'analysis', '分析']):
+        return 'report'
+    elif any(keyword in filename_lower for keyword in ['contract', 'sop', 'report']):
+        if 'contract' in filename_lower:
+            return 'contract'
+        elif 'sop' in filename_lower:
+            return 'sop'
+        elif 'report' in filename_lower:
+            return 'report'
+
+    return 'other'
+
+
+def bench(label: str, fn, size_bytes: int, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best * 1000:9.1f} ms  {size_bytes / best / 1e6:8.1f} MB/s  -> {result[1]}")
+    return result
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    # Messy extractor output: padded lines, blank lines, runs of spaces
+    text = make_corpus(size_mb).replace("。", "。  \n \n   ").replace(". ", ".    ")
+    size_bytes = len(text.encode("utf-8"))
+    print(f"{size_bytes / 1e6:.1f} MB of text")
+
+    classifier = DocumentTypeClassifier(strategy="first_match")
+    weighted = DocumentTypeClassifier(strategy="weighted")
+
+    def legacy():
+        cleaned = legacy_clean_text(text)
+        return cleaned, legacy_detect_document_type(cleaned, "document.pdf")
+
+    def single_scan(classifier):
+        cleaned = clean_text(text)
+        counts = classifier.count(cleaned)
+        return cleaned, classifier.classify(counts, "document.pdf")
+
+    expected = bench("legacy", legacy, size_bytes)
+    result = bench("single scan (first_match)", lambda: single_scan(classifier), size_bytes)
+    assert result == expected, "single scan output differs from legacy"
+    bench("single scan (weighted)", lambda: single_scan(weighted), size_bytes)
+    print(f"keyword counts: {dict(weighted.count(result[0]))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ Configuration management using Pydantic Settings
 """
 from pydantic_settings import BaseSettings
 from pydantic import Field, validator
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 import os
 
 
@@ -24,8 +24,27 @@ class Settings(BaseSettings):
     openrouter_api_key: Optional[str] = Field(None, env="OPENROUTER_API_KEY")
     
     # Vector Database
-    vector_db_type: Literal["chromadb", "pinecone"] = Field("chromadb", env="VECTOR_DB_TYPE")
+    vector_db_type: Literal["chromadb", "flat", "pgvector", "pinecone"] = Field("chromadb", env="VECTOR_DB_TYPE")
     chromadb_path: str = Field("./chromadb_data", env="CHROMADB_PATH")
+    # Chroma server (required with chromadb: worker.py runs next to the API and embedded Chroma is single-process)
+    chromadb_host: Optional[str] = Field(None, env="CHROMADB_HOST")
+    chromadb_port: int = Field(8000, env="CHROMADB_PORT")
+    # Flat index: exact search over memory-mapped segments (float16 halves memory, scores more slowly)
+    flat_index_path: str = Field("./vector_index", env="FLAT_INDEX_PATH")
+    flat_index_dtype: Literal["float32", "float16"] = Field("float32", env="FLAT_INDEX_DTYPE")
+    flat_index_max_segments: int = Field(16, env="FLAT_INDEX_MAX_SEGMENTS")
+    flat_index_compact_dead_ratio: float = Field(0.2, env="FLAT_INDEX_COMPACT_DEAD_RATIO")
+    # pgvector: embeddings in chunks.embedding (DATABASE_URL); the ANN index is built by /api/admin/vector-index/rebuild
+    pgvector_dimension: int = Field(1536, env="PGVECTOR_DIMENSION")
+    pgvector_index: Literal["hnsw", "ivfflat", "none"] = Field("hnsw", env="PGVECTOR_INDEX")
+    pgvector_hnsw_m: int = Field(16, env="PGVECTOR_HNSW_M")
+    pgvector_hnsw_ef_construction: int = Field(64, env="PGVECTOR_HNSW_EF_CONSTRUCTION")
+    pgvector_hnsw_ef_search: int = Field(40, env="PGVECTOR_HNSW_EF_SEARCH")
+    pgvector_ivfflat_lists: int = Field(100, env="PGVECTOR_IVFFLAT_LISTS")
+    pgvector_ivfflat_probes: int = Field(10, env="PGVECTOR_IVFFLAT_PROBES")
+    # Filtered queries keep scanning the index until top_k rows pass (pgvector >= 0.8)
+    pgvector_iterative_scan: bool = Field(False, env="PGVECTOR_ITERATIVE_SCAN")
+    pgvector_maintenance_work_mem: str = Field("512MB", env="PGVECTOR_MAINTENANCE_WORK_MEM")
     pinecone_api_key: Optional[str] = Field(None, env="PINECONE_API_KEY")
     pinecone_environment: Optional[str] = Field(None, env="PINECONE_ENVIRONMENT")
     pinecone_index_name: str = Field("document-embeddings", env="PINECONE_INDEX_NAME")
@@ -39,17 +58,40 @@ class Settings(BaseSettings):
     chunk_size: int = Field(1000, env="CHUNK_SIZE")
     chunk_overlap: int = Field(200, env="CHUNK_OVERLAP")
     min_chunk_size: int = Field(100, env="MIN_CHUNK_SIZE")
+    # "chars" (default) or "tokens": unit for chunk_size / chunk_overlap / min_chunk_size
+    chunk_unit: Literal["chars", "tokens"] = Field("chars", env="CHUNK_UNIT")
     
     # RAG Configuration
     default_top_k: int = Field(4, env="DEFAULT_TOP_K")
     similarity_threshold: float = Field(0.7, env="SIMILARITY_THRESHOLD")
     max_context_length: int = Field(4000, env="MAX_CONTEXT_LENGTH")
+    max_context_tokens: int = Field(3000, env="MAX_CONTEXT_TOKENS")  # used when chunk_unit == "tokens"
     
     # LLM Configuration
     llm_model: str = Field("gpt-4o-mini", env="LLM_MODEL")
     embedding_model: str = Field("text-embedding-3-small", env="EMBEDDING_MODEL")
     llm_temperature: float = Field(0.1, env="LLM_TEMPERATURE")
     max_tokens: int = Field(2000, env="MAX_TOKENS")
+    # Ask the provider for a bare JSON object in metadata extraction (response_format / responseMimeType)
+    llm_json_mode: bool = Field(True, env="LLM_JSON_MODE")
+    
+    # Embedding Cache
+    enable_embedding_cache: bool = Field(True, env="ENABLE_EMBEDDING_CACHE")
+    embedding_cache_path: str = Field("./cache/embeddings.sqlite3", env="EMBEDDING_CACHE_PATH")
+    embedding_cache_memory_items: int = Field(20000, env="EMBEDDING_CACHE_MEMORY_ITEMS")
+    embedding_cache_max_mb: int = Field(1024, env="EMBEDDING_CACHE_MAX_MB")
+    query_embedding_cache_size: int = Field(1024, env="QUERY_EMBEDDING_CACHE_SIZE")
+    
+    # Embedding Batching (limits shrink after 413/429 and grow back)
+    embedding_batch_size: int = Field(100, env="EMBEDDING_BATCH_SIZE")
+    embedding_batch_tokens: int = Field(50000, env="EMBEDDING_BATCH_TOKENS")
+    embedding_concurrency: int = Field(4, env="EMBEDDING_CONCURRENCY")
+    embedding_max_retries: int = Field(5, env="EMBEDDING_MAX_RETRIES")
+    
+    # Parsed Text Cache (cleaned text + page numbers per file hash and parser version)
+    enable_parsed_text_cache: bool = Field(True, env="ENABLE_PARSED_TEXT_CACHE")
+    parsed_text_cache_path: str = Field("./cache/parsed_text.sqlite3", env="PARSED_TEXT_CACHE_PATH")
+    parsed_text_cache_max_mb: int = Field(2048, env="PARSED_TEXT_CACHE_MAX_MB")
     
     # Alternative LLM Models
     google_model: str = Field("gemini-pro", env="GOOGLE_MODEL")
@@ -81,6 +123,22 @@ class Settings(BaseSettings):
     # Feature Flags
     enable_batch_processing: bool = Field(True, env="ENABLE_BATCH_PROCESSING")
     enable_auto_extraction: bool = Field(True, env="ENABLE_AUTO_EXTRACTION")
+    # AI metadata: "prefix" sends the first 8000 characters in one call; "map_reduce"
+    # extracts sections of the ingest chunks in parallel and merges the results
+    metadata_extraction_mode: Literal["prefix", "map_reduce"] = Field("map_reduce", env="METADATA_EXTRACTION_MODE")
+    extraction_section_chars: int = Field(8000, env="EXTRACTION_SECTION_CHARS")
+    # Longer documents are sampled evenly (first and last sections always included)
+    extraction_max_sections: int = Field(32, env="EXTRACTION_MAX_SECTIONS")
+    extraction_concurrency: int = Field(4, env="EXTRACTION_CONCURRENCY")
+    # Short documents of one type packed into a single extraction prompt
+    extraction_batch_size: int = Field(10, env="EXTRACTION_BATCH_SIZE")
+    extraction_batch_chars: int = Field(8000, env="EXTRACTION_BATCH_CHARS")
+    # Extraction results per (model, schema, prompt text)
+    enable_extraction_cache: bool = Field(True, env="ENABLE_EXTRACTION_CACHE")
+    extraction_cache_path: str = Field("./cache/extractions.sqlite3", env="EXTRACTION_CACHE_PATH")
+    extraction_cache_max_entries: int = Field(100000, env="EXTRACTION_CACHE_MAX_ENTRIES")
+    # Edits to extraction_templates are picked up within this many seconds
+    template_check_interval_seconds: int = Field(30, env="TEMPLATE_CHECK_INTERVAL_SECONDS")
     enable_query_logging: bool = Field(True, env="ENABLE_QUERY_LOGGING")
     enable_metrics: bool = Field(True, env="ENABLE_METRICS")
     
@@ -89,6 +147,49 @@ class Settings(BaseSettings):
     processing_timeout_seconds: int = Field(300, env="PROCESSING_TIMEOUT_SECONDS")
     cache_ttl_seconds: int = Field(3600, env="CACHE_TTL_SECONDS")
     
+    # Ingestion Queue (worker.py: max_concurrent_uploads worker processes,
+    # processing_timeout_seconds is the job lease)
+    ingest_max_retries: int = Field(3, env="INGEST_MAX_RETRIES")
+    ingest_retry_backoff_seconds: int = Field(30, env="INGEST_RETRY_BACKOFF_SECONDS")
+    ingest_poll_interval_seconds: float = Field(2.0, env="INGEST_POLL_INTERVAL_SECONDS")
+    # Chunks per embedding batch started while extraction is still running
+    ingest_pipeline_batch_chunks: int = Field(64, env="INGEST_PIPELINE_BATCH_CHUNKS")
+    ingest_embedding_workers: int = Field(2, env="INGEST_EMBEDDING_WORKERS")
+    # Chunk row writes: "auto" (COPY on PostgreSQL + psycopg2, else executemany), "copy", "executemany"
+    chunk_insert_method: Literal["auto", "copy", "executemany"] = Field("auto", env="CHUNK_INSERT_METHOD")
+    # Parallel PDF text extraction (a process pool per ingestion worker;
+    # 0 = CPU cores divided by the number of worker processes, at least 1)
+    pdf_extraction_workers: int = Field(0, env="PDF_EXTRACTION_WORKERS")
+    # PDFs with fewer pages are extracted serially (pool start-up is not worth it)
+    pdf_parallel_min_pages: int = Field(40, env="PDF_PARALLEL_MIN_PAGES")
+    # documents.full_text: spooled to a temporary file during extraction and
+    # written in slices of full_text_flush_chars in the job's final step, or
+    # not stored at all
+    store_full_text: bool = Field(True, env="STORE_FULL_TEXT")
+    full_text_flush_chars: int = Field(1_000_000, env="FULL_TEXT_FLUSH_CHARS")
+    # Document type detection: keyword table per type (JSON object), in priority
+    # order; "weighted" picks the type with the most keyword matches (ties go
+    # to the earlier type), "first_match" the first type with any match
+    document_type_keywords: Dict[str, List[str]] = Field(
+        {
+            "contract": ["contract", "合約", "協議", "agreement"],
+            "sop": ["sop", "standard operating procedure", "標準作業程序"],
+            "official_document": ["official", "公文", "memorandum", "函"],
+            "report": ["report", "報告", "analysis", "分析"],
+        },
+        env="DOCUMENT_TYPE_KEYWORDS"
+    )
+    document_type_strategy: Literal["weighted", "first_match"] = Field("weighted", env="DOCUMENT_TYPE_STRATEGY")
+    
+    # Answer Cache (RAGEngine.query)
+    enable_answer_cache: bool = Field(True, env="ENABLE_ANSWER_CACHE")
+    answer_cache_max_entries: int = Field(1000, env="ANSWER_CACHE_MAX_ENTRIES")
+    answer_cache_similarity_threshold: float = Field(0.95, env="ANSWER_CACHE_SIMILARITY_THRESHOLD")
+    # Filenames shown with query sources (invalidation only reaches the uvicorn worker that made the change)
+    document_metadata_ttl_seconds: int = Field(30, env="DOCUMENT_METADATA_TTL_SECONDS")
+    # Concurrent identical queries share one embedding / retrieval / generation
+    enable_request_coalescing: bool = Field(True, env="ENABLE_REQUEST_COALESCING")
+    
     @validator("allowed_extensions", pre=True)
     def parse_extensions(cls, v):
         if isinstance(v, str):
@@ -106,6 +207,16 @@ class Settings(BaseSettings):
         """Convert MB to bytes"""
         return self.max_file_size_mb * 1024 * 1024
     
+    @property
+    def embedding_cache_max_bytes(self) -> int:
+        """Convert MB to bytes"""
+        return self.embedding_cache_max_mb * 1024 * 1024
+    
+    @property
+    def parsed_text_cache_max_bytes(self) -> int:
+        """Convert MB to bytes"""
+        return self.parsed_text_cache_max_mb * 1024 * 1024
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
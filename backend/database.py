@@ -1,7 +1,7 @@
 """
 Database connection and session management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
@@ -35,6 +35,25 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+# Columns added after the initial schema (create_all does not alter existing tables)
+SCHEMA_UPGRADES = [
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS document_id UUID REFERENCES documents(id) ON DELETE CASCADE",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS retry_count INTEGER DEFAULT 0",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS max_retries INTEGER DEFAULT 3",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS locked_by VARCHAR(200)",
+    "ALTER TABLE processing_jobs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS idx_processing_jobs_queue ON processing_jobs(status, run_after)",
+    "CREATE INDEX IF NOT EXISTS idx_processing_jobs_document_id ON processing_jobs(document_id)",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash)",
+]
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
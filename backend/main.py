@@ -1,24 +1,28 @@
 """
 FastAPI Main Application - Enterprise Document Intelligence Platform
 """
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 import os
+import json
 import uuid
-import shutil
+import hashlib
 from datetime import datetime
 
 from config import settings
-from database import get_db, init_db
-from models import Document, Chunk, QueryLog, SystemConfig
+from database import get_db, init_db, SessionLocal
+from models import Document, Chunk, QueryLog, SystemConfig, ProcessingJob
 from services.document_processor import DocumentProcessor
-from services.ai_extractor import AIExtractor
 from services.embedding_service import EmbeddingService
 from services.rag_engine import RAGEngine
+from services.http_pool import http_pool
+from services.document_metadata import document_metadata_cache
+from services.job_queue import job_queue
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -38,7 +42,6 @@ app.add_middleware(
 
 # Initialize services
 doc_processor = DocumentProcessor()
-ai_extractor = AIExtractor()
 embedding_service = EmbeddingService()
 rag_engine = RAGEngine()
 
@@ -49,6 +52,7 @@ class DocumentUploadResponse(BaseModel):
     filename: str
     status: str
     message: str
+    job_id: Optional[str] = None
 
 
 class SearchRequest(BaseModel):
@@ -63,6 +67,12 @@ class SearchResponse(BaseModel):
     retrieval_time_ms: int
     llm_time_ms: int
     total_time_ms: int
+    cached: bool = False
+
+
+class MetadataExtractionRequest(BaseModel):
+    document_ids: Optional[List[str]] = None
+    document_type: Optional[str] = None
 
 
 class DocumentListResponse(BaseModel):
@@ -74,78 +84,76 @@ class DocumentListResponse(BaseModel):
     file_size_bytes: int
 
 
-# Background task for document processing
-async def process_document_task(
-    document_id: str,
-    file_path: str,
-    db: Session
-):
-    """Background task to process uploaded document"""
+def job_summary(job: Optional[ProcessingJob]) -> Optional[dict]:
+    """Public view of an ingestion job"""
+    if job is None:
+        return None
+    return {
+        "id": str(job.id),
+        "job_type": job.job_type,
+        "status": job.status,
+        "document_id": str(job.document_id) if job.document_id else None,
+        "processed_items": job.processed_items,
+        "total_items": job.total_items,
+        "retry_count": job.retry_count,
+        "max_retries": job.max_retries,
+        "error_message": job.error_message,
+        "output": job.output_data,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None
+    }
+
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+def check_extension(file_ext: str) -> None:
+    """Reject unsupported formats before anything is written"""
+    ext = file_ext.lower().lstrip('.')
+    if ext not in doc_processor.supported_formats:
+        raise HTTPException(status_code=400, detail=f"Unsupported file format: {ext}")
+
+
+def save_upload(file: UploadFile, file_path: str) -> Tuple[int, str]:
+    """
+    Stream an upload to disk in large blocks, hashing it in the same pass
+    
+    The size limit is enforced while streaming: the partial file is removed
+    as soon as the limit is exceeded.
+    
+    Returns:
+        Tuple of (size in bytes, SHA-256 hex digest)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    
     try:
-        # Update status to processing
-        doc = db.query(Document).filter(Document.id == document_id).first()
-        doc.status = "processing"
-        db.commit()
-        
-        # Step 1: Extract text
-        full_text, mime_type, error = doc_processor.process_file(file_path)
-        
-        if error:
-            doc.status = "failed"
-            doc.error_message = error
-            db.commit()
-            return
-        
-        # Update document with text
-        doc.full_text = full_text
-        doc.mime_type = mime_type
-        
-        # Detect document type if not set
-        if not doc.document_type:
-            doc.document_type = doc_processor.detect_document_type(full_text, doc.filename)
-        
-        db.commit()
-        
-        # Step 2: Extract metadata using AI
-        if settings.enable_auto_extraction:
-            metadata, extract_error = ai_extractor.extract_metadata(
-                full_text,
-                doc.document_type
-            )
-            
-            if not extract_error:
-                doc.doc_metadata = metadata
-                db.commit()
-        
-        # Step 3: Create chunks and embeddings
-        chunks, embeddings = embedding_service.process_document(
-            document_id=str(document_id),
-            text=full_text,
-            metadata={'document_type': doc.document_type}
-        )
-        
-        # Step 4: Store chunks in database
-        for chunk_data in chunks:
-            chunk = Chunk(
-                document_id=document_id,
-                chunk_index=chunk_data['chunk_index'],
-                chunk_text=chunk_data['chunk_text'],
-                chunk_metadata=chunk_data['metadata']
-            )
-            db.add(chunk)
-        
-        # Mark as completed
-        doc.status = "completed"
-        doc.processed_date = datetime.utcnow()
-        db.commit()
+        with open(file_path, "wb") as buffer:
+            while True:
+                block = file.file.read(UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                
+                size += len(block)
+                if size > settings.max_file_size_bytes:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File size exceeds maximum of {settings.max_file_size_mb}MB"
+                    )
+                
+                digest.update(block)
+                buffer.write(block)
         
-    except Exception as e:
-        # Handle errors
-        doc = db.query(Document).filter(Document.id == document_id).first()
-        doc.status = "failed"
-        doc.error_message = str(e)
-        doc.retry_count += 1
-        db.commit()
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File is empty")
+    
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    
+    return size, digest.hexdigest()
 
 
 # API Endpoints
@@ -170,10 +178,9 @@ async def health_check():
 
 
 @app.post("/api/documents/upload", response_model=DocumentUploadResponse)
-async def upload_document(
+def upload_document(
     file: UploadFile = File(...),
     document_type: Optional[str] = None,
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     db: Session = Depends(get_db)
 ):
     """
@@ -183,51 +190,36 @@ async def upload_document(
     - **document_type**: Optional document type classification
     """
     try:
-        # Validate file size
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset
+        file_ext = os.path.splitext(file.filename)[1]
+        check_extension(file_ext)
         
-        if file_size > settings.max_file_size_bytes:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File size exceeds maximum of {settings.max_file_size_mb}MB"
-            )
-            
-        # Check for duplicate file
+        # Generate unique filename
+        unique_filename = f"{uuid.uuid4()}{file_ext}"
+        file_path = os.path.join(settings.upload_dir, unique_filename)
+        
+        # Save file (size limit enforced and SHA-256 computed while streaming)
+        file_size, content_hash = save_upload(file, file_path)
+        
+        # Check for duplicate content (any filename)
         existing_doc = db.query(Document).filter(
-            Document.original_filename == file.filename,
-            Document.file_size_bytes == file_size,
+            Document.content_hash == content_hash,
             Document.status != 'failed'
         ).first()
-
+        
         if existing_doc:
+            os.remove(file_path)
             raise HTTPException(
                 status_code=409,
-                detail=f"文件 '{file.filename}' 已存在，請勿重複上傳。"
+                detail=f"文件 '{file.filename}' 已存在（與 '{existing_doc.original_filename}' 內容相同），請勿重複上傳。"
             )
         
-        # Generate unique filename
-        file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(settings.upload_dir, unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Validate file
-        is_valid, error = doc_processor.validate_file(file_path)
-        if not is_valid:
-            os.remove(file_path)
-            raise HTTPException(status_code=400, detail=error)
-        
         # Create database record
         document = Document(
             filename=unique_filename,
             original_filename=file.filename,
             file_path=file_path,
             file_size_bytes=file_size,
+            content_hash=content_hash,
             document_type=document_type,
             status="pending"
         )
@@ -235,20 +227,22 @@ async def upload_document(
         db.add(document)
         db.commit()
         db.refresh(document)
+        document_metadata_cache.put(document)
         
-        # Schedule background processing
-        background_tasks.add_task(
-            process_document_task,
-            str(document.id),
-            file_path,
-            db
+        # Queue for the ingestion workers (worker.py)
+        job = job_queue.enqueue(
+            db,
+            "document_upload",
+            document_id=document.id,
+            input_data={"file_path": file_path}
         )
         
         return DocumentUploadResponse(
             id=str(document.id),
             filename=file.filename,
             status="pending",
-            message="文件上傳成功，正在後台處理。"
+            message="文件上傳成功，正在後台處理。",
+            job_id=str(job.id)
         )
         
     except HTTPException:
@@ -258,7 +252,7 @@ async def upload_document(
 
 
 @app.get("/api/documents", response_model=List[DocumentListResponse])
-async def list_documents(
+def list_documents(
     status: Optional[str] = None,
     document_type: Optional[str] = None,
     limit: int = Query(100, le=1000),
@@ -296,7 +290,7 @@ async def list_documents(
 
 
 @app.get("/api/documents/{document_id}")
-async def get_document(
+def get_document(
     document_id: str,
     db: Session = Depends(get_db)
 ):
@@ -322,12 +316,13 @@ async def get_document(
         "mime_type": document.mime_type,
         "metadata": document.doc_metadata,
         "error_message": document.error_message,
-        "chunk_count": len(document.chunks)
+        "chunk_count": len(document.chunks),
+        "job": job_summary(job_queue.latest_for_document(db, document.id))
     }
 
 
 @app.get("/api/documents/{document_id}/content")
-async def get_document_content(
+def get_document_content(
     document_id: str,
     db: Session = Depends(get_db)
 ):
@@ -352,8 +347,150 @@ async def get_document_content(
     )
 
 
+@app.put("/api/documents/{document_id}", response_model=DocumentUploadResponse)
+def update_document(
+    document_id: str,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a new version of an existing document
+    
+    Only chunks whose content changed are re-embedded.
+    """
+    try:
+        doc_uuid = uuid.UUID(document_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無效的文件 ID 格式")
+    
+    document = db.query(Document).filter(Document.id == doc_uuid).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="找不到文件")
+    
+    file_ext = os.path.splitext(file.filename)[1]
+    check_extension(file_ext)
+    unique_filename = f"{uuid.uuid4()}{file_ext}"
+    file_path = os.path.join(settings.upload_dir, unique_filename)
+    
+    file_size, content_hash = save_upload(file, file_path)
+    
+    if content_hash == document.content_hash and document.status != "failed":
+        # Same bytes as the current version: nothing to re-index
+        os.remove(file_path)
+        return DocumentUploadResponse(
+            id=str(document.id),
+            filename=document.original_filename,
+            status=document.status,
+            message="文件內容未變更，無需重新索引。"
+        )
+    
+    # Replace the stored file
+    old_path = document.file_path
+    document.filename = unique_filename
+    document.original_filename = file.filename
+    document.file_path = file_path
+    document.file_size_bytes = file_size
+    document.content_hash = content_hash
+    document.status = "pending"
+    db.commit()
+    document_metadata_cache.invalidate(str(document.id))
+    
+    if old_path != file_path and os.path.exists(old_path):
+        os.remove(old_path)
+    
+    # Cached answers go stale when the worker commits the new chunks (processed_date)
+    job = job_queue.enqueue(db, "reindex", document_id=document.id, input_data={"file_path": file_path})
+    
+    return DocumentUploadResponse(
+        id=str(document.id),
+        filename=file.filename,
+        status="pending",
+        message="文件已更新，正在重新索引變更的內容。",
+        job_id=str(job.id)
+    )
+
+
+@app.post("/api/documents/{document_id}/reindex", response_model=DocumentUploadResponse)
+def reindex_document(
+    document_id: str,
+    db: Session = Depends(get_db)
+):
+    """Re-index a document from its stored file (e.g. after a chunking change)"""
+    try:
+        doc_uuid = uuid.UUID(document_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無效的文件 ID 格式")
+    
+    document = db.query(Document).filter(Document.id == doc_uuid).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="找不到文件")
+    
+    if not os.path.exists(document.file_path):
+        raise HTTPException(status_code=404, detail="文件檔案已遺失")
+    
+    document.status = "pending"
+    db.commit()
+    
+    # Cached answers go stale when the worker commits the new chunks (processed_date)
+    job = job_queue.enqueue(db, "reindex", document_id=document.id, input_data={"file_path": document.file_path})
+    
+    return DocumentUploadResponse(
+        id=str(document.id),
+        filename=document.original_filename,
+        status="pending",
+        message="正在重新索引文件。",
+        job_id=str(job.id)
+    )
+
+
+@app.post("/api/documents/extract-metadata")
+def extract_metadata_bulk(
+    request: MetadataExtractionRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Re-run AI metadata extraction for completed documents in the background
+    
+    - **document_ids**: Documents to re-extract (default: all completed documents)
+    - **document_type**: Only documents of this type
+    
+    Short documents of the same type share LLM calls, and unchanged
+    documents are answered from the extraction cache.
+    """
+    query = db.query(Document.id).filter(Document.status == "completed")
+    
+    if request.document_ids:
+        try:
+            doc_uuids = [uuid.UUID(document_id) for document_id in request.document_ids]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="無效的文件 ID 格式")
+        query = query.filter(Document.id.in_(doc_uuids))
+    
+    if request.document_type:
+        query = query.filter(Document.document_type == request.document_type)
+    
+    document_ids = [str(row.id) for row in query.all()]
+    if not document_ids:
+        raise HTTPException(status_code=404, detail="找不到符合條件的已完成文件")
+    
+    job = job_queue.enqueue(
+        db,
+        "extract_metadata",
+        input_data={"document_ids": document_ids},
+        total_items=len(document_ids)
+    )
+    
+    return {
+        "job_id": str(job.id),
+        "documents": len(document_ids),
+        "message": "正在重新抽取文件資訊。"
+    }
+
+
 @app.delete("/api/documents/{document_id}")
-async def delete_document(
+def delete_document(
     document_id: str,
     db: Session = Depends(get_db)
 ):
@@ -374,6 +511,8 @@ async def delete_document(
     
     # Delete from vector database
     embedding_service.delete_document_chunks(str(document_id))
+    rag_engine.invalidate_document(str(document_id))
+    document_metadata_cache.invalidate(str(document_id))
     
     # Delete from database (cascades to chunks)
     db.delete(document)
@@ -382,6 +521,41 @@ async def delete_document(
     return {"message": "文件刪除成功"}
 
 
+@app.get("/api/jobs/{job_id}")
+def get_job(
+    job_id: str,
+    db: Session = Depends(get_db)
+):
+    """Get the status and progress of an ingestion job"""
+    try:
+        job_uuid = uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無效的工作 ID 格式")
+    
+    job = db.query(ProcessingJob).filter(ProcessingJob.id == job_uuid).first()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到工作")
+    
+    return job_summary(job)
+
+
+def log_query(db: Session, request: SearchRequest, result: dict) -> None:
+    """Persist a query and its answer to query_logs"""
+    query_log = QueryLog(
+        query_text=request.query,
+        top_k=request.top_k or settings.default_top_k,
+        filters=request.filters,
+        answer_text=result['answer'],
+        sources=result['sources'],
+        retrieval_time_ms=result['retrieval_time_ms'],
+        llm_time_ms=result['llm_time_ms'],
+        total_time_ms=result['total_time_ms']
+    )
+    db.add(query_log)
+    db.commit()
+
+
 @app.post("/api/search/query", response_model=SearchResponse)
 async def search_query(
     request: SearchRequest,
@@ -395,8 +569,8 @@ async def search_query(
     - **filters**: Optional metadata filters
     """
     try:
-        # Execute RAG query
-        result = rag_engine.query(
+        # Execute RAG query without blocking the event loop
+        result = await rag_engine.aquery(
             query_text=request.query,
             top_k=request.top_k,
             filters=request.filters,
@@ -405,18 +579,7 @@ async def search_query(
         
         # Log query if enabled
         if settings.enable_query_logging:
-            query_log = QueryLog(
-                query_text=request.query,
-                top_k=request.top_k or settings.default_top_k,
-                filters=request.filters,
-                answer_text=result['answer'],
-                sources=result['sources'],
-                retrieval_time_ms=result['retrieval_time_ms'],
-                llm_time_ms=result['llm_time_ms'],
-                total_time_ms=result['total_time_ms']
-            )
-            db.add(query_log)
-            db.commit()
+            await run_in_threadpool(log_query, db, request, result)
         
         return SearchResponse(**result)
         
@@ -424,8 +587,55 @@ async def search_query(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event(event: dict) -> str:
+    """Encode an astream_query event as a server-sent event"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/search/stream")
+async def search_stream(request: SearchRequest):
+    """
+    Execute RAG query and stream the answer as server-sent events
+    
+    Events: `sources` (retrieved chunks), `answer_chunk` (token deltas),
+    `done` (timings) or `error`
+    """
+    async def event_stream():
+        # Dependency-managed sessions are closed before a streamed body is sent
+        db = SessionLocal()
+        try:
+            sources, answer_parts = [], []
+            
+            async for event in rag_engine.astream_query(
+                query_text=request.query,
+                top_k=request.top_k,
+                filters=request.filters,
+                db=db
+            ):
+                if event['type'] == 'sources':
+                    sources = event['content']
+                elif event['type'] == 'answer_chunk':
+                    answer_parts.append(event['content'])
+                elif event['type'] == 'done' and settings.enable_query_logging:
+                    result = {'answer': "".join(answer_parts), 'sources': sources, **event['content']}
+                    await run_in_threadpool(log_query, db, request, result)
+                
+                yield sse_event(event)
+        
+        except Exception as e:
+            yield sse_event({'type': 'error', 'content': str(e)})
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/api/stats")
-async def get_stats(db: Session = Depends(get_db)):
+def get_stats(db: Session = Depends(get_db)):
     """Get system statistics"""
     total_docs = db.query(Document).count()
     completed_docs = db.query(Document).filter(Document.status == "completed").count()
@@ -439,6 +649,10 @@ async def get_stats(db: Session = Depends(get_db)):
         "failed_documents": failed_docs,
         "total_chunks": total_chunks,
         "total_queries": total_queries,
+        "vector_store": embedding_service.vector_store.stats(),
+        "embedding_cache": embedding_service.cache.stats() if embedding_service.cache else None,
+        "answer_cache": rag_engine.answer_cache.stats() if rag_engine.answer_cache else None,
+        "parsed_text_cache": doc_processor.text_cache.stats() if doc_processor.text_cache else None,
         "token_usage": {
             "total": total_queries * 500,  # Estimated fallback
             "limit": 100000,               # Default limit
@@ -455,14 +669,14 @@ class SystemConfigRequest(BaseModel):
 
 
 @app.get("/api/admin/config")
-async def get_system_config(db: Session = Depends(get_db)):
+def get_system_config(db: Session = Depends(get_db)):
     """Get all system configurations"""
     configs = db.query(SystemConfig).all()
     return {cfg.key: cfg.value for cfg in configs}
 
 
 @app.post("/api/admin/config")
-async def update_system_config(
+def update_system_config(
     config: SystemConfigRequest,
     db: Session = Depends(get_db)
 ):
@@ -488,6 +702,15 @@ async def update_system_config(
     return {"message": "Configuration updated successfully", "key": config.key}
 
 
+@app.post("/api/admin/vector-index/rebuild")
+def rebuild_vector_index():
+    """Rebuild the vector store's ANN index (pgvector)"""
+    try:
+        return embedding_service.vector_store.rebuild_index()
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -497,6 +720,13 @@ async def startup_event():
     print(f"✅ API running on {settings.api_host}:{settings.api_port}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled LLM connections"""
+    await http_pool.aclose()
+    http_pool.close()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -4,7 +4,7 @@ SQLAlchemy ORM models
 from sqlalchemy import Column, String, Integer, BigInteger, Boolean, Text, TIMESTAMP, ForeignKey, CheckConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 import uuid
 from database import Base
 
@@ -18,6 +18,7 @@ class Document(Base):
     original_filename = Column(String(500), nullable=False)
     file_path = Column(Text, nullable=False)
     file_size_bytes = Column(BigInteger, nullable=False)
+    content_hash = Column(String(64))  # SHA-256 of the file (indexed in schema.sql)
     mime_type = Column(String(100))
     
     # Document classification
@@ -35,7 +36,7 @@ class Document(Base):
     
     # Extracted metadata
     doc_metadata = Column(JSONB)
-    full_text = Column(Text)
+    full_text = deferred(Column(Text))  # Loaded only when accessed
     
     # Error tracking
     error_message = Column(Text)
@@ -144,6 +145,14 @@ class ProcessingJob(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     job_type = Column(String(50), nullable=False)
     status = Column(String(50), nullable=False, default="queued", server_default="queued")
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"))
+    
+    # Queue / lease
+    retry_count = Column(Integer, default=0, server_default="0")
+    max_retries = Column(Integer, default=3, server_default="3")
+    run_after = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    locked_by = Column(String(200))
+    lease_expires_at = Column(TIMESTAMP(timezone=True))
     
     # Job details
     input_data = Column(JSONB)
@@ -2,10 +2,21 @@
 AI Extraction Service - uses LLM to extract structured data from documents
 """
 import json
-from typing import Dict, Any, Optional, Tuple
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from config import settings
 import time
-from services.llm_client import llm_client
+from services.llm_client import llm_client, is_json_mode_rejection
+from services.extraction_cache import ExtractionCache, extraction_cache_key
+from services.template_registry import CompiledTemplate, template_registry
+from services.llm_json import parse_json_response
+
+
+# Confidence assumed when a section result does not report one
+DEFAULT_CONFIDENCE = 0.5
+
+_WHITESPACE = re.compile(r'\s+')
 
 
 class AIExtractor:
@@ -13,8 +24,16 @@ class AIExtractor:
     
     def __init__(self):
         self.client = llm_client
+        self.templates = template_registry
         self.temperature = settings.llm_temperature
         self.max_tokens = settings.max_tokens
+        self.json_mode = settings.llm_json_mode
+        self.section_chars = settings.extraction_section_chars
+        self.max_sections = settings.extraction_max_sections
+        self.concurrency = settings.extraction_concurrency
+        self.batch_size = settings.extraction_batch_size
+        self.batch_chars = settings.extraction_batch_chars
+        self.cache = ExtractionCache() if settings.enable_extraction_cache else None
     
     def extract_metadata(
         self,
@@ -34,103 +53,284 @@ class AIExtractor:
             Tuple of (extracted_metadata, error_message)
         """
         try:
-            # Get extraction schema
-            schema = custom_schema or self._get_default_schema(document_type)
-            
-            # Build prompts
-            system_prompt = self._build_system_prompt(schema)
-            user_prompt = self._build_user_prompt(text, schema)
+            # Get compiled extraction template
+            template = self._template(document_type, custom_schema)
             
-            # Call LLM with retry logic
-            response = self._call_llm_with_retry(system_prompt, user_prompt)
-            
-            # Parse JSON response
-            metadata = self._parse_llm_response(response)
+            # Call LLM with retry logic and parse the JSON response (or reuse a cached result)
+            metadata = self._complete_json(template.system_prompt, template.user_prompt(text), template.schema)
             
             # Validate against schema
-            validated_metadata = self._validate_metadata(metadata, schema)
+            validated_metadata = template.validate(metadata)
             
             return validated_metadata, None
             
         except Exception as e:
             return {}, f"Extraction error: {str(e)}"
     
-    def _get_default_schema(self, document_type: str) -> Dict:
-        """Get default extraction schema for document type"""
-        
-        base_fields = [
-            {"name": "title", "type": "string", "description": "Document title"},
-            {"name": "date", "type": "string", "description": "Document date (ISO format)"},
-            {"name": "summary", "type": "string", "description": "Brief summary (max 200 chars)"},
-        ]
-        
-        if document_type == "contract":
-            return {
-                "fields": base_fields + [
-                    {"name": "parties", "type": "array", "description": "List of contracting parties"},
-                    {"name": "contract_amounts", "type": "array", "description": "Contract amounts with currency"},
-                    {"name": "effective_date", "type": "string", "description": "Contract effective date"},
-                    {"name": "expiry_date", "type": "string", "description": "Contract expiry date"},
-                    {"name": "key_terms", "type": "array", "description": "Key contract terms"},
-                ]
-            }
-        elif document_type == "sop":
-            return {
-                "fields": base_fields + [
-                    {"name": "department", "type": "string", "description": "Responsible department"},
-                    {"name": "version", "type": "string", "description": "SOP version number"},
-                    {"name": "approval_date", "type": "string", "description": "Approval date"},
-                    {"name": "sections", "type": "array", "description": "Main section titles"},
-                    {"name": "procedures", "type": "array", "description": "Key procedures"},
-                ]
-            }
-        elif document_type == "official_document":
-            return {
-                "fields": base_fields + [
-                    {"name": "document_number", "type": "string", "description": "Official document number"},
-                    {"name": "sender", "type": "string", "description": "Sender organization/person"},
-                    {"name": "recipient", "type": "string", "description": "Recipient organization/person"},
-                    {"name": "subject", "type": "string", "description": "Document subject"},
-                    {"name": "action_required", "type": "string", "description": "Required action if any"},
-                ]
-            }
-        else:
-            return {"fields": base_fields}
-    
-    def _build_system_prompt(self, schema: Dict) -> str:
-        """Build system prompt for extraction"""
-        return f"""You are a precise document metadata extractor. 
-Extract information from documents according to the provided schema.
-Output ONLY valid JSON matching the schema. Do not include explanations or markdown.
-
-Schema:
-{json.dumps(schema, indent=2)}
-
-Rules:
-1. Extract only information explicitly stated in the document
-2. Use null for missing fields
-3. Format dates as ISO 8601 (YYYY-MM-DD)
-4. Be concise and accurate
-5. Output must be valid JSON"""
-    
-    def _build_user_prompt(self, text: str, schema: Dict) -> str:
-        """Build user prompt with document text"""
-        # Truncate text if too long
-        max_length = 8000  # Leave room for schema and response
-        if len(text) > max_length:
-            text = text[:max_length] + "\n...[truncated]"
-        
-        field_names = [f["name"] for f in schema["fields"]]
-        
-        return f"""Extract the following fields from this document:
-{', '.join(field_names)}
-
-Document text:
----
-{text}
----
-
-Output JSON:"""
+    def extract_metadata_from_chunks(
+        self,
+        chunks: List[Dict[str, Any]],
+        document_type: str = "general",
+        custom_schema: Optional[Dict] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Map-reduce extraction over a document's ingest chunks
+        
+        Consecutive chunks are grouped into sections that fit one prompt,
+        every section is extracted in parallel (at most
+        extraction_concurrency calls at a time), and the partial results are
+        merged per field type: arrays are unioned and de-duplicated, other
+        fields take the value reported with the highest confidence.
+        
+        Returns:
+            Tuple of (extracted_metadata, error_message)
+        """
+        return self.extract_metadata_from_sections(self.build_sections(chunks), document_type, custom_schema)
+    
+    def extract_metadata_from_sections(
+        self,
+        sections: List[str],
+        document_type: str = "general",
+        custom_schema: Optional[Dict] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Map-reduce extraction over sections already grouped (build_sections / section_plan)"""
+        if len(sections) <= 1:
+            return self.extract_metadata("".join(sections), document_type, custom_schema)
+        
+        try:
+            template = self._template(document_type, custom_schema)
+            
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(sections))) as pool:
+                results = list(pool.map(
+                    lambda item: self._extract_section(template, item[1], item[0], len(sections)),
+                    enumerate(sections)
+                ))
+            
+            partials = [result for result in results if result is not None]
+            if not partials:
+                return {}, f"Extraction error: all {len(sections)} sections failed"
+            
+            return self._merge_partials(partials, template), None
+            
+        except Exception as e:
+            return {}, f"Extraction error: {str(e)}"
+    
+    def extract_metadata_batch(
+        self,
+        texts: List[str],
+        document_type: str = "general",
+        custom_schema: Optional[Dict] = None
+    ) -> List[Tuple[Dict[str, Any], Optional[str]]]:
+        """
+        Extract metadata for several documents of the same type
+        
+        Each document is first looked up in the extraction cache under the
+        key extract_metadata would use. Uncached documents of at most
+        batch_chars characters are packed, up to batch_size at a time, into
+        one prompt asking for a JSON object per document; each output is
+        validated (and cached) on its own. Longer documents, and documents a
+        batch response left out, are extracted individually.
+        
+        Returns:
+            (extracted_metadata, error_message) per text, in input order
+        """
+        try:
+            template = self._template(document_type, custom_schema)
+        except Exception as e:
+            return [({}, f"Extraction error: {str(e)}")] * len(texts)
+        
+        results: List[Optional[Tuple[Dict[str, Any], Optional[str]]]] = [None] * len(texts)
+        
+        packable = []
+        for i, text in enumerate(texts):
+            key = self._cache_key(template.system_prompt, template.user_prompt(text), template.schema)
+            cached = self._cached(key)
+            if cached is not None:
+                results[i] = (template.validate(cached), None)
+            elif len(text) <= self.batch_chars:
+                packable.append((i, key))
+        
+        batches, batch, batch_chars = [], [], 0
+        for i, key in packable:
+            if batch and (len(batch) >= self.batch_size or batch_chars + len(texts[i]) > self.batch_chars):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append((i, key))
+            batch_chars += len(texts[i])
+        if batch:
+            batches.append(batch)
+        
+        batches = [batch for batch in batches if len(batch) > 1]
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                list(pool.map(lambda batch: self._extract_batch(batch, texts, template, results), batches))
+        
+        # Long documents, single-document batches and anything a batch missed
+        for i, text in enumerate(texts):
+            if results[i] is None:
+                results[i] = self.extract_metadata(text, document_type, custom_schema)
+        
+        return results
+    
+    def _extract_batch(
+        self,
+        batch: List[Tuple[int, Optional[str]]],
+        texts: List[str],
+        template: CompiledTemplate,
+        results: List[Optional[Tuple[Dict[str, Any], Optional[str]]]]
+    ) -> None:
+        """One packed prompt; fills results for the documents it returned"""
+        try:
+            response = self._call_llm_with_retry(
+                template.batch_system_prompt,
+                template.batch_prompt([texts[i] for i, _ in batch])
+            )
+            output = self._parse_llm_response(response)
+        except Exception as e:
+            print(f"⚠️ Batch extraction of {len(batch)} documents failed: {e}")
+            return
+        
+        documents = output.get("documents") if isinstance(output, dict) else output
+        by_id = {}
+        for item in documents if isinstance(documents, list) else []:
+            if isinstance(item, dict):
+                by_id[str(item.pop("document_id", None))] = item
+        
+        for number, (i, key) in enumerate(batch, start=1):
+            metadata = by_id.get(str(number))
+            if metadata is None:
+                continue
+            if key and metadata:
+                self.cache.put(key, metadata)
+            results[i] = (template.validate(metadata), None)
+    
+    def build_sections(self, chunks: List[Dict[str, Any]]) -> List[str]:
+        """
+        Group consecutive chunk texts into sections of at most section_chars
+        characters; beyond max_sections, sections are sampled evenly
+        """
+        texts = [chunk['chunk_text'] for chunk in chunks]
+        return ["\n".join(texts[start:end]) for start, end in self.section_plan(len(text) for text in texts)]
+    
+    def section_plan(self, lengths: Iterable[int]) -> List[Tuple[int, int]]:
+        """
+        The sections build_sections keeps, as (start, end) chunk positions,
+        from the chunk text lengths alone (so stored chunks can be read
+        section by section)
+        """
+        bounds: List[Tuple[int, int]] = []
+        start = size = 0
+        
+        for i, length in enumerate(lengths):
+            if i > start and size + length + 1 > self.section_chars:
+                bounds.append((start, i))
+                start, size = i, 0
+            size += length + 1
+            end = i + 1
+        
+        if size:
+            bounds.append((start, end))
+        
+        if self.max_sections and len(bounds) > self.max_sections:
+            last = len(bounds) - 1
+            keep = sorted({round(i * last / (self.max_sections - 1)) for i in range(self.max_sections)}) \
+                if self.max_sections > 1 else [0]
+            bounds = [bounds[i] for i in keep]
+        
+        return bounds
+    
+    def _extract_section(
+        self,
+        template: CompiledTemplate,
+        text: str,
+        index: int,
+        total: int
+    ) -> Optional[Tuple[Dict[str, Any], Dict[str, float]]]:
+        """Map step: (metadata, confidence per field) for one section, None if it failed"""
+        try:
+            metadata = self._complete_json(
+                template.section_system_prompt, template.section_prompt(text, index, total), template.schema
+            )
+        except Exception as e:
+            print(f"⚠️ Extraction of section {index + 1}/{total} failed: {e}")
+            return None
+        
+        confidence = metadata.pop("_confidence", None)
+        if not isinstance(confidence, dict):
+            confidence = {}
+        
+        return template.validate(metadata), confidence
+    
+    def _merge_partials(
+        self,
+        partials: List[Tuple[Dict[str, Any], Dict[str, float]]],
+        template: CompiledTemplate
+    ) -> Dict[str, Any]:
+        """Reduce step: combine section results field by field"""
+        merged = {}
+        
+        for field in template.fields:
+            field_name = field["name"]
+            
+            if field.get("type") == "array":
+                seen = set()
+                values = []
+                for metadata, _ in partials:
+                    for item in metadata.get(field_name) or []:
+                        key = _dedupe_key(item)
+                        if key not in seen:
+                            seen.add(key)
+                            values.append(item)
+                merged[field_name] = values or None
+                continue
+            
+            # Highest confidence wins; earlier sections win ties
+            best, best_confidence = None, -1.0
+            for metadata, confidence in partials:
+                value = metadata.get(field_name)
+                if value is None or value == "":
+                    continue
+                score = _confidence(confidence.get(field_name))
+                if score > best_confidence:
+                    best, best_confidence = value, score
+            merged[field_name] = best
+        
+        return merged
+    
+    def _template(self, document_type: str, custom_schema: Optional[Dict]) -> CompiledTemplate:
+        """Registered template for the document type, or one compiled from custom_schema"""
+        if custom_schema:
+            return self.templates.compile(custom_schema)
+        return self.templates.get(document_type)
+    
+    def _complete_json(self, system_prompt: str, user_prompt: str, schema: Dict) -> Dict:
+        """LLM call + JSON parse, served from the extraction cache when possible"""
+        key = self._cache_key(system_prompt, user_prompt, schema)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        
+        metadata = self._parse_llm_response(self._call_llm_with_retry(system_prompt, user_prompt))
+        if not isinstance(metadata, dict):
+            # e.g. a bare array: never cached, so a retry asks the model again
+            raise ValueError(f"Expected a JSON object from the LLM, got {type(metadata).__name__}")
+        
+        # An empty object is not worth keeping (a retry may do better)
+        if key and metadata:
+            self.cache.put(key, metadata)
+        return metadata
+    
+    def _cached(self, key: Optional[str]) -> Optional[Dict]:
+        """Cached extraction for key; entries that are not a non-empty object count as misses"""
+        if not key:
+            return None
+        cached = self.cache.get(key)
+        return cached if isinstance(cached, dict) and cached else None
+    
+    def _cache_key(self, system_prompt: str, user_prompt: str, schema: Dict) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return extraction_cache_key(self.client.chat_model_id, schema, system_prompt + "\0" + user_prompt)
     
     def _call_llm_with_retry(
         self,
@@ -139,8 +339,10 @@ Output JSON:"""
         max_retries: int = 3
     ) -> str:
         """Call LLM with exponential backoff retry"""
+        json_mode = self.json_mode
+        attempt = 0
         
-        for attempt in range(max_retries):
+        while True:
             try:
                 messages = [
                     {"role": "system", "content": system_prompt},
@@ -150,64 +352,41 @@ Output JSON:"""
                 response = self.client.chat_completion(
                     messages=messages,
                     temperature=self.temperature,
-                    max_tokens=self.max_tokens
+                    max_tokens=self.max_tokens,
+                    json_mode=json_mode
                 )
                 
                 return response
                 
             except Exception as e:
-                if attempt == max_retries - 1:
+                if json_mode and is_json_mode_rejection(e):
+                    # The model does not support JSON mode: retry at once with a plain request
+                    json_mode = False
+                    continue
+                
+                attempt += 1
+                if attempt == max_retries:
                     raise
                 
                 # Exponential backoff
-                wait_time = 2 ** attempt
+                wait_time = 2 ** (attempt - 1)
                 time.sleep(wait_time)
     
     def _parse_llm_response(self, response: str) -> Dict:
-        """Parse and validate JSON response from LLM"""
-        try:
-            # Try to parse as JSON
-            metadata = json.loads(response)
-            return metadata
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks
-            import re
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(1))
-            
-            # Try to find JSON object
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(0))
-            
-            raise ValueError("Could not parse JSON from LLM response")
-    
-    def _validate_metadata(self, metadata: Dict, schema: Dict) -> Dict:
-        """Validate and clean extracted metadata"""
-        validated = {}
-        
-        for field in schema["fields"]:
-            field_name = field["name"]
-            field_type = field["type"]
-            
-            value = metadata.get(field_name)
-            
-            # Type validation
-            if value is not None:
-                if field_type == "string" and not isinstance(value, str):
-                    value = str(value)
-                elif field_type == "array" and not isinstance(value, list):
-                    value = [value] if value else []
-                elif field_type == "number" and not isinstance(value, (int, float)):
-                    try:
-                        value = float(value)
-                    except:
-                        value = None
-            
-            validated[field_name] = value
-        
-        return validated
+        """Parse JSON response from LLM (the first complete object)"""
+        return parse_json_response(response)
+
+
+def _confidence(value: Any) -> float:
+    """A reported confidence as a float in [0, 1]"""
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return DEFAULT_CONFIDENCE
 
 
-from typing import Tuple
+def _dedupe_key(item: Any) -> str:
+    """Identity of an array item for de-duplication (case and spacing insensitive for strings)"""
+    if isinstance(item, str):
+        return _WHITESPACE.sub(" ", item).strip().casefold()
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,229 @@
+"""
+Answer Cache - exact and semantic caching of RAG answers
+"""
+from typing import Callable, List, Dict, Any, Optional, Set
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import threading
+import time
+import numpy as np
+from config import settings
+from services.embedding_cache import normalize_text
+
+
+def query_key(query_text: str, filters: Optional[Dict], top_k: int) -> str:
+    """Identity of a query: normalized text + filters + top_k"""
+    raw = normalize_text(query_text).lower() + "\0" + _scope(filters, top_k)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _scope(filters: Optional[Dict], top_k: int) -> str:
+    return json.dumps([filters or {}, top_k], sort_keys=True, ensure_ascii=False)
+
+
+# is_current(document_ids, created_at): False if a source document changed since created_at
+IsCurrent = Callable[[Set[str], float], bool]
+
+
+class _Entry:
+    __slots__ = ("result", "embedding", "scope", "document_ids", "created_at", "expires_at")
+
+    def __init__(self, result, embedding, scope, document_ids, created_at, expires_at):
+        self.result = result
+        self.embedding = embedding
+        self.scope = scope
+        self.document_ids = document_ids
+        self.created_at = created_at
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """
+    Two-level answer cache for RAGEngine.query
+
+    Level 1 is an exact key of normalized query text + filters + top_k.
+    Level 2 compares the query embedding against cached queries with the
+    same filters and top_k and reuses an answer above a similarity threshold.
+    Entries expire after a TTL, are evicted LRU, and are dropped when any
+    document that contributed a source is deleted or re-indexed: directly
+    through invalidate_document, or on lookup when the caller's is_current
+    check finds a document changed after the entry was built (re-indexing
+    runs in worker processes, which cannot reach this cache).
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = None,
+        max_entries: int = None,
+        similarity_threshold: float = None
+    ):
+        self.ttl_seconds = ttl_seconds or settings.cache_ttl_seconds
+        self.max_entries = max_entries or settings.answer_cache_max_entries
+        self.similarity_threshold = similarity_threshold or settings.answer_cache_similarity_threshold
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_document: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def get_exact(
+        self,
+        query_text: str,
+        filters: Optional[Dict],
+        top_k: int,
+        is_current: Optional[IsCurrent] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Level 1: normalized query text + filters + top_k"""
+        key = query_key(query_text, filters, top_k)
+        with self._lock:
+            entry = self._live(key)
+        if entry is None or not self._current(key, entry, is_current):
+            return None
+
+        with self._lock:
+            self.exact_hits += 1
+        return copy.deepcopy(entry.result)
+
+    def get_similar(
+        self,
+        query_embedding: List[float],
+        filters: Optional[Dict],
+        top_k: int,
+        is_current: Optional[IsCurrent] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Level 2: most similar cached query with the same filters and top_k"""
+        scope = _scope(filters, top_k)
+        query = _unit(query_embedding)
+
+        with self._lock:
+            now = time.time()
+            keys, vectors = [], []
+            for key, entry in self._entries.items():
+                if entry.scope == scope and entry.expires_at > now and entry.embedding is not None:
+                    keys.append(key)
+                    vectors.append(entry.embedding)
+
+            if not keys:
+                self.misses += 1
+                return None
+
+            scores = np.stack(vectors) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key = keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+
+        if not self._current(key, entry, is_current):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.semantic_hits += 1
+        return copy.deepcopy(entry.result)
+
+    def put(
+        self,
+        query_text: str,
+        filters: Optional[Dict],
+        top_k: int,
+        query_embedding: Optional[List[float]],
+        result: Dict[str, Any],
+        document_ids: List[str],
+        created_at: float = None
+    ) -> None:
+        """
+        Cache an answer, remembering which documents it was built from
+
+        created_at is when its retrieval started (default: now); a document
+        processed after that makes the entry stale.
+        """
+        key = query_key(query_text, filters, top_k)
+        now = time.time()
+        entry = _Entry(
+            result=copy.deepcopy(result),
+            embedding=_unit(query_embedding) if query_embedding is not None else None,
+            scope=_scope(filters, top_k),
+            document_ids=set(str(doc_id) for doc_id in document_ids),
+            created_at=created_at or now,
+            expires_at=now + self.ttl_seconds
+        )
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            for doc_id in entry.document_ids:
+                self._by_document.setdefault(doc_id, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_document(self, document_id: str) -> int:
+        """Drop every cached answer that used a chunk of this document"""
+        with self._lock:
+            keys = list(self._by_document.get(str(document_id), ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_document.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+        }
+
+    def _live(self, key: str) -> Optional[_Entry]:
+        """Entry for key if present and not expired (caller holds the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _current(self, key: str, entry: _Entry, is_current: Optional[IsCurrent]) -> bool:
+        """Run is_current outside the lock; a stale entry is dropped"""
+        if is_current is None or is_current(entry.document_ids, entry.created_at):
+            return True
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._remove(key)
+        return False
+
+    def _remove(self, key: str) -> None:
+        """Remove an entry and its document index links (caller holds the lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for doc_id in entry.document_ids:
+            keys = self._by_document.get(doc_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_document[doc_id]
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    """float32 unit vector, so a dot product is the cosine similarity"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
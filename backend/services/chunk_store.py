@@ -0,0 +1,128 @@
+"""
+Chunk Store - bulk persistence of chunk rows in the caller's transaction
+"""
+from typing import Any, Dict, List
+import csv
+import io
+import json
+import uuid
+from sqlalchemy import delete, insert, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+from config import settings
+from models import Chunk
+
+
+CHUNK_COLUMNS = ("id", "document_id", "chunk_index", "chunk_text", "chunk_metadata")
+
+
+def _supports_copy(db: Session) -> bool:
+    """COPY needs PostgreSQL through psycopg2 (cursor.copy_expert)"""
+    bind = db.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+class ChunkStore:
+    """
+    Write a document's chunk rows in bulk
+
+    PostgreSQL + psycopg2 uses COPY FROM STDIN; other databases fall back to
+    a single executemany INSERT. Both run on the session's connection, so
+    the rows only become visible when the session commits.
+    """
+
+    def __init__(self, method: str = None):
+        method = method or settings.chunk_insert_method
+        if method not in ("auto", "copy", "executemany"):
+            raise ValueError(f"Unknown chunk insert method: {method}")
+        self.method = method
+        # pgvector: the vector store writes the rows, with their embeddings
+        self.rows_in_vector_store = settings.vector_db_type == "pgvector"
+
+    def insert_chunks(self, db: Session, document_id: Any, chunks: List[Dict[str, Any]]) -> int:
+        """
+        Insert chunk rows (not committed)
+
+        Returns:
+            Number of rows written
+        """
+        if not chunks:
+            return 0
+
+        doc_uuid = document_id if isinstance(document_id, uuid.UUID) else uuid.UUID(str(document_id))
+        method = self.method
+        if method == "auto":
+            method = "copy" if _supports_copy(db) else "executemany"
+
+        if method == "copy":
+            self._copy(db, doc_uuid, chunks)
+        else:
+            db.execute(insert(Chunk), [
+                {
+                    "id": uuid.uuid4(),
+                    "document_id": doc_uuid,
+                    "chunk_index": chunk['chunk_index'],
+                    "chunk_text": chunk['chunk_text'],
+                    "chunk_metadata": chunk['metadata']
+                }
+                for chunk in chunks
+            ])
+
+        return len(chunks)
+
+    def replace_chunks(self, db: Session, document_id: Any, chunks: List[Dict[str, Any]]) -> int:
+        """Delete a document's chunk rows and insert new ones (not committed)"""
+        self.delete_chunks(db, document_id)
+        return self.append_chunks(db, document_id, chunks)
+
+    def delete_chunks(self, db: Session, document_id: Any) -> None:
+        """Delete a document's chunk rows (not committed)"""
+        if not self.rows_in_vector_store:
+            db.execute(delete(Chunk).where(Chunk.document_id == document_id))
+
+    def append_chunks(self, db: Session, document_id: Any, chunks: List[Dict[str, Any]]) -> int:
+        """
+        Insert one batch of a document's chunk rows (not committed); with
+        pgvector the vector store writes them
+
+        Returns:
+            Number of chunks in the batch
+        """
+        if self.rows_in_vector_store:
+            return len(chunks)
+        return self.insert_chunks(db, document_id, chunks)
+
+    def merge_metadata(self, db: Session, document_id: Any, values: Dict[str, Any]) -> None:
+        """Merge values into every chunk row's chunk_metadata (not committed)"""
+        db.query(Chunk).filter(Chunk.document_id == document_id).update(
+            {Chunk.chunk_metadata: Chunk.chunk_metadata.op("||")(type_coerce(values, JSONB))},
+            synchronize_session=False
+        )
+
+    def _copy(self, db: Session, doc_uuid: uuid.UUID, chunks: List[Dict[str, Any]]) -> None:
+        """COPY rows through the session's own DBAPI connection (same transaction)"""
+        buffer = io.StringIO()
+        # Quote every string so an empty string is not read as NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for chunk in chunks:
+            writer.writerow((
+                str(uuid.uuid4()),
+                str(doc_uuid),
+                chunk['chunk_index'],
+                chunk['chunk_text'],
+                json.dumps(chunk['metadata'], ensure_ascii=False)
+            ))
+        buffer.seek(0)
+
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {Chunk.__tablename__} ({', '.join(CHUNK_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+
+# Global instance
+chunk_store = ChunkStore()
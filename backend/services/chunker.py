@@ -0,0 +1,305 @@
+"""
+Text Chunker - single-pass, streaming sentence-aware chunking
+"""
+from typing import List, Dict, Any, Iterable, Iterator
+from bisect import bisect_left
+
+
+# Preferred break points, in the order they are considered
+SENTENCE_ENDINGS = ('. ', '。', '! ', '！', '? ', '？', '\n\n')
+
+# How far back from the window end to look for a sentence break
+BOUNDARY_LOOKBACK = 100
+
+# (ending, length) pairs so the hot loop does no len() calls
+_ENDINGS = tuple((ending, len(ending)) for ending in SENTENCE_ENDINGS)
+
+
+class TextChunker:
+    """
+    Split text into overlapping chunks that prefer to end on a sentence boundary.
+
+    A single forward pass: each window only inspects its last
+    BOUNDARY_LOOKBACK characters for a break, so total work is linear in the
+    input. The input may be one string or any iterable of text pieces
+    (pages, paragraphs, file reads); only about one window of text is
+    buffered at a time.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, min_chunk_size: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_chunk_size = min_chunk_size
+
+    def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict[str, Any]]:
+        """Chunk a complete string"""
+        return list(self.iter_chunks((text,), metadata))
+
+    def iter_chunks(
+        self,
+        pieces: Iterable[str],
+        metadata: Dict = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield chunk dictionaries from a stream of text pieces
+
+        Args:
+            pieces: Iterable of text fragments, concatenated in order
+            metadata: Optional metadata to attach to each chunk
+
+        Yields:
+            Chunk dictionaries with chunk_index, chunk_text and metadata
+        """
+        base_metadata = metadata or {}
+        chunk_size = self.chunk_size
+        chunk_overlap = self.chunk_overlap
+        min_chunk_size = self.min_chunk_size
+        source = iter(pieces)
+
+        buffer = ""            # text[base:base + len(buffer)]
+        base = 0               # absolute offset of buffer[0]
+        exhausted = False
+
+        def fill(target: int) -> None:
+            """Read until the buffer reaches absolute offset `target` or input ends"""
+            nonlocal buffer, exhausted
+            parts = [buffer]
+            length = base + len(buffer)
+            while length < target:
+                piece = next(source, None)
+                if piece is None:
+                    exhausted = True
+                    break
+                parts.append(piece)
+                length += len(piece)
+            if len(parts) > 1:
+                buffer = "".join(parts)
+
+        start = 0
+        chunk_index = 0
+        fill(chunk_size + 1)
+
+        while start < base + len(buffer):
+            # Window in buffer coordinates
+            lo = start - base
+            hi = lo + chunk_size
+
+            # Need one character past the window to know whether this is the last chunk
+            if not exhausted and hi >= len(buffer):
+                fill(base + hi + 1)
+
+            # If not the last chunk, try to break at sentence boundary
+            if hi < len(buffer):
+                search_start = hi - BOUNDARY_LOOKBACK
+                if search_start < lo:
+                    search_start = lo
+
+                best_break = -1
+                for ending, length in _ENDINGS:
+                    pos = buffer.rfind(ending, search_start, hi)
+                    if pos > best_break:
+                        best_break = pos + length
+
+                if best_break > lo:
+                    hi = best_break
+
+            end = base + hi
+
+            # Only add if chunk is substantial
+            chunk_text = buffer[lo:hi].strip()
+            if len(chunk_text) >= min_chunk_size:
+                yield {
+                    "chunk_index": chunk_index,
+                    "chunk_text": chunk_text,
+                    "metadata": {
+                        "chunk_index": chunk_index,
+                        "start_pos": start,
+                        "end_pos": end,
+                        **base_metadata
+                    }
+                }
+                chunk_index += 1
+
+            # Move start position with overlap
+            next_start = end - chunk_overlap
+            if next_start <= start:
+                raise ValueError(
+                    "chunk_overlap is too large for chunk_size: the window would not advance"
+                )
+            start = next_start
+
+            # Drop text the window can no longer reach; compacting only once
+            # half the buffer is stale keeps the copying linear
+            drop = start - base
+            if drop > chunk_size and drop * 2 >= len(buffer):
+                buffer = buffer[drop:]
+                base = start
+
+            if not exhausted and start >= base + len(buffer):
+                fill(start + 1)
+
+
+def _find_break(buffer: str, search_start: int, end: int) -> int:
+    """End offset of the preferred sentence break in buffer[search_start:end], or -1"""
+    best_break = -1
+    for ending, length in _ENDINGS:
+        pos = buffer.rfind(ending, search_start, end)
+        if pos > best_break:
+            best_break = pos + length
+    return best_break
+
+
+def _line_cut(text: str) -> int:
+    """
+    Offset just past the last newline that is followed by a non-space
+    character, or 0. No token of the regex tokenizer or a BPE pre-tokenizer
+    spans such a point, so text can be tokenized in pieces cut there.
+    """
+    cut = text.rfind("\n")
+    while cut >= 0 and (cut + 1 == len(text) or text[cut + 1].isspace()):
+        cut = text.rfind("\n", 0, cut)
+    return cut + 1
+
+
+class TokenChunker:
+    """
+    Token-measured variant of TextChunker: chunk_size, chunk_overlap and
+    min_chunk_size count tokens from a pluggable tokenizer rather than
+    characters. Windows still prefer to end on a sentence boundary within
+    the last BOUNDARY_LOOKBACK characters. Each chunk carries its token
+    count, which is also recorded in the shared TokenCounter so later
+    stages never re-tokenize it.
+
+    Streamed pieces are re-cut at line starts (_line_cut) before they are
+    tokenized, so a word split across two pages is counted as in the
+    joined text and iter_chunks yields the same chunks as chunk_text.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        chunk_size: int,
+        chunk_overlap: int,
+        min_chunk_size: int,
+        counter=None
+    ):
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_chunk_size = min_chunk_size
+        self.counter = counter
+
+    def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict[str, Any]]:
+        """Chunk a complete string"""
+        return list(self.iter_chunks((text,), metadata))
+
+    def iter_chunks(
+        self,
+        pieces: Iterable[str],
+        metadata: Dict = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield chunk dictionaries from a stream of text pieces
+
+        Args:
+            pieces: Iterable of text fragments, concatenated in order
+            metadata: Optional metadata to attach to each chunk
+
+        Yields:
+            Chunk dictionaries with chunk_index, chunk_text, token_count and metadata
+        """
+        base_metadata = metadata or {}
+        chunk_size = self.chunk_size
+        chunk_overlap = self.chunk_overlap
+        source = iter(pieces)
+
+        buffer = ""            # text[base:base + len(buffer)], tokenized
+        base = 0               # absolute character offset of buffer[0]
+        offsets: List[int] = []  # absolute start offset of tokens tbase, tbase + 1, ...
+        tbase = 0
+        carry = ""             # read but not yet tokenized (after the last line start)
+        exhausted = False
+
+        def fill(target: int) -> None:
+            """Tokenize input until `target` tokens are known or input ends"""
+            nonlocal buffer, carry, exhausted
+            while tbase + len(offsets) < target and not exhausted:
+                piece = next(source, None)
+                if piece is None:
+                    exhausted = True
+                    text, carry = carry, ""
+                else:
+                    text = carry + piece
+                    cut = _line_cut(text)
+                    if cut == 0:
+                        carry = text
+                        continue
+                    text, carry = text[:cut], text[cut:]
+                shift = base + len(buffer)
+                offsets.extend(shift + offset for offset in self.tokenizer.token_offsets(text))
+                buffer += text
+
+        ts = 0                 # first token of the current window
+        start = 0              # first character of the current window
+        chunk_index = 0
+        fill(chunk_size + 1)
+
+        while ts < tbase + len(offsets):
+            te = ts + chunk_size
+            fill(te + 1)
+            total = tbase + len(offsets)
+
+            if te < total:
+                end = offsets[te - tbase]
+
+                # Prefer a sentence break, as long as the window still advances
+                search_start = max(start, end - BOUNDARY_LOOKBACK)
+                best_break = _find_break(buffer, search_start - base, end - base)
+                if best_break >= 0:
+                    te_break = bisect_left(offsets, base + best_break) + tbase
+                    if te_break - chunk_overlap > ts:
+                        te = te_break
+                        end = base + best_break
+            else:
+                te = total
+                end = base + len(buffer)
+
+            chunk_text = buffer[start - base:end - base].strip()
+            token_count = te - ts
+
+            if chunk_text and token_count >= self.min_chunk_size:
+                if self.counter is not None:
+                    self.counter.remember(chunk_text, token_count)
+                yield {
+                    "chunk_index": chunk_index,
+                    "chunk_text": chunk_text,
+                    "token_count": token_count,
+                    "metadata": {
+                        "chunk_index": chunk_index,
+                        "start_pos": start,
+                        "end_pos": end,
+                        "token_count": token_count,
+                        **base_metadata
+                    }
+                }
+                chunk_index += 1
+
+            if te >= total:
+                break
+
+            # Move start position with overlap
+            next_ts = te - chunk_overlap
+            if next_ts <= ts:
+                raise ValueError(
+                    "chunk_overlap is too large for chunk_size: the window would not advance"
+                )
+            ts = next_ts
+            start = offsets[ts - tbase]
+
+            # Drop text and token offsets the window can no longer reach
+            drop = ts - tbase
+            if drop > chunk_size and drop * 2 >= len(offsets):
+                del offsets[:drop]
+                tbase = ts
+                buffer = buffer[start - base:]
+                base = start
@@ -0,0 +1,112 @@
+"""
+Document Metadata Cache - process-wide lookup of document filenames for query results
+"""
+from typing import Any, Dict, Iterable, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+import uuid
+from config import settings
+from models import Document
+
+
+class DocumentMetadataCache:
+    """
+    LRU of document_id -> {'filename', 'document_type'} shared by every request
+
+    Misses are resolved with a single `IN` query per call. Entries are
+    invalidated when a document is uploaded, replaced or deleted; that only
+    reaches this process, so entries also expire after ttl_seconds and other
+    uvicorn workers pick up a rename within that time.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.document_metadata_ttl_seconds
+        # document_id -> (metadata, expiry on the monotonic clock)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, db: Any, document_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Metadata for the given document IDs
+
+        Args:
+            db: SQLAlchemy session used for misses (None = cached entries only)
+            document_ids: Document UUID strings
+
+        Returns:
+            Dictionary of document_id -> metadata for the documents found
+        """
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+
+        now = time.monotonic()
+        with self._lock:
+            for doc_id in set(str(doc_id) for doc_id in document_ids if doc_id):
+                cached = self._entries.get(doc_id)
+                if cached is not None and cached[1] > now:
+                    self._entries.move_to_end(doc_id)
+                    found[doc_id] = cached[0]
+                else:
+                    missing.append(doc_id)
+
+        if not missing or db is None:
+            return found
+
+        uuids = []
+        for doc_id in missing:
+            try:
+                uuids.append(uuid.UUID(doc_id))
+            except ValueError:
+                continue
+
+        if not uuids:
+            return found
+
+        rows = db.query(
+            Document.id, Document.original_filename, Document.document_type
+        ).filter(Document.id.in_(uuids)).all()
+
+        with self._lock:
+            for doc_uuid, filename, document_type in rows:
+                doc_id = str(doc_uuid)
+                entry = {'filename': filename, 'document_type': document_type}
+                found[doc_id] = entry
+                self._store(doc_id, entry)
+
+        return found
+
+    def filenames(self, db: Any, document_ids: Iterable[str]) -> Dict[str, str]:
+        """Original filename for each document ID that could be resolved"""
+        return {
+            doc_id: entry['filename']
+            for doc_id, entry in self.get_many(db, document_ids).items()
+        }
+
+    def put(self, document: Document) -> None:
+        """Cache a document's metadata (e.g. right after it was created)"""
+        with self._lock:
+            self._store(str(document.id), {
+                'filename': document.original_filename,
+                'document_type': document.document_type
+            })
+
+    def invalidate(self, document_id: Optional[str] = None) -> None:
+        """Forget one document, or everything when no ID is given"""
+        with self._lock:
+            if document_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(document_id), None)
+
+    def _store(self, doc_id: str, entry: Dict[str, Any]) -> None:
+        """Insert an entry and evict LRU overflow (caller holds the lock)"""
+        self._entries[doc_id] = (entry, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(doc_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Global instance
+document_metadata_cache = DocumentMetadataCache()
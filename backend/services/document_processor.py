@@ -2,12 +2,141 @@
 Document processing service - handles file parsing and text extraction
 """
 import os
+import re
 import mimetypes
-from typing import Tuple, Optional
+import multiprocessing
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple, Optional, Iterator, List, NamedTuple, Dict
 from pathlib import Path
 import PyPDF2
 import docx
 from config import settings
+from services.parsed_text_cache import ParsedTextCache, file_sha256
+
+
+# Bump whenever extraction or cleaning output changes (invalidates the parsed text cache)
+PARSER_VERSION = "2"
+
+
+# Set by worker.py for its worker processes (each gets a share of the CPU cores)
+WORKER_PROCESSES_ENV = "INGEST_WORKER_PROCESSES"
+
+
+def default_pdf_workers() -> int:
+    """PDF extraction pool size when PDF_EXTRACTION_WORKERS is 0: the cores divided among worker processes"""
+    processes = int(os.environ.get(WORKER_PROCESSES_ENV) or 1)
+    return max(1, (os.cpu_count() or 1) // max(1, processes))
+
+
+# Two or more spaces (a single space needs no replacing)
+_MULTIPLE_SPACES = re.compile(r' {2,}')
+
+
+def clean_text(text: str) -> str:
+    """
+    Strip every line, drop empty lines and collapse runs of spaces
+    
+    Stripped lines never start or end with a space, so the space pass can
+    run on the joined text and only touches actual runs.
+    """
+    cleaned = '\n'.join(filter(None, [line.strip() for line in text.split('\n')]))
+    if '  ' in cleaned:
+        cleaned = _MULTIPLE_SPACES.sub(' ', cleaned)
+    return cleaned
+
+
+class DocumentTypeClassifier:
+    """
+    Classify documents by keyword matches counted in a single scan
+    
+    All keywords of all types are compiled into one alternation (longest
+    first) matched against the lowercased text, so a text is scanned once
+    however many keywords there are. Counts can be accumulated segment by segment:
+    keywords never span lines, so the sum over a document's segments equals
+    the count for the whole text.
+    """
+    
+    def __init__(self, keywords: Dict[str, List[str]] = None, strategy: str = None):
+        self.keywords = keywords or settings.document_type_keywords
+        self.strategy = strategy or settings.document_type_strategy
+        if self.strategy not in ("weighted", "first_match"):
+            raise ValueError(f"Unknown document type strategy: {self.strategy}")
+        
+        self.types = list(self.keywords)
+        self._types_by_keyword: Dict[str, List[str]] = {}
+        for doc_type, type_keywords in self.keywords.items():
+            for keyword in type_keywords:
+                types = self._types_by_keyword.setdefault(keyword.lower(), [])
+                if doc_type not in types:
+                    types.append(doc_type)
+        
+        alternation = sorted(self._types_by_keyword, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(map(re.escape, alternation))) if alternation else None
+    
+    def count(self, text: str) -> Counter:
+        """Keyword matches per document type"""
+        counts = Counter()
+        if self._pattern is None:
+            return counts
+        
+        for keyword, hits in Counter(self._pattern.findall(text.lower())).items():
+            for doc_type in self._types_by_keyword.get(keyword, ()):
+                counts[doc_type] += hits
+        
+        return counts
+    
+    def classify(self, counts: Counter, filename: str = "") -> str:
+        """
+        Pick the document type from keyword counts, falling back to the
+        filename (contract, sop, report) and then 'other'
+        """
+        matched = [doc_type for doc_type in self.types if counts.get(doc_type)]
+        if matched:
+            if self.strategy == "first_match":
+                return matched[0]
+            # max keeps the first (highest priority) type on ties
+            return max(matched, key=lambda doc_type: counts[doc_type])
+        
+        # Fallback to filename
+        filename_lower = filename.lower()
+        for doc_type in ['contract', 'sop', 'report']:
+            if doc_type in filename_lower:
+                return doc_type
+        
+        return 'other'
+
+
+class TextSegment(NamedTuple):
+    """A cleaned piece of a document and where it sits in the cleaned full text"""
+    text: str             # Cleaned text, including the '\n' separating it from the previous segment
+    start: int            # Offset of text in the full text
+    end: int              # start + len(text)
+    page: Optional[int]   # 1-based PDF page number (None for DOCX / TXT)
+    type_counts: Counter  # Document type keyword matches in text
+
+
+# Page ranges per pool process, so a slow range does not hold up the others
+_RANGES_PER_WORKER = 4
+
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) in a pool process; returns (page_number, text) pairs"""
+    pages = []
+    
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        
+        for page_num in range(start, end):
+            try:
+                page_text = pdf_reader.pages[page_num].extract_text()
+                if page_text:
+                    pages.append((page_num + 1, page_text))
+            except Exception as e:
+                print(f"Warning: Failed to extract page {page_num}: {e}")
+    
+    return pages
 
 
 class DocumentProcessor:
@@ -15,13 +144,20 @@ class DocumentProcessor:
     
     def __init__(self):
         self.supported_formats = settings.allowed_extensions
+        self.pdf_workers = settings.pdf_extraction_workers or default_pdf_workers()
+        self.pdf_parallel_min_pages = settings.pdf_parallel_min_pages
+        self._pdf_pool: Optional[ProcessPoolExecutor] = None
+        self._pdf_pool_lock = threading.Lock()
+        self.type_classifier = DocumentTypeClassifier()
+        self.text_cache = ParsedTextCache() if settings.enable_parsed_text_cache else None
     
-    def process_file(self, file_path: str) -> Tuple[str, str, Optional[str]]:
+    def process_file(self, file_path: str, content_hash: str = None) -> Tuple[str, str, Optional[str]]:
         """
         Process a file and extract text content
         
         Args:
             file_path: Path to the file
+            content_hash: SHA-256 of the file, if known (parsed text cache key)
             
         Returns:
             Tuple of (full_text, mime_type, error_message)
@@ -36,18 +172,8 @@ class DocumentProcessor:
             if ext not in self.supported_formats:
                 return "", mime_type, f"Unsupported file format: {ext}"
             
-            # Route to appropriate parser
-            if ext == 'pdf':
-                text = self._extract_from_pdf(file_path)
-            elif ext in ['docx', 'doc']:
-                text = self._extract_from_docx(file_path)
-            elif ext == 'txt':
-                text = self._extract_from_txt(file_path)
-            else:
-                return "", mime_type, f"No parser available for: {ext}"
-            
-            # Clean and validate text
-            text = self._clean_text(text)
+            # Parse and clean segment by segment (one copy of the text)
+            text = "".join(self.iter_clean_text(file_path, content_hash))
             
             if not text or len(text.strip()) < 10:
                 return "", mime_type, "Extracted text is too short or empty"
@@ -57,42 +183,146 @@ class DocumentProcessor:
         except Exception as e:
             return "", None, f"Error processing file: {str(e)}"
     
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        text_parts = []
+    def iter_segments(self, file_path: str, content_hash: str = None) -> Iterator[TextSegment]:
+        """
+        Yield cleaned segments with their offsets and document type keyword
+        counts as each page or paragraph is extracted. Only one raw segment
+        is held at a time; the segment texts concatenated equal the text
+        returned by process_file.
         
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
+        Raises:
+            ValueError: If the format is not supported
+        """
+        offset = 0
+        
+        for page, piece in self._iter_cleaned(file_path, content_hash):
+            type_counts = self.type_classifier.count(piece)
+            if offset:
+                piece = '\n' + piece
             
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(page_text)
-                except Exception as e:
-                    print(f"Warning: Failed to extract page {page_num}: {e}")
-                    continue
-        
-        return "\n\n".join(text_parts)
-    
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
+            yield TextSegment(piece, offset, offset + len(piece), page, type_counts)
+            offset += len(piece)
+    
+    def iter_clean_text(self, file_path: str, content_hash: str = None) -> Iterator[str]:
+        """
+        Yield cleaned text as each segment is extracted; the concatenated
+        pieces equal the text returned by process_file
+        """
+        for segment in self.iter_segments(file_path, content_hash):
+            yield segment.text
+    
+    def _iter_cleaned(self, file_path: str, content_hash: str = None) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Non-empty cleaned (page_number, text) pieces: replayed from the parsed
+        text cache, or parsed and stored on the way through
+        """
+        ext = Path(file_path).suffix.lower().lstrip('.')
+        if ext not in self.supported_formats:
+            raise ValueError(f"Unsupported file format: {ext}")
+        
+        if self.text_cache is None:
+            return self._parse(file_path)
+        
+        key = ParsedTextCache.key(content_hash or file_sha256(file_path), PARSER_VERSION)
+        cached = self.text_cache.get(key)
+        if cached is not None:
+            return cached
+        return self.text_cache.put_through(key, self._parse(file_path))
+    
+    def _parse(self, file_path: str) -> Iterator[Tuple[Optional[int], str]]:
+        """Run the parser and cleaner: non-empty cleaned (page_number, text) pieces"""
+        for page, raw in self._iter_raw_segments(file_path):
+            piece = clean_text(raw)
+            if piece:
+                yield page, piece
+    
+    def _iter_raw_segments(self, file_path: str) -> Iterator[Tuple[Optional[int], str]]:
+        """Yield (page_number, raw_text) per PDF page, DOCX part or TXT file"""
+        ext = Path(file_path).suffix.lower().lstrip('.')
+        
+        if ext not in self.supported_formats:
+            raise ValueError(f"Unsupported file format: {ext}")
+        
+        if ext == 'pdf':
+            yield from self.iter_pdf_pages(file_path)
+        elif ext in ['docx', 'doc']:
+            for part in self._iter_docx_parts(file_path):
+                yield None, part
+        elif ext == 'txt':
+            yield None, self._extract_from_txt(file_path)
+        else:
+            raise ValueError(f"No parser available for: {ext}")
+    
+    def iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page_number, text) for each PDF page with text, in page order
+        
+        Documents with at least pdf_parallel_min_pages pages are split into
+        contiguous page ranges extracted in a process pool; ranges are
+        yielded in order as soon as each one (and all before it) is done.
+        Only a bounded window of ranges is in flight at a time.
+        """
+        with open(file_path, 'rb') as file:
+            page_count = len(PyPDF2.PdfReader(file).pages)
+        
+        if self.pdf_workers <= 1 or page_count < self.pdf_parallel_min_pages:
+            yield from _extract_pdf_range(file_path, 0, page_count)
+            return
+        
+        range_size = -(-page_count // (self.pdf_workers * _RANGES_PER_WORKER))
+        ranges = iter(range(0, page_count, range_size))
+        pool = self._get_pdf_pool()
+        
+        # At most two ranges per process in flight, so a slow consumer does
+        # not pile up the text of the whole document
+        pending = deque()
+        
+        def submit_next() -> None:
+            start = next(ranges, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_pdf_range, file_path, start, min(start + range_size, page_count)))
+        
+        for _ in range(self.pdf_workers * 2):
+            submit_next()
+        
+        try:
+            while pending:
+                pages = pending.popleft().result()
+                submit_next()
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def extract_pdf_pages(self, file_path: str) -> List[Tuple[int, str]]:
+        """Per-page PDF text as (page_number, text) pairs"""
+        return list(self.iter_pdf_pages(file_path))
+    
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        """Create the extraction pool on first use (spawn: safe from threaded callers)"""
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                self._pdf_pool = ProcessPoolExecutor(
+                    max_workers=self.pdf_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pdf_pool
+    
+    def _iter_docx_parts(self, file_path: str) -> Iterator[str]:
+        """Yield DOCX paragraphs, then table rows"""
         doc = docx.Document(file_path)
-        text_parts = []
         
         # Extract from paragraphs
         for para in doc.paragraphs:
             if para.text.strip():
-                text_parts.append(para.text)
+                yield para.text
         
         # Extract from tables
         for table in doc.tables:
             for row in table.rows:
                 row_text = " | ".join(cell.text.strip() for cell in row.cells)
                 if row_text.strip():
-                    text_parts.append(row_text)
-        
-        return "\n\n".join(text_parts)
+                    yield row_text
     
     def _extract_from_txt(self, file_path: str) -> str:
         """Extract text from TXT file"""
@@ -107,21 +337,6 @@ class DocumentProcessor:
         
         raise ValueError("Unable to decode text file with common encodings")
     
-    def _clean_text(self, text: str) -> str:
-        """Clean and normalize extracted text"""
-        # Remove excessive whitespace
-        lines = [line.strip() for line in text.split('\n')]
-        lines = [line for line in lines if line]  # Remove empty lines
-        
-        # Join with single newline
-        cleaned = '\n'.join(lines)
-        
-        # Remove multiple spaces
-        import re
-        cleaned = re.sub(r' +', ' ', cleaned)
-        
-        return cleaned.strip()
-    
     def detect_document_type(self, text: str, filename: str) -> str:
         """
         Detect document type based on content and filename
@@ -129,55 +344,4 @@ class DocumentProcessor:
         Returns:
             Document type: contract, sop, official_document, report, other
         """
-        text_lower = text.lower()
-        filename_lower = filename.lower()
-        
-        # Simple keyword-based detection
-        if any(keyword in text_lower for keyword in ['contract', '合約', '協議', 'agreement']):
-            return 'contract'
-        elif any(keyword in text_lower for keyword in ['sop', 'standard operating procedure', '標準作業程序']):
-            return 'sop'
-        elif any(keyword in text_lower for keyword in ['official', '公文', 'memorandum', '函']):
-            return 'official_document'
-        elif any(keyword in text_lower for keyword in ['report', '報告', 'analysis', '分析']):
-            return 'report'
-        elif any(keyword in filename_lower for keyword in ['contract', 'sop', 'report']):
-            # Fallback to filename
-            if 'contract' in filename_lower:
-                return 'contract'
-            elif 'sop' in filename_lower:
-                return 'sop'
-            elif 'report' in filename_lower:
-                return 'report'
-        
-        return 'other'
-    
-    def validate_file(self, file_path: str, max_size_bytes: Optional[int] = None) -> Tuple[bool, Optional[str]]:
-        """
-        Validate file before processing
-        
-        Returns:
-            Tuple of (is_valid, error_message)
-        """
-        if not os.path.exists(file_path):
-            return False, "File does not exist"
-        
-        if not os.path.isfile(file_path):
-            return False, "Path is not a file"
-        
-        # Check file size
-        file_size = os.path.getsize(file_path)
-        max_size = max_size_bytes or settings.max_file_size_bytes
-        
-        if file_size > max_size:
-            return False, f"File size ({file_size} bytes) exceeds maximum ({max_size} bytes)"
-        
-        if file_size == 0:
-            return False, "File is empty"
-        
-        # Check extension
-        ext = Path(file_path).suffix.lower().lstrip('.')
-        if ext not in self.supported_formats:
-            return False, f"Unsupported file format: {ext}"
-        
-        return True, None
+        return self.type_classifier.classify(self.type_classifier.count(text), filename)
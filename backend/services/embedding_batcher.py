@@ -0,0 +1,239 @@
+"""
+Embedding Batcher - concurrent, token-aware, adaptive batching for embedding requests
+"""
+from typing import List, Optional, Callable, Awaitable, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import asyncio
+import threading
+import time
+from config import settings
+from services.tokenizer import token_counter
+
+
+# Status codes that mean "this batch is too big / too fast" rather than "give up"
+SHRINK_STATUS_CODES = (413, 429)
+
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """HTTP status code of an httpx / OpenAI SDK error, if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+class AdaptiveBatcher:
+    """
+    Split texts into batches bounded by item count and token count, send them
+    concurrently, and shrink the batch limits after 413/429 responses.
+    Results are always returned in input order.
+    """
+
+    def __init__(
+        self,
+        max_items: int = None,
+        max_tokens: int = None,
+        concurrency: int = None,
+        max_retries: int = None,
+        count_tokens: Callable[[str], int] = None
+    ):
+        self.configured_items = max_items or settings.embedding_batch_size
+        self.configured_tokens = max_tokens or settings.embedding_batch_tokens
+        self.concurrency = concurrency or settings.embedding_concurrency
+        self.max_retries = max_retries if max_retries is not None else settings.embedding_max_retries
+        # Shared, cached token counts (chunks counted while chunking are not re-tokenized)
+        self.count_tokens = count_tokens or token_counter.count
+
+        # Current (adaptive) limits
+        self.max_items = self.configured_items
+        self.max_tokens = self.configured_tokens
+        self._lock = threading.Lock()
+
+    def _shrink(self, batch_size: int) -> None:
+        """Multiplicative decrease after the provider pushed back"""
+        with self._lock:
+            self.max_items = max(1, min(self.max_items, batch_size) // 2)
+            self.max_tokens = max(1, self.max_tokens // 2)
+
+    def _grow(self) -> None:
+        """Additive increase back towards the configured limits"""
+        with self._lock:
+            self.max_items = min(self.configured_items, self.max_items + max(1, self.configured_items // 10))
+            self.max_tokens = min(self.configured_tokens, self.max_tokens + max(1, self.configured_tokens // 10))
+
+    def _take(self, start: int, end: int, tokens: List[int]) -> int:
+        """End index of the next batch starting at `start` under the current limits"""
+        with self._lock:
+            max_items, max_tokens = self.max_items, self.max_tokens
+
+        stop = start
+        used = 0
+        while stop < end and stop - start < max_items:
+            # Always take at least one item, even if it alone exceeds the token budget
+            if stop > start and used + tokens[stop] > max_tokens:
+                break
+            used += tokens[stop]
+            stop += 1
+        return stop
+
+    def _place(
+        self,
+        results: List[Optional[List[float]]],
+        batch: Tuple[int, int, int],
+        embeddings: List[List[float]]
+    ) -> None:
+        """Store a batch's vectors at its input positions"""
+        start, end, _ = batch
+        # A short or long reply would shift every later vector onto the wrong text
+        if len(embeddings) != end - start:
+            raise ValueError(
+                f"Embedding provider returned {len(embeddings)} vectors for {end - start} inputs"
+            )
+        results[start:end] = embeddings
+        self._grow()
+
+    def _on_error(
+        self,
+        error: Exception,
+        batch: Tuple[int, int, int],
+        pending: deque
+    ) -> float:
+        """
+        Requeue a failed batch (split in half when it was too large)
+
+        Returns:
+            Seconds to wait before the retry is sent
+        """
+        start, end, attempt = batch
+        status = error_status_code(error)
+
+        if status not in SHRINK_STATUS_CODES or attempt >= self.max_retries:
+            raise error
+
+        self._shrink(end - start)
+
+        if end - start > 1:
+            middle = (start + end) // 2
+            pending.appendleft((middle, end, attempt + 1))
+            pending.appendleft((start, middle, attempt + 1))
+        elif status == 413:
+            # A single input that is still too large will never succeed
+            raise error
+        else:
+            pending.appendleft((start, end, attempt + 1))
+
+        # Back off only for rate limiting
+        return min(2 ** attempt, 30) if status == 429 else 0
+
+    def run(self, texts: List[str], send: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Embed texts with a thread pool of `concurrency` in-flight batches"""
+        if not texts:
+            return []
+
+        tokens = [self.count_tokens(text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: deque = deque()
+        cursor = 0
+
+        def next_batch() -> Optional[Tuple[int, int, int]]:
+            nonlocal cursor
+            if pending:
+                return pending.popleft()
+            if cursor >= len(texts):
+                return None
+            stop = self._take(cursor, len(texts), tokens)
+            batch = (cursor, stop, 0)
+            cursor = stop
+            return batch
+
+        def send_batch(batch: Tuple[int, int, int], delay: float) -> List[List[float]]:
+            if delay:
+                time.sleep(delay)
+            start, end, _ = batch
+            return send(texts[start:end])
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            in_flight = {}
+            delay = 0.0
+
+            while True:
+                while len(in_flight) < self.concurrency:
+                    batch = next_batch()
+                    if batch is None:
+                        break
+                    in_flight[executor.submit(send_batch, batch, delay)] = batch
+                    delay = 0.0
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        embeddings = future.result()
+                    except Exception as e:
+                        delay = max(delay, self._on_error(e, batch, pending))
+                        continue
+
+                    self._place(results, batch, embeddings)
+
+        return results
+
+    async def arun(
+        self,
+        texts: List[str],
+        send: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """Embed texts with up to `concurrency` batches awaited at once"""
+        if not texts:
+            return []
+
+        tokens = [self.count_tokens(text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: deque = deque()
+        cursor = 0
+
+        async def send_batch(batch: Tuple[int, int, int], delay: float) -> List[List[float]]:
+            if delay:
+                await asyncio.sleep(delay)
+            start, end, _ = batch
+            return await send(texts[start:end])
+
+        in_flight = {}
+        delay = 0.0
+
+        try:
+            while True:
+                while len(in_flight) < self.concurrency:
+                    if pending:
+                        batch = pending.popleft()
+                    elif cursor < len(texts):
+                        stop = self._take(cursor, len(texts), tokens)
+                        batch = (cursor, stop, 0)
+                        cursor = stop
+                    else:
+                        break
+                    in_flight[asyncio.ensure_future(send_batch(batch, delay))] = batch
+                    delay = 0.0
+
+                if not in_flight:
+                    break
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    batch = in_flight.pop(task)
+                    try:
+                        embeddings = task.result()
+                    except Exception as e:
+                        delay = max(delay, self._on_error(e, batch, pending))
+                        continue
+
+                    self._place(results, batch, embeddings)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        return results
@@ -0,0 +1,246 @@
+"""
+Embedding Cache - content-addressed cache for chunk embeddings
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+from config import settings
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different copies share a cache entry"""
+    text = unicodedata.normalize("NFC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """Cache key: sha256 of (embedding model, normalized text)"""
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: in-memory LRU in front of a SQLite store
+
+    The SQLite file is shared by the API and every ingestion worker process.
+    Its total size is kept in a one-row table updated in the same write
+    transaction as the rows, so every process evicts against the real
+    total rather than its own writes.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        memory_items: int = None,
+        max_disk_bytes: int = None
+    ):
+        self.path = path or settings.embedding_cache_path
+        self.memory_items = memory_items or settings.embedding_cache_memory_items
+        self.max_disk_bytes = max_disk_bytes or settings.embedding_cache_max_bytes
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)"
+        )
+        # Seeded once from the rows (stores written before the table existed)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO cache_size (id, bytes) SELECT 0, COALESCE(SUM(size_bytes), 0) FROM embeddings"
+        )
+        self._conn.commit()
+
+        self.disk_bytes = self._total_bytes()
+
+    def get_many(self, model: str, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        """
+        Look up embeddings for texts
+
+        Returns:
+            Tuple of (results aligned with texts, None for misses; cache keys aligned with texts)
+        """
+        keys = [embedding_cache_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        disk_lookup: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup:
+                found = self._read_disk(list(disk_lookup))
+                for key, positions in disk_lookup.items():
+                    vector = found.get(key)
+                    if vector is None:
+                        self.misses += len(positions)
+                        continue
+                    self.disk_hits += len(positions)
+                    self._remember(key, vector)
+                    for i in positions:
+                        results[i] = vector
+
+        return results, keys
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]) -> None:
+        """Store embeddings under precomputed cache keys"""
+        if not keys:
+            return
+
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                rows.append((key, blob, len(blob), now))
+
+            # Write lock first: the size read below then includes every other process's writes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._sizes(keys)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, size_bytes, last_access) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute(
+                    "UPDATE cache_size SET bytes = bytes + ? WHERE id = 0",
+                    (sum(row[2] for row in rows) - sum(existing.values()),)
+                )
+                self.disk_bytes = self._total_bytes()
+                self._evict_disk()
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._total_bytes(),
+        }
+
+    def _total_bytes(self) -> int:
+        row = self._conn.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        """Insert into the memory tier, evicting least recently used entries"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Fetch vectors from SQLite and refresh their access time"""
+        found = {}
+        # Stay well below SQLite's host-parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+
+        return found
+
+    def _sizes(self, keys: List[str]) -> Dict[str, int]:
+        """Current on-disk sizes for keys that are about to be replaced"""
+        sizes = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, size_bytes FROM embeddings WHERE key IN ({placeholders})",
+                batch
+            ).fetchall()
+            sizes.update(rows)
+        return sizes
+
+    def _evict_disk(self) -> None:
+        """Drop least recently used rows until the store is under 90% of its budget (in the write transaction)"""
+        if self.disk_bytes <= self.max_disk_bytes:
+            return
+
+        target = int(self.max_disk_bytes * 0.9)
+        while self.disk_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size_bytes FROM embeddings ORDER BY last_access ASC LIMIT 500"
+            ).fetchall()
+            if not rows:
+                self.disk_bytes = 0
+                break
+
+            victims = []
+            for key, size in rows:
+                victims.append((key,))
+                self.disk_bytes -= size
+                if self.disk_bytes <= target:
+                    break
+
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+            self.evictions += len(victims)
+
+        self._conn.execute("UPDATE cache_size SET bytes = ? WHERE id = 0", (self.disk_bytes,))
@@ -1,35 +1,60 @@
 """
 Embedding Service - handles text chunking and vector embeddings
 """
-from typing import List, Dict, Any, Tuple
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+from typing import List, Dict, Any, Tuple, Iterable, Iterator
+import asyncio
 from config import settings
-from services.llm_client import llm_client
+from services.llm_client import llm_client, async_llm_client
+from services.embedding_cache import EmbeddingCache, embedding_cache_key
+from services.single_flight import SingleFlight, AsyncSingleFlight
+from services.chunker import TextChunker, TokenChunker
+from services.tokenizer import tokenizer, token_counter
+from services.vector_store import create_vector_store
+from collections import deque, OrderedDict
+import hashlib
+import threading
 import uuid
 
 
+def content_hash(text: str) -> str:
+    """SHA-256 of a chunk's text, used to match chunks across re-indexing"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
 class EmbeddingService:
     """Manage text chunking and vector embeddings"""
     
     def __init__(self):
         self.client = llm_client
+        self.async_client = async_llm_client
         self.chunk_size = settings.chunk_size
         self.chunk_overlap = settings.chunk_overlap
-        
-        # Initialize vector database
-        if settings.vector_db_type == "chromadb":
-            self.vector_db = chromadb.PersistentClient(
-                path=settings.chromadb_path,
-                settings=ChromaSettings(anonymized_telemetry=False)
-            )
-            self.collection = self.vector_db.get_or_create_collection(
-                name="document_chunks",
-                metadata={"hnsw:space": "cosine"}
+        if settings.chunk_unit == "tokens":
+            self.chunker = TokenChunker(
+                tokenizer=tokenizer,
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                min_chunk_size=settings.min_chunk_size,
+                counter=token_counter
             )
         else:
-            # Pinecone initialization would go here
-            raise NotImplementedError("Pinecone support not yet implemented")
+            self.chunker = TextChunker(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                min_chunk_size=settings.min_chunk_size
+            )
+        
+        # Content-addressed embedding cache (only misses go to the provider)
+        self.cache = EmbeddingCache() if settings.enable_embedding_cache else None
+        
+        # Small in-process LRU for query embeddings; identical in-flight queries are coalesced
+        self._query_embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._query_flight = SingleFlight()
+        self._aquery_flight = AsyncSingleFlight()
+        
+        # Initialize vector database (settings.vector_db_type)
+        self.vector_store = create_vector_store()
     
     def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict[str, Any]]:
         """
@@ -42,59 +67,15 @@ class EmbeddingService:
         Returns:
             List of chunk dictionaries with text and metadata
         """
-        chunks = []
-        text_length = len(text)
-        
-        start = 0
-        chunk_index = 0
-        
-        while start < text_length:
-            # Calculate end position
-            end = start + self.chunk_size
-            
-            # If not the last chunk, try to break at sentence boundary
-            if end < text_length:
-                # Look for sentence endings within the last 100 chars
-                search_start = max(start, end - 100)
-                sentence_endings = ['. ', '。', '! ', '！', '? ', '？', '\n\n']
-                
-                best_break = -1
-                for ending in sentence_endings:
-                    pos = text.rfind(ending, search_start, end)
-                    if pos > best_break:
-                        best_break = pos + len(ending)
-                
-                if best_break > start:
-                    end = best_break
-            
-            # Extract chunk
-            chunk_text = text[start:end].strip()
-            
-            # Only add if chunk is substantial
-            if len(chunk_text) >= settings.min_chunk_size:
-                chunk_metadata = {
-                    "chunk_index": chunk_index,
-                    "start_pos": start,
-                    "end_pos": end,
-                    **(metadata or {})
-                }
-                
-                chunks.append({
-                    "chunk_index": chunk_index,
-                    "chunk_text": chunk_text,
-                    "metadata": chunk_metadata
-                })
-                
-                chunk_index += 1
-            
-            # Move start position with overlap
-            start = end - self.chunk_overlap
-            
-            # Prevent infinite loop
-            if start >= text_length:
-                break
-        
-        return chunks
+        return self.chunker.chunk_text(text, metadata)
+    
+    def iter_chunks(self, pieces: Iterable[str], metadata: Dict = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of chunk_text over an iterable of text pieces
+        (pages, paragraphs); yields the same chunks as chunk_text on the
+        concatenated text
+        """
+        return self.chunker.iter_chunks(pieces, metadata)
     
     def create_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
@@ -106,14 +87,111 @@ class EmbeddingService:
         Returns:
             List of embedding vectors
         """
-        return self.client.create_embeddings(texts)
+        if self.cache is None:
+            return self.client.create_embeddings(texts)
+        
+        results, keys, missing = self._cache_lookup(texts)
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            self._cache_fill(results, missing, self.client.create_embeddings(miss_texts))
+        
+        return results
+    
+    async def acreate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of create_embeddings (does not block the event loop)"""
+        if self.cache is None:
+            return await self.async_client.create_embeddings(texts)
+        
+        results, keys, missing = await asyncio.to_thread(self._cache_lookup, texts)
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            embeddings = await self.async_client.create_embeddings(miss_texts)
+            await asyncio.to_thread(self._cache_fill, results, missing, embeddings)
+        
+        return results
+    
+    def embed_query(self, query_text: str) -> List[float]:
+        """
+        Embedding of a search query, served from the query LRU when possible;
+        concurrent calls for the same query share a single provider request
+        """
+        key = embedding_cache_key(self.client.embedding_model_id, query_text)
+        embedding = self._recall_query(key)
+        if embedding is not None:
+            return embedding
+        
+        def embed() -> List[float]:
+            embedding = self.create_embeddings([query_text])[0]
+            self._remember_query(key, embedding)
+            return embedding
+        
+        return self._query_flight.do(key, embed)
+    
+    async def aembed_query(self, query_text: str) -> List[float]:
+        """Async variant of embed_query"""
+        key = embedding_cache_key(self.client.embedding_model_id, query_text)
+        embedding = self._recall_query(key)
+        if embedding is not None:
+            return embedding
+        
+        async def embed() -> List[float]:
+            embedding = (await self.acreate_embeddings([query_text]))[0]
+            self._remember_query(key, embedding)
+            return embedding
+        
+        return await self._aquery_flight.do(key, embed)
+    
+    def _recall_query(self, key: str):
+        with self._query_lock:
+            embedding = self._query_embeddings.get(key)
+            if embedding is not None:
+                self._query_embeddings.move_to_end(key)
+            return embedding
+    
+    def _remember_query(self, key: str, embedding: List[float]) -> None:
+        with self._query_lock:
+            self._query_embeddings[key] = embedding
+            self._query_embeddings.move_to_end(key)
+            while len(self._query_embeddings) > settings.query_embedding_cache_size:
+                self._query_embeddings.popitem(last=False)
+    
+    def _cache_lookup(self, texts: List[str]) -> Tuple[List, List[str], Dict[str, List[int]]]:
+        """
+        Resolve texts against the embedding cache
+        
+        Returns:
+            Tuple of (results with None for misses, cache keys,
+            {missing key: positions in texts}) - duplicate texts are embedded once
+        """
+        results, keys = self.cache.get_many(self.client.embedding_model_id, texts)
+        
+        missing: Dict[str, List[int]] = {}
+        for i, vector in enumerate(results):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        
+        return results, keys, missing
+    
+    def _cache_fill(
+        self,
+        results: List,
+        missing: Dict[str, List[int]],
+        embeddings: List[List[float]]
+    ) -> None:
+        """Store freshly created embeddings and merge them back in order"""
+        self.cache.put_many(list(missing), embeddings)
+        
+        for positions, embedding in zip(missing.values(), embeddings):
+            for i in positions:
+                results[i] = embedding
     
     def store_chunks(
         self,
         document_id: str,
         chunks: List[Dict[str, Any]],
-        embeddings: List[List[float]]
-    ) -> None:
+        embeddings: List[List[float]],
+        db: Any = None
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
         """
         Store chunks and embeddings in vector database
         
@@ -121,68 +199,58 @@ class EmbeddingService:
             document_id: Document UUID
             chunks: List of chunk dictionaries
             embeddings: List of embedding vectors
+            db: Session whose transaction the write joins (pgvector)
+            
+        Returns:
+            Tuple of (vector IDs, vector metadata) as written
         """
         if len(chunks) != len(embeddings):
             raise ValueError("Number of chunks must match number of embeddings")
         
-        # Prepare data for ChromaDB
-        ids = [f"{document_id}_{chunk['chunk_index']}" for chunk in chunks]
+        # Prepare data for the vector store
+        ids = [chunk.get('id') or f"{document_id}_{chunk['chunk_index']}" for chunk in chunks]
         documents = [chunk['chunk_text'] for chunk in chunks]
-        metadatas = [
-            {
-                **chunk['metadata'],
-                'document_id': str(document_id)
-            }
-            for chunk in chunks
-        ]
+        metadatas = [self._vector_metadata(document_id, chunk) for chunk in chunks]
         
         # Upsert to vector database
-        self.collection.upsert(
+        self.vector_store.upsert(
             ids=ids,
             embeddings=embeddings,
             documents=documents,
-            metadatas=metadatas
+            metadatas=metadatas,
+            db=db
         )
+        
+        return ids, metadatas
     
-    def search_similar(
+    def _vector_metadata(self, document_id: str, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """Metadata stored alongside a chunk in the vector database"""
+        return {
+            **chunk['metadata'],
+            'document_id': str(document_id),
+            'content_hash': content_hash(chunk['chunk_text'])
+        }
+    
+    def search_by_embedding(
         self,
-        query_text: str,
-        top_k: int = None,
+        query_embedding: List[float],
+        top_k: int,
         filter_metadata: Dict = None
     ) -> List[Dict[str, Any]]:
-        """
-        Search for similar chunks using semantic search
-        
-        Args:
-            query_text: Query string
-            top_k: Number of results to return
-            filter_metadata: Optional metadata filters
-            
-        Returns:
-            List of matching chunks with scores
-        """
-        top_k = top_k or settings.default_top_k
-        
-        # Create query embedding
-        query_embedding = self.create_embeddings([query_text])[0]
-        
+        """Run a nearest-neighbour query and format the matches"""
         # Search in vector database
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            where=filter_metadata
-        )
+        results = self.vector_store.query(query_embedding, top_k, filter_metadata)
         
         # Format results
         matches = []
-        for i in range(len(results['ids'][0])):
+        for result in results:
             matches.append({
-                'id': results['ids'][0][i],
-                'document_id': results['metadatas'][0][i].get('document_id'),
-                'chunk_index': results['metadatas'][0][i].get('chunk_index'),
-                'text': results['documents'][0][i],
-                'score': 1 - results['distances'][0][i],  # Convert distance to similarity
-                'metadata': results['metadatas'][0][i]
+                'id': result['id'],
+                'document_id': result['metadata'].get('document_id'),
+                'chunk_index': result['metadata'].get('chunk_index'),
+                'text': result['text'],
+                'score': result['score'],
+                'metadata': result['metadata']
             })
         
         return matches
@@ -190,12 +258,12 @@ class EmbeddingService:
     def delete_document_chunks(self, document_id: str) -> None:
         """Delete all chunks for a document from vector database"""
         # Query for all chunks of this document
-        results = self.collection.get(
+        results = self.vector_store.get(
             where={"document_id": str(document_id)}
         )
         
         if results['ids']:
-            self.collection.delete(ids=results['ids'])
+            self.vector_store.delete(ids=results['ids'])
     
     def process_document(
         self,
@@ -228,3 +296,82 @@ class EmbeddingService:
         self.store_chunks(document_id, chunks, embeddings)
         
         return chunks, embeddings
+    
+    def refresh_chunks(
+        self,
+        document_id: str,
+        chunks: List[Dict[str, Any]],
+        db: Any = None
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """
+        Rewrite the vector metadata of chunks that kept their stored vector
+        (chunk['id'], see ChunkMatcher) without re-embedding them
+        
+        Returns:
+            Tuple of (vector IDs, vector metadata) as written
+        """
+        ids = [chunk['id'] for chunk in chunks]
+        metadatas = [self._vector_metadata(document_id, chunk) for chunk in chunks]
+        if ids:
+            self.vector_store.update_metadata(ids, metadatas, db)
+        return ids, metadatas
+    
+    def match_stored_chunks(self, document_id: str) -> "ChunkMatcher":
+        """ChunkMatcher over the chunks stored for a document"""
+        existing = self.vector_store.get(
+            where={"document_id": str(document_id)}
+        )
+        return ChunkMatcher(document_id, existing)
+
+
+class ChunkMatcher:
+    """
+    Incremental re-indexing: match a document's new chunks, one at a time,
+    to its stored chunks by content hash
+    
+    An unchanged chunk takes over the stored vector ID (its embedding is
+    reused, only positional metadata is refreshed); a new or changed chunk
+    gets a content-derived ID that stays stable across later updates.
+    Stored chunks no new chunk claimed are stale.
+    """
+    
+    def __init__(self, document_id: str, existing: Dict[str, List]):
+        self.document_id = document_id
+        # content hash -> stored IDs with that content (in order)
+        self.stored: Dict[str, deque] = {}
+        for chunk_id, chunk_text, chunk_meta in zip(
+            existing['ids'], existing['documents'], existing['metadatas']
+        ):
+            chunk_hash = (chunk_meta or {}).get('content_hash') or content_hash(chunk_text)
+            self.stored.setdefault(chunk_hash, deque()).append(chunk_id)
+        self.used_ids = set(existing['ids'])
+        self.reused = 0
+        self.embedded = 0
+    
+    def match(self, chunk: Dict[str, Any]) -> bool:
+        """
+        Set chunk['id']
+        
+        Returns:
+            True if the chunk reuses a stored vector, False if it must be embedded
+        """
+        chunk_hash = content_hash(chunk['chunk_text'])
+        candidates = self.stored.get(chunk_hash)
+        if candidates:
+            chunk['id'] = candidates.popleft()
+            self.reused += 1
+            return True
+        
+        chunk_id = f"{self.document_id}_{chunk_hash[:16]}"
+        suffix = 1
+        while chunk_id in self.used_ids:
+            chunk_id = f"{self.document_id}_{chunk_hash[:16]}_{suffix}"
+            suffix += 1
+        self.used_ids.add(chunk_id)
+        chunk['id'] = chunk_id
+        self.embedded += 1
+        return False
+    
+    def stale_ids(self) -> List[str]:
+        """Stored chunks that no matched chunk reused (once every chunk is matched)"""
+        return [chunk_id for ids in self.stored.values() for chunk_id in ids]
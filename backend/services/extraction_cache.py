@@ -0,0 +1,116 @@
+"""
+Extraction Cache - persistent cache of LLM metadata extraction results
+"""
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import settings
+
+
+def extraction_cache_key(model: str, schema: Dict, text: str) -> str:
+    """Cache key: sha256 of (model, schema, prompt text)"""
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(schema, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite store of parsed extraction results (the LLM's JSON, before schema
+    validation), shared by all worker processes. Least recently used
+    entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None):
+        self.path = path or settings.extraction_cache_path
+        self.max_entries = max_entries or settings.extraction_cache_max_entries
+        self._lock = threading.Lock()
+
+        # Counters (this process)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extractions_last_access ON extractions(last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT result FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Extraction cache read failed: {e}")
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO extractions (key, result, last_access) VALUES (?, ?, ?)",
+                        (key, json.dumps(result, ensure_ascii=False), time.time())
+                    )
+                    self._evict()
+            except sqlite3.Error as e:
+                print(f"⚠️ Extraction cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the store is under 90% of its budget"""
+        (entries,) = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()
+        if entries <= self.max_entries:
+            return
+
+        excess = entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM extractions WHERE key IN "
+            "(SELECT key FROM extractions ORDER BY last_access ASC LIMIT ?)",
+            (excess,)
+        )
+        self.evictions += excess
@@ -0,0 +1,562 @@
+"""
+Flat Index - exact cosine search over memory-mapped vector segments
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import json
+import mmap
+import os
+import threading
+import uuid
+import numpy as np
+from config import settings
+from services.vector_store import VectorStore
+
+
+# Vectors per matrix-vector multiply, as float32 bytes (float16 blocks are
+# converted to float32 one cache-sized block at a time)
+BLOCK_BYTES = 4 * 1024 * 1024
+
+# A filter selecting less than this fraction of a segment scores only the selected rows
+SPARSE_FILTER_RATIO = 0.125
+
+_COMPARE = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """Unit-length rows (zero rows stay zero)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _block_rows(vectors: np.ndarray) -> int:
+    return max(1, BLOCK_BYTES // (vectors.shape[1] * 4))
+
+
+def _fsync_path(path: str) -> None:
+    """fsync a file, or a directory (making the names created in it durable)"""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _hashable(value: Any) -> Any:
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, sort_keys=True)
+
+
+class _Segment:
+    """
+    One immutable segment: <name>.npy (unit vectors, memory-mapped),
+    <name>.txt (chunk texts, memory-mapped) and <name>.json (IDs, metadata
+    and text offsets). Liveness and metadata updates are kept in memory.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        base = os.path.join(directory, name)
+
+        self.vectors = np.load(base + ".npy", mmap_mode="r")
+        with open(base + ".json", encoding="utf-8") as file:
+            rows = json.load(file)
+        self.ids: List[str] = rows["ids"]
+        self.metadatas: List[Dict[str, Any]] = rows["metadatas"]
+        self.offsets = np.asarray(rows["offsets"], dtype=np.int64)
+
+        # The mapping outlives the file, so compaction may delete it under a reader
+        with open(base + ".txt", "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self._text = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self.updated_rows = set()
+        self._columns: Dict[Tuple[str, str], Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def document(self, row: int) -> str:
+        return self._text[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def update(self, row: int, metadata: Dict[str, Any]) -> None:
+        self.metadatas[row] = metadata
+        self.updated_rows.add(row)
+        self._columns.clear()
+
+    def codes(self, key: str) -> Tuple[np.ndarray, Dict[Any, int]]:
+        """Dictionary-encoded metadata column: (code per row, value -> code)"""
+        column = self._columns.get(("codes", key))
+        if column is None:
+            index: Dict[Any, int] = {}
+            codes = np.fromiter(
+                (index.setdefault(_hashable(metadata.get(key)), len(index)) for metadata in self.metadatas),
+                dtype=np.int32,
+                count=len(self.metadatas)
+            )
+            column = self._columns[("codes", key)] = (codes, index)
+        return column
+
+    def numbers(self, key: str) -> np.ndarray:
+        """Numeric metadata column, NaN where the value is missing or not a number"""
+        column = self._columns.get(("numbers", key))
+        if column is None:
+            column = np.fromiter(
+                (
+                    value if isinstance(value, (int, float)) else np.nan
+                    for value in (metadata.get(key) for metadata in self.metadatas)
+                ),
+                dtype=np.float64,
+                count=len(self.metadatas)
+            )
+            self._columns[("numbers", key)] = column
+        return column
+
+
+def _where_mask(segment: _Segment, where: Dict) -> np.ndarray:
+    """Rows of a segment matching a Chroma-style filter"""
+    mask = np.ones(len(segment), dtype=bool)
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                mask &= _where_mask(segment, clause)
+        elif key == "$or":
+            matched = np.zeros(len(segment), dtype=bool)
+            for clause in condition:
+                matched |= _where_mask(segment, clause)
+            mask &= matched
+        else:
+            mask &= _field_mask(segment, key, condition)
+    return mask
+
+
+def _field_mask(segment: _Segment, key: str, condition: Any) -> np.ndarray:
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+
+    mask = np.ones(len(segment), dtype=bool)
+    for op, value in condition.items():
+        if op in ("$eq", "$ne"):
+            codes, index = segment.codes(key)
+            matched = codes == index.get(_hashable(value), -1)
+        elif op in ("$in", "$nin"):
+            codes, index = segment.codes(key)
+            wanted = [index[item] for item in map(_hashable, value) if item in index]
+            matched = np.isin(codes, wanted)
+        elif op in _COMPARE:
+            with np.errstate(invalid="ignore"):
+                matched = _COMPARE[op](segment.numbers(key), float(value))
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        mask &= ~matched if op in ("$ne", "$nin") else matched
+    return mask
+
+
+def _top_rows(vectors: np.ndarray, mask: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(rows, scores) of the k best rows selected by mask"""
+    selected = int(np.count_nonzero(mask))
+    k = min(k, selected)
+    if not k:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if selected < len(mask) * SPARSE_FILTER_RATIO:
+        rows = np.flatnonzero(mask)
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+    else:
+        rows = None
+        scores = np.empty(len(mask), dtype=np.float32)
+        block_rows = _block_rows(vectors)
+        for start in range(0, len(mask), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            np.dot(block, query, out=scores[start:start + len(block)])
+        scores[~mask] = -np.inf
+
+    top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    return (top if rows is None else rows[top]), scores[top]
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Exact cosine search in-process, without a vector database
+
+    Vectors are stored unit-length as contiguous float32 (or float16)
+    matrices in append-only segment files and memory-mapped, so worker
+    processes share the page cache. A query is a blocked matrix-vector
+    multiply per segment and an argpartition for the top k; metadata
+    filters run on dictionary-encoded / numeric columns first, and a
+    selective filter scores only the rows it selects.
+
+    Every write appends a segment or a delete/update record to a log under
+    an exclusive file lock; readers replay whatever the log gained since
+    they last looked, so writes from ingestion workers are visible to the
+    API. A background thread merges small segments once there are more
+    than max_segments, and rewrites everything once more than
+    compact_dead_ratio of the rows are deleted or superseded.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        dtype: str = None,
+        max_segments: int = None,
+        compact_dead_ratio: float = None
+    ):
+        self.path = path or settings.flat_index_path
+        self.dtype = np.dtype(dtype or settings.flat_index_dtype)
+        self.max_segments = max_segments or settings.flat_index_max_segments
+        self.compact_dead_ratio = settings.flat_index_compact_dead_ratio if compact_dead_ratio is None else compact_dead_ratio
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.RLock()         # in-memory state
+        self._write_mutex = threading.Lock()   # writers of this process (the file lock is per process)
+        self._lock_file = open(os.path.join(self.path, "LOCK"), "a")
+
+        self._generation: Optional[int] = None
+        self._log_offset = 0
+        self._segments: List[_Segment] = []
+        self._by_name: Dict[str, _Segment] = {}
+        self._id_map: Dict[str, Tuple[_Segment, int]] = {}
+        self._compacting = False
+        self.compactions = 0
+
+        with self._write_lock():
+            if not os.path.exists(self._current_path()):
+                open(self._log_path(0), "a").close()
+                self._write_current(0)
+            self._sync()
+
+    def upsert(self, ids, embeddings, documents, metadatas, db=None) -> None:
+        if not ids:
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32)).astype(self.dtype)
+
+        with self._write_lock():
+            self._sync()
+            dimension = self._dimension()
+            if dimension is not None and vectors.shape[1] != dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index ({dimension})")
+
+            name = self._write_segment(vectors, ids, documents, metadatas)
+            self._append({"op": "add", "segment": name})
+
+        self._maybe_compact()
+
+    def query(self, embedding, top_k, where=None) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            segments = list(self._segments)
+
+        query = _normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+
+        candidates = []
+        for segment in segments:
+            mask = segment.live & _where_mask(segment, where) if where else segment.live
+            rows, scores = _top_rows(segment.vectors, mask, query, top_k)
+            candidates.extend(zip(scores.tolist(), [segment] * len(rows), rows.tolist()))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [
+            {
+                'id': segment.ids[row],
+                'text': segment.document(row),
+                'metadata': dict(segment.metadatas[row]),
+                'score': score
+            }
+            for score, segment, row in candidates[:top_k]
+        ]
+
+    def get(self, where: Dict) -> Dict[str, List]:
+        with self._lock:
+            self._sync()
+            segments = list(self._segments)
+
+        results = {'ids': [], 'documents': [], 'metadatas': []}
+        for segment in segments:
+            for row in np.flatnonzero(segment.live & _where_mask(segment, where)).tolist():
+                results['ids'].append(segment.ids[row])
+                results['documents'].append(segment.document(row))
+                results['metadatas'].append(dict(segment.metadatas[row]))
+        return results
+
+    def update_metadata(self, ids, metadatas, db=None) -> None:
+        if ids:
+            with self._write_lock():
+                self._append({"op": "update", "ids": list(ids), "metadatas": list(metadatas)})
+
+    def delete(self, ids: List[str], db=None) -> None:
+        if ids:
+            with self._write_lock():
+                self._append({"op": "delete", "ids": list(ids)})
+            self._maybe_compact()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            rows = sum(len(segment) for segment in self._segments)
+            stats = {
+                "backend": "flat",
+                "chunks": len(self._id_map),
+                "dead_rows": rows - len(self._id_map),
+                "segments": len(self._segments),
+                "dimension": self._dimension(),
+                "dtype": self.dtype.name,
+                "generation": self._generation,
+                "compactions": self.compactions,
+            }
+        stats["disk_bytes"] = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+        return stats
+
+    # Log and segment files
+
+    def _current_path(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"log-{generation}.jsonl")
+
+    def _write_current(self, generation: int) -> None:
+        temp_path = self._current_path() + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(str(generation))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._current_path())
+        _fsync_path(self.path)
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        with self._write_mutex:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        """Append to the log (write lock held), then apply it like any other reader"""
+        with open(self._log_path(self._generation), "ab") as file:
+            file.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._sync()
+
+    def _write_segment(self, vectors: np.ndarray, ids, documents, metadatas) -> str:
+        name = f"seg-{uuid.uuid4().hex[:16]}"
+        base = os.path.join(self.path, name)
+
+        np.save(base + ".npy", vectors)
+        offsets = [0]
+        with open(base + ".txt", "wb") as file:
+            for text in documents:
+                data = text.encode("utf-8")
+                file.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with open(base + ".json", "w", encoding="utf-8") as file:
+            json.dump({"ids": list(ids), "metadatas": list(metadatas), "offsets": offsets}, file, ensure_ascii=False)
+        self._fsync_segment(base)
+        return name
+
+    def _fsync_segment(self, base: str) -> None:
+        """Make a new segment durable before a log record refers to it"""
+        for extension in (".npy", ".txt", ".json"):
+            _fsync_path(base + extension)
+        _fsync_path(self.path)
+
+    def _dimension(self) -> Optional[int]:
+        return self._segments[0].vectors.shape[1] if self._segments else None
+
+    # Replay
+
+    def _sync(self) -> None:
+        """Catch up with CURRENT and the log (other processes write too)"""
+        with self._lock:
+            for attempt in range(3):
+                try:
+                    with open(self._current_path()) as file:
+                        generation = int(file.read())
+                    if generation != self._generation:
+                        self._reset(generation)
+
+                    with open(self._log_path(generation), "rb") as file:
+                        file.seek(self._log_offset)
+                        data = file.read()
+                    break
+                except FileNotFoundError:
+                    # Compaction replaced the generation between the two reads
+                    if attempt == 2:
+                        raise
+
+            # Only complete lines; a writer may be mid-append
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if line:
+                    self._apply(json.loads(line))
+            self._log_offset += end
+
+    def _reset(self, generation: int) -> None:
+        self._generation = generation
+        self._log_offset = 0
+        self._segments = []
+        self._by_name = {}
+        self._id_map = {}
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        op = entry["op"]
+        if op == "add":
+            segment = _Segment(self.path, entry["segment"])
+            self._segments.append(segment)
+            self._by_name[segment.name] = segment
+            for row, chunk_id in enumerate(segment.ids):
+                self._kill(chunk_id)
+                self._id_map[chunk_id] = (segment, row)
+        elif op == "drop":
+            segment = self._by_name[entry["segment"]]
+            for row in entry["rows"]:
+                segment.live[row] = False
+                if self._id_map.get(segment.ids[row]) == (segment, row):
+                    del self._id_map[segment.ids[row]]
+        elif op == "delete":
+            for chunk_id in entry["ids"]:
+                self._kill(chunk_id)
+        elif op == "update":
+            for chunk_id, metadata in zip(entry["ids"], entry["metadatas"]):
+                ref = self._id_map.get(chunk_id)
+                if ref is not None:
+                    ref[0].update(ref[1], metadata)
+
+    def _kill(self, chunk_id: str) -> None:
+        ref = self._id_map.pop(chunk_id, None)
+        if ref is not None:
+            ref[0].live[ref[1]] = False
+
+    # Compaction
+
+    def _compaction_plan(self) -> List[_Segment]:
+        """Segments to merge (empty if none need it)"""
+        segments = self._segments
+        rows = sum(len(segment) for segment in segments)
+        if rows and (rows - len(self._id_map)) / rows > self.compact_dead_ratio:
+            return list(segments)
+
+        if len(segments) > self.max_segments:
+            # Tiered: merge the small segments, leave the large ones alone
+            largest = max(len(segment) for segment in segments)
+            small = [segment for segment in segments if len(segment) * 4 < largest]
+            return small if len(small) > 1 else list(segments)
+
+        return []
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            if self._compacting or not self._compaction_plan():
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, name="flat-index-compaction", daemon=True).start()
+
+    def _compact(self) -> None:
+        try:
+            with self._write_lock():
+                self._sync()
+                with self._lock:
+                    plan = self._compaction_plan()
+                    segments = list(self._segments)
+                if plan:
+                    self._rewrite(segments, plan)
+        except Exception as e:
+            print(f"⚠️ Flat index compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _rewrite(self, segments: List[_Segment], plan: List[_Segment]) -> None:
+        """Merge the live rows of plan into one segment and start a new log generation (write lock held)"""
+        merged = self._write_merged(plan)
+        planned = {segment.name for segment in plan}
+
+        # Surviving segments first: replaying an add supersedes every earlier
+        # copy of its IDs, so the merged (live-only) rows must come last
+        entries = []
+        updates = {"op": "update", "ids": [], "metadatas": []}
+        for segment in segments:
+            if segment.name in planned:
+                continue
+            entries.append({"op": "add", "segment": segment.name})
+            dead = np.flatnonzero(~segment.live).tolist()
+            if dead:
+                entries.append({"op": "drop", "segment": segment.name, "rows": dead})
+            for row in sorted(segment.updated_rows):
+                if segment.live[row]:
+                    updates["ids"].append(segment.ids[row])
+                    updates["metadatas"].append(segment.metadatas[row])
+        if merged:
+            entries.append({"op": "add", "segment": merged})
+        if updates["ids"]:
+            entries.append(updates)
+
+        old_generation = self._generation
+        generation = old_generation + 1
+        with open(self._log_path(generation), "wb") as file:
+            for entry in entries:
+                file.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._write_current(generation)
+        self._sync()
+        self.compactions += 1
+
+        # Readers still holding the old files keep their mappings
+        for name in planned:
+            for extension in (".npy", ".txt", ".json"):
+                try:
+                    os.remove(os.path.join(self.path, name + extension))
+                except FileNotFoundError:
+                    pass
+        os.remove(self._log_path(old_generation))
+
+        print(f"✅ Flat index compacted {len(plan)} segments ({len(self._segments)} left)")
+
+    def _write_merged(self, plan: List[_Segment]) -> Optional[str]:
+        """One segment with the live rows of plan, copied block by block; None if none are live"""
+        live_rows = [np.flatnonzero(segment.live) for segment in plan]
+        total = sum(len(rows) for rows in live_rows)
+        if not total:
+            return None
+
+        name = f"seg-{uuid.uuid4().hex[:16]}"
+        base = os.path.join(self.path, name)
+        dimension = plan[0].vectors.shape[1]
+
+        vectors = np.lib.format.open_memmap(base + ".npy", mode="w+", dtype=self.dtype, shape=(total, dimension))
+        ids, metadatas, offsets = [], [], [0]
+        position = 0
+        with open(base + ".txt", "wb") as text_file:
+            for segment, rows in zip(plan, live_rows):
+                block_rows = _block_rows(segment.vectors)
+                for start in range(0, len(rows), block_rows):
+                    block = rows[start:start + block_rows]
+                    vectors[position:position + len(block)] = segment.vectors[block]
+                    position += len(block)
+                for row in rows.tolist():
+                    data = segment.document(row).encode("utf-8")
+                    text_file.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                    ids.append(segment.ids[row])
+                    metadatas.append(segment.metadatas[row])
+        vectors.flush()
+        del vectors
+
+        with open(base + ".json", "w", encoding="utf-8") as file:
+            json.dump({"ids": ids, "metadatas": metadatas, "offsets": offsets}, file, ensure_ascii=False)
+        self._fsync_segment(base)
+        return name
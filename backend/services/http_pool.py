@@ -0,0 +1,104 @@
+"""
+HTTP Connection Pool - 每個 LLM 提供商共用的 keep-alive 連線池
+"""
+import os
+import atexit
+import threading
+from typing import Dict
+import httpx
+
+
+def _http2_available() -> bool:
+    """HTTP/2 requires the optional `h2` package (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ProviderHTTPPool:
+    """每個提供商一個 httpx.Client，重用 TCP/TLS 連線並強制逾時"""
+
+    def __init__(self):
+        # Pool sizing
+        self.max_connections = int(os.getenv("LLM_POOL_SIZE", "20"))
+        self.max_keepalive_connections = int(os.getenv("LLM_POOL_KEEPALIVE", "10"))
+        self.keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+
+        # Timeouts (seconds)
+        self.connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+        self.read_timeout = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+
+        # HTTP/2 only when requested and the h2 package is installed
+        self.http2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and _http2_available()
+
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            self.read_timeout,
+            connect=self.connect_timeout,
+            pool=self.connect_timeout
+        )
+
+    def get(self, provider: str) -> httpx.Client:
+        """Return the pooled client for a provider, creating it on first use"""
+        client = self._clients.get(provider)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None:
+                client = httpx.Client(
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    http2=self.http2
+                )
+                self._clients[provider] = client
+
+        return client
+
+    def get_async(self, provider: str) -> httpx.AsyncClient:
+        """Return the pooled async client for a provider (used from the event loop)"""
+        client = self._async_clients.get(provider)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2
+            )
+            self._async_clients[provider] = client
+
+        return client
+
+    def close(self) -> None:
+        """Close every pooled sync connection"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    async def aclose(self) -> None:
+        """Close every pooled async connection"""
+        clients = list(self._async_clients.values())
+        self._async_clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+# 全局連線池實例
+http_pool = ProviderHTTPPool()
+atexit.register(http_pool.close)
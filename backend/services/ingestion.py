@@ -0,0 +1,554 @@
+"""
+Ingestion Worker - runs document processing jobs claimed from the job queue
+"""
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import mimetypes
+import os
+import socket
+import tempfile
+import threading
+import time
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from config import settings
+from database import SessionLocal
+from models import Document, Chunk, ProcessingJob
+from services.document_processor import DocumentProcessor
+from services.ai_extractor import AIExtractor
+from services.embedding_service import EmbeddingService
+from services.job_queue import Heartbeat, LeaseLost, job_queue
+from services.chunk_store import chunk_store
+
+
+# Progress steps reported through processed_items / total_items
+INGEST_STEPS = 4  # extract text, embeddings, AI metadata, store
+
+# A single AIExtractor call only reads the first 8000 characters, so only that
+# prefix is kept in memory. In prefix mode with a known document type it can
+# start as soon as that much text has been extracted; in map_reduce mode longer
+# documents are extracted from their chunks instead
+METADATA_PREFIX_CHARS = 8000
+
+
+# Documents loaded per step of a bulk metadata extraction job
+EXTRACT_GROUP_SIZE = 50
+
+
+class StageTimings:
+    """
+    Per-stage timings for one ingest job. Stages overlap, so each records
+    its wall-clock span (offsets from the job start) and its own busy time,
+    excluding time spent in stages nested inside it on the same thread
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def measure(self, stage: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        nested = [0.0]
+        stack.append(nested)
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            stack.pop()
+            if stack:
+                stack[-1][0] += end - start
+            self._record(stage, start, end, end - start - nested[0])
+
+    def timed(self, iterable: Iterable, stage: str) -> Iterator:
+        """Wrap an iterator so the time spent producing each item counts towards stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.measure(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {
+                stage: {key: int(value) for key, value in entry.items()}
+                for stage, entry in self.stages.items()
+            }
+        result["total_ms"] = int((time.time() - self.started) * 1000)
+        return result
+
+    def _record(self, stage: str, start: float, end: float, busy: float) -> None:
+        start_ms = (start - self.started) * 1000
+        end_ms = (end - self.started) * 1000
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"start_ms": start_ms, "end_ms": end_ms, "busy_ms": 0.0})
+            entry["start_ms"] = min(entry["start_ms"], start_ms)
+            entry["end_ms"] = max(entry["end_ms"], end_ms)
+            entry["busy_ms"] += busy * 1000
+
+
+class FullTextWriter:
+    """
+    Spool a document's full_text to a temporary file while extraction
+    streams, so the worker never holds the whole text, then write it to the
+    row in slices in the job's final step. Writing only then keeps the
+    document row unlocked while the job runs, so API updates and deletes
+    of the document are not blocked behind it.
+    """
+
+    def __init__(self, db: Session, document_id: Any, flush_chars: int = None):
+        self.db = db
+        self.document_id = document_id
+        self.flush_chars = flush_chars or settings.full_text_flush_chars
+        self.spool = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+
+    def write(self, text: str) -> None:
+        self.spool.write(text)
+
+    def save(self) -> None:
+        """Write the spooled text to the row (joins the session's transaction)"""
+        self.spool.seek(0)
+        # Start over (a retried job may have written part of the text)
+        self._update("")
+        while True:
+            part = self.spool.read(self.flush_chars)
+            if not part:
+                break
+            self._update(Document.full_text + part)
+
+    def close(self) -> None:
+        self.spool.close()
+
+    def _update(self, value) -> None:
+        self.db.query(Document).filter(Document.id == self.document_id).update(
+            {Document.full_text: value}, synchronize_session=False
+        )
+
+
+class IngestionWorker:
+    """One worker process: claims a job, runs its handler, records the outcome"""
+
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.queue = job_queue
+        self.doc_processor = DocumentProcessor()
+        self.ai_extractor = AIExtractor()
+        self.embedding_service = EmbeddingService()
+
+        self.handlers: Dict[str, Callable[[Session, ProcessingJob, Optional[Document]], Dict[str, Any]]] = {
+            "document_upload": self.process_document,
+            "reindex": self.reindex_document,
+            "extract_metadata": self.extract_metadata,
+        }
+
+    def run_forever(self, stop_event: Optional[threading.Event] = None) -> None:
+        """Poll the queue until stop_event is set"""
+        print(f"✅ Ingestion worker {self.worker_id} started")
+
+        while stop_event is None or not stop_event.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                print(f"❌ Ingestion worker {self.worker_id}: {e}")
+                worked = False
+
+            if not worked:
+                time.sleep(settings.ingest_poll_interval_seconds)
+
+    def run_once(self) -> bool:
+        """
+        Claim and run at most one job
+
+        Returns:
+            True if a job was run, False if the queue was empty
+        """
+        db = SessionLocal()
+        try:
+            job = self.queue.claim(db, self.worker_id, list(self.handlers))
+            if job is None:
+                return False
+
+            document = None
+            if job.document_id is not None:
+                document = db.query(Document).filter(Document.id == job.document_id).first()
+                if document is None:
+                    # Deleted while queued
+                    self.queue.complete(db, job, self.worker_id, {"skipped": "document deleted"})
+                    return True
+
+            with Heartbeat(self.queue, job.id, self.worker_id):
+                try:
+                    output = self.handlers[job.job_type](db, job, document)
+                except LeaseLost:
+                    raise
+                except Exception as e:
+                    db.rollback()
+                    retrying = self.queue.fail(db, job, self.worker_id, str(e))
+                    print(f"⚠️ Job {job.id} ({job.job_type}) failed: {e}" + (" - retry scheduled" if retrying else ""))
+                    return True
+
+                self.queue.complete(db, job, self.worker_id, output)
+            return True
+        except LeaseLost as e:
+            # Another worker runs the job now; leave everything to it
+            db.rollback()
+            print(f"⚠️ Job {job.id} ({job.job_type}) abandoned: {e}")
+            return True
+        finally:
+            db.close()
+
+    def process_document(self, db: Session, job: ProcessingJob, doc: Document) -> Dict[str, Any]:
+        """
+        Extract, enrich, chunk and embed a newly uploaded document
+
+        The stages overlap: segments are chunked as they are extracted,
+        embedding batches are sent as soon as enough chunks exist, and AI
+        metadata extraction runs in its own thread alongside both. Memory is
+        bounded by the batch size, not the document: full_text is spooled to
+        a temporary file and written to the row in the final step, and each embedded batch's rows and vectors are written as
+        soon as it returns, inside the transaction that finally commits the
+        document. Vectors in a store outside the database are only written
+        while the job's lease is confirmed, and deleted again if the job fails.
+        """
+        return self._ingest(db, job, doc)
+
+    def reindex_document(self, db: Session, job: ProcessingJob, doc: Document) -> Dict[str, Any]:
+        """
+        Re-index an updated document through the same pipeline: each chunk is
+        matched to the stored ones by content hash as it is cut, only new or
+        changed chunks are embedded, unchanged chunks keep their vectors, and
+        stored chunks nothing matched are deleted before the commit
+        """
+        return self._ingest(db, job, doc, reindex=True)
+
+    def _ingest(self, db: Session, job: ProcessingJob, doc: Document, reindex: bool = False) -> Dict[str, Any]:
+        """Pipeline behind process_document and reindex_document"""
+        timings = StageTimings()
+        file_path = doc.file_path
+        document_type = doc.document_type
+        extract_metadata = settings.enable_auto_extraction
+        # Long documents: map-reduce over the chunks once chunking is done
+        map_reduce = settings.metadata_extraction_mode == "map_reduce"
+
+        # Update status to processing
+        doc.status = "processing"
+        db.commit()
+        self.queue.progress(job, self.worker_id, 0, INGEST_STEPS)
+
+        # Only bounded state is kept about the text itself: the prefix AI
+        # extraction reads and keyword counts for type detection (full_text
+        # goes to a spool file)
+        prefix_parts: List[str] = []
+        prefix_chars = 0
+        text_chars = 0
+        type_counts = Counter()
+        full_text = FullTextWriter(db, doc.id) if settings.store_full_text else None
+
+        def pieces() -> Iterator[str]:
+            nonlocal prefix_chars, text_chars
+            for segment in timings.timed(self.doc_processor.iter_segments(file_path, doc.content_hash), "extract"):
+                text = segment.text
+                text_chars += len(text)
+                # One character past the limit, so AIExtractor still marks the text as truncated
+                if prefix_chars <= METADATA_PREFIX_CHARS:
+                    prefix = text[:METADATA_PREFIX_CHARS + 1 - prefix_chars]
+                    prefix_parts.append(prefix)
+                    prefix_chars += len(prefix)
+                if not document_type:
+                    type_counts.update(segment.type_counts)
+                if full_text is not None:
+                    full_text.write(text)
+                yield text
+
+        vector_store = self.embedding_service.vector_store
+        # Re-indexing: stored chunks by content hash (unchanged ones keep their vectors)
+        matcher = self.embedding_service.match_stored_chunks(str(doc.id)) if reindex else None
+        # Vector IDs written so far and, for batches written before the
+        # document type was known, their vector metadata; the vectors this
+        # job added are deleted again if it fails
+        written_ids: List[str] = []
+        untyped_metadatas: List[Dict[str, Any]] = []
+        added_ids: List[str] = []
+        chunk_count = 0
+
+        def confirm_lease() -> None:
+            """Writes to a store outside db's transaction only happen while the job is still ours"""
+            if not vector_store.joins_transaction:
+                self.queue.confirm_lease(job, self.worker_id)
+
+        def store(
+            chunks: List[Dict[str, Any]],
+            reused: List[Dict[str, Any]],
+            changed: List[Dict[str, Any]],
+            embeddings: List[List[float]]
+        ) -> None:
+            nonlocal chunk_count
+            with timings.measure("store"):
+                if document_type:
+                    for chunk in chunks:
+                        chunk['metadata']['document_type'] = document_type
+                chunk_store.append_chunks(db, doc.id, chunks)
+                confirm_lease()
+                ids, metadatas = self.embedding_service.refresh_chunks(str(doc.id), reused, db)
+                new_ids, new_metadatas = [], []
+                if changed:
+                    new_ids, new_metadatas = self.embedding_service.store_chunks(str(doc.id), changed, embeddings, db)
+            added_ids.extend(new_ids)
+            written_ids.extend(ids + new_ids)
+            if not document_type:
+                untyped_metadatas.extend(metadatas + new_metadatas)
+            chunk_count += len(chunks)
+
+        # (batch, reused chunks, changed chunks, embedding future) in chunk order, written as they finish
+        pending: Deque[Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]], Future]] = deque()
+
+        def submit() -> None:
+            pending.append((batch, reused, changed, embedding_pool.submit(self._embed, changed, timings)))
+
+        def drain(wait: bool) -> None:
+            """Write finished batches in order; with wait, block for the oldest"""
+            while pending and (wait or pending[0][3].done()):
+                chunks, batch_reused, batch_changed, future = pending.popleft()
+                store(chunks, batch_reused, batch_changed, future.result())
+                wait = False
+
+        # The batch being filled: all its chunks, those matched to a stored vector, those to embed
+        batch: List[Dict[str, Any]] = []
+        reused: List[Dict[str, Any]] = []
+        changed: List[Dict[str, Any]] = []
+        metadata_future = None
+        doc_metadata = None
+
+        embedding_pool = ThreadPoolExecutor(max_workers=settings.ingest_embedding_workers)
+        metadata_pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            try:
+                chunk_store.delete_chunks(db, doc.id)
+                if matcher is not None:
+                    vector_store.begin_rewrite(str(doc.id), db)
+
+                # Steps 1 + 3: extract and chunk segment by segment, embedding batches in the background
+                for chunk in timings.timed(self.embedding_service.iter_chunks(pieces()), "chunk"):
+                    batch.append(chunk)
+                    if matcher is not None and matcher.match(chunk):
+                        reused.append(chunk)
+                    else:
+                        changed.append(chunk)
+
+                    if len(batch) >= settings.ingest_pipeline_batch_chunks:
+                        submit()
+                        batch, reused, changed = [], [], []
+                        # Backpressure: extraction may not run far ahead of the embedding calls
+                        drain(wait=len(pending) > 2 * settings.ingest_embedding_workers)
+
+                    if (
+                        extract_metadata and not map_reduce and metadata_future is None
+                        and document_type and prefix_chars > METADATA_PREFIX_CHARS
+                    ):
+                        metadata_future = metadata_pool.submit(
+                            self._extract_metadata, "".join(prefix_parts), document_type, timings
+                        )
+
+                if batch:
+                    submit()
+                    batch, reused, changed = [], [], []
+
+                # Cleaned lines are stripped, so the text has no surrounding whitespace
+                if text_chars < 10:
+                    raise ValueError("Extracted text is too short or empty")
+
+                # Detect document type if not set (written to the row in Step 4)
+                if not document_type:
+                    document_type = self.doc_processor.type_classifier.classify(type_counts, doc.filename)
+
+                self.queue.progress(job, self.worker_id, 1)
+
+                # Step 2: Extract metadata using AI (unless it already started)
+                long_document = map_reduce and text_chars > METADATA_PREFIX_CHARS
+                if extract_metadata and metadata_future is None and not long_document:
+                    metadata_future = metadata_pool.submit(
+                        self._extract_metadata, "".join(prefix_parts), document_type, timings
+                    )
+
+                while pending:
+                    drain(wait=True)
+
+                stale_ids = matcher.stale_ids() if matcher is not None else []
+                if stale_ids and vector_store.joins_transaction:
+                    with timings.measure("store"):
+                        vector_store.delete(stale_ids, db)
+
+                # Batches written before the type was detected get it now
+                if untyped_metadatas:
+                    with timings.measure("store"):
+                        chunk_store.merge_metadata(db, doc.id, {'document_type': document_type})
+                        if not vector_store.joins_transaction:
+                            for metadata in untyped_metadatas:
+                                metadata['document_type'] = document_type
+                            confirm_lease()
+                            vector_store.update_metadata(written_ids[:len(untyped_metadatas)], untyped_metadatas)
+
+                self.queue.progress(job, self.worker_id, 2)
+
+                if extract_metadata and metadata_future is None:
+                    # Map-reduce over the chunk rows just written, read back section by section
+                    metadata_future = metadata_pool.submit(
+                        self._extract_metadata_from_sections, self._stored_sections(db, doc.id), document_type, timings
+                    )
+
+                if metadata_future is not None:
+                    metadata, extract_error = metadata_future.result()
+                    if not extract_error:
+                        doc_metadata = metadata
+
+                self.queue.progress(job, self.worker_id, 3)
+            finally:
+                embedding_pool.shutdown(wait=True, cancel_futures=True)
+                metadata_pool.shutdown(wait=True, cancel_futures=True)
+
+            # Step 4: Mark as completed - committed together with the rows and vectors.
+            # The document row is only updated (and locked) from here on.
+            with timings.measure("store"):
+                if full_text is not None:
+                    full_text.save()
+                else:
+                    doc.full_text = None
+                doc.mime_type, _ = mimetypes.guess_type(file_path)
+                doc.document_type = document_type
+                if doc_metadata is not None:
+                    doc.doc_metadata = doc_metadata
+                doc.status = "completed"
+                doc.error_message = None
+                doc.processed_date = datetime.now(timezone.utc)
+
+                # Holds the job row until the commit, so no other worker can claim it meanwhile
+                self.queue.check_lease(db, job, self.worker_id)
+                db.commit()
+        except LeaseLost:
+            # The new owner rewrites the same vector IDs
+            raise
+        except Exception:
+            db.rollback()
+            if added_ids and not vector_store.joins_transaction:
+                vector_store.delete(added_ids)
+            raise
+        finally:
+            if full_text is not None:
+                full_text.close()
+
+        if stale_ids and not vector_store.joins_transaction:
+            # Only after the commit, so a failed job leaves the old chunks searchable
+            with timings.measure("store"):
+                confirm_lease()
+                vector_store.delete(stale_ids)
+
+        output: Dict[str, Any] = {"chunks": chunk_count}
+        if matcher is not None:
+            output.update(embedded=matcher.embedded, reused=matcher.reused, deleted=len(stale_ids))
+            print(f"✅ Re-indexed {doc.id}: {output}")
+        return {**output, "timings": timings.as_dict()}
+
+    def _stored_sections(self, db: Session, document_id: Any) -> List[str]:
+        """AIExtractor.build_sections over a document's chunk rows, reading only the sections it keeps"""
+        lengths = [
+            length for (length,) in db.query(func.length(Chunk.chunk_text)).filter(
+                Chunk.document_id == document_id
+            ).order_by(Chunk.chunk_index)
+        ]
+        plan = self.ai_extractor.section_plan(lengths)
+        section_of = {position: n for n, (start, end) in enumerate(plan) for position in range(start, end)}
+
+        parts: List[List[str]] = [[] for _ in plan]
+        rows = db.query(Chunk.chunk_text).filter(
+            Chunk.document_id == document_id
+        ).order_by(Chunk.chunk_index).yield_per(256)
+        for position, (chunk_text,) in enumerate(rows):
+            if position in section_of:
+                parts[section_of[position]].append(chunk_text)
+        return ["\n".join(part) for part in parts]
+
+    def _embed(self, chunks: List[Dict[str, Any]], timings: StageTimings) -> List[List[float]]:
+        if not chunks:
+            return []
+        with timings.measure("embed"):
+            return self.embedding_service.create_embeddings([chunk['chunk_text'] for chunk in chunks])
+
+    def _extract_metadata(self, text: str, document_type: str, timings: StageTimings):
+        with timings.measure("metadata"):
+            return self.ai_extractor.extract_metadata(text, document_type)
+
+    def _extract_metadata_from_sections(self, sections: List[str], document_type: str, timings: StageTimings):
+        with timings.measure("metadata"):
+            return self.ai_extractor.extract_metadata_from_sections(sections, document_type)
+
+    def extract_metadata(self, db: Session, job: ProcessingJob, _document: Optional[Document]) -> Dict[str, Any]:
+        """
+        Re-run AI metadata extraction for input_data["document_ids"]
+
+        Short documents are grouped by type and packed into shared prompts;
+        long ones go through map-reduce over their stored chunks (or a single
+        prefix call). Results come from the extraction cache when the text,
+        schema and model are unchanged.
+        """
+        document_ids = (job.input_data or {}).get("document_ids") or []
+        map_reduce = settings.metadata_extraction_mode == "map_reduce"
+        updated = failed = 0
+
+        for start in range(0, len(document_ids), EXTRACT_GROUP_SIZE):
+            documents = db.query(Document).filter(
+                Document.id.in_(document_ids[start:start + EXTRACT_GROUP_SIZE])
+            ).all()
+
+            # document_type -> [(document, text)] for the batch API
+            short: Dict[str, List] = {}
+            results = []
+
+            for document in documents:
+                text = document.full_text
+                if text is None:
+                    text, _, error = self.doc_processor.process_file(document.file_path, document.content_hash)
+                    if error:
+                        results.append((document, ({}, error)))
+                        continue
+
+                document_type = document.document_type or "general"
+                if map_reduce and len(text) > METADATA_PREFIX_CHARS:
+                    chunks = [
+                        {"chunk_text": chunk_text}
+                        for (chunk_text,) in db.query(Chunk.chunk_text).filter(
+                            Chunk.document_id == document.id
+                        ).order_by(Chunk.chunk_index)
+                    ]
+                    results.append((document, self.ai_extractor.extract_metadata_from_chunks(chunks, document_type)))
+                else:
+                    short.setdefault(document_type, []).append((document, text))
+
+            for document_type, items in short.items():
+                extracted = self.ai_extractor.extract_metadata_batch([text for _, text in items], document_type)
+                results.extend(zip([document for document, _ in items], extracted))
+
+            for document, (metadata, error) in results:
+                if error:
+                    failed += 1
+                    print(f"⚠️ Metadata extraction failed for {document.id}: {error}")
+                else:
+                    document.doc_metadata = metadata
+                    updated += 1
+
+            self.queue.check_lease(db, job, self.worker_id)
+            db.commit()
+            self.queue.progress(job, self.worker_id, min(start + EXTRACT_GROUP_SIZE, len(document_ids)))
+            # Let the group's texts be freed
+            for document in documents:
+                db.expunge(document)
+
+        return {"updated": updated, "failed": failed}
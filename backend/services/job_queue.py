@@ -0,0 +1,325 @@
+"""
+Job Queue - durable ingestion jobs on the processing_jobs table
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+import threading
+from sqlalchemy import and_, or_, exists, text
+from sqlalchemy.orm import Session, aliased
+from config import settings
+from database import SessionLocal
+from models import Document, ProcessingJob
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker has claimed it"""
+
+
+class JobQueue:
+    """
+    Postgres-backed work queue for document ingestion
+
+    Workers claim one job at a time with SELECT ... FOR UPDATE SKIP LOCKED,
+    so concurrent workers never pick the same row. A claimed job holds a
+    lease that a Heartbeat renews while the handler runs; a job whose lease
+    expired (its worker crashed or was killed) becomes claimable again.
+    Progress, complete and fail only write while the caller still holds
+    the lease and raise LeaseLost otherwise. Failures are
+    retried with exponential backoff until retry_count exceeds max_retries.
+    The owning document's status mirrors the job.
+    """
+
+    def __init__(
+        self,
+        lease_seconds: int = None,
+        max_retries: int = None,
+        retry_backoff_seconds: int = None
+    ):
+        self.lease_seconds = lease_seconds or settings.processing_timeout_seconds
+        self.max_retries = max_retries if max_retries is not None else settings.ingest_max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds or settings.ingest_retry_backoff_seconds
+
+    def enqueue(
+        self,
+        db: Session,
+        job_type: str,
+        document_id: Any = None,
+        input_data: Dict = None,
+        total_items: int = None
+    ) -> ProcessingJob:
+        """
+        Add a job (committed together with any pending changes in db)
+
+        Args:
+            db: Database session
+            job_type: Handler name, e.g. 'document_upload' or 'reindex'
+            document_id: Document the job works on
+            input_data: Handler arguments (JSON)
+            total_items: Expected number of progress steps, if known
+
+        Returns:
+            The queued ProcessingJob
+        """
+        job = ProcessingJob(
+            job_type=job_type,
+            status="queued",
+            document_id=document_id,
+            input_data=input_data or {},
+            total_items=total_items,
+            processed_items=0,
+            retry_count=0,
+            max_retries=self.max_retries,
+            run_after=utcnow()
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    def claim(self, db: Session, worker_id: str, job_types: List[str] = None) -> Optional[ProcessingJob]:
+        """
+        Lease the oldest runnable job, or return None when the queue is empty
+
+        Runnable means queued and due, or running with an expired lease.
+        """
+        # Jobs passed over because their document is busy
+        skipped = []
+        while True:
+            now = utcnow()
+            query = db.query(ProcessingJob).filter(or_(
+                and_(ProcessingJob.status == "queued", ProcessingJob.run_after <= now),
+                and_(ProcessingJob.status == "running", ProcessingJob.lease_expires_at < now)
+            ))
+            if job_types:
+                query = query.filter(ProcessingJob.job_type.in_(job_types))
+            if skipped:
+                query = query.filter(ProcessingJob.id.notin_(skipped))
+
+            # One job per document at a time (re-checked under a lock in _lock_document)
+            query = query.filter(~self._document_busy(ProcessingJob, now))
+
+            job = query.order_by(ProcessingJob.created_at).with_for_update(skip_locked=True).first()
+
+            if job is None:
+                db.commit()
+                return None
+
+            if not self._lock_document(db, job, now):
+                skipped.append(job.id)
+                db.rollback()
+                continue
+
+            if job.status == "running":
+                # The previous worker died while holding the lease
+                job.retry_count = (job.retry_count or 0) + 1
+                if job.retry_count > job.max_retries:
+                    self._finish_failed(db, job, job.error_message or "Job lease expired", now)
+                    db.commit()
+                    continue
+
+            job.status = "running"
+            job.locked_by = worker_id
+            job.lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+            job.started_at = now
+            job.completed_at = None
+            job.processed_items = 0
+            db.commit()
+            return job
+
+    @staticmethod
+    def _document_busy(job, now: datetime):
+        """EXISTS: another job for job's document is running under a live lease"""
+        busy = aliased(ProcessingJob)
+        return exists().where(and_(
+            busy.document_id == job.document_id,
+            busy.id != job.id,
+            busy.status == "running",
+            busy.lease_expires_at >= now
+        ))
+
+    def _lock_document(self, db: Session, job: ProcessingJob, now: datetime) -> bool:
+        """
+        Serialize claims for job's document: take a transaction-scoped
+        advisory lock on it, then repeat the busy check in a new statement.
+        Under READ COMMITTED that statement sees every claim committed
+        before the lock was granted, so two workers can no longer both pass
+        the check for different jobs of the same document.
+
+        Returns:
+            False if another worker is claiming, or already runs, a job for the document
+        """
+        if job.document_id is None:
+            return True
+        locked = db.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:key))"),
+            {"key": f"document:{job.document_id}"}
+        ).scalar()
+        if not locked:
+            return False
+        return not db.query(self._document_busy(job, now)).scalar()
+
+    def renew(self, db: Session, job_id: Any, worker_id: str, **values) -> bool:
+        """
+        Extend the lease (and set values) if worker_id still holds it; commits db
+
+        Returns:
+            False if the job has been taken over or finished
+        """
+        updated = db.query(ProcessingJob).filter(
+            ProcessingJob.id == job_id,
+            ProcessingJob.status == "running",
+            ProcessingJob.locked_by == worker_id
+        ).update(
+            {**values, "lease_expires_at": utcnow() + timedelta(seconds=self.lease_seconds)},
+            synchronize_session=False
+        )
+        db.commit()
+        return updated > 0
+
+    def progress(self, job: ProcessingJob, worker_id: str, processed_items: int, total_items: int = None) -> None:
+        """
+        Record progress and extend the lease
+
+        Written on a session of its own, so the handler's transaction stays
+        open. Raises LeaseLost if another worker has taken the job over.
+        """
+        values = {"processed_items": processed_items}
+        if total_items is not None:
+            values["total_items"] = total_items
+        self._renew_or_raise(job, worker_id, **values)
+
+    def confirm_lease(self, job: ProcessingJob, worker_id: str) -> None:
+        """
+        Extend the lease, on a session of its own, before a write that does
+        not roll back with the handler's transaction (an external vector
+        store). The fresh lease cannot expire, so the job cannot be taken
+        over, before that write is done. Raises LeaseLost.
+        """
+        self._renew_or_raise(job, worker_id)
+
+    def _renew_or_raise(self, job: ProcessingJob, worker_id: str, **values) -> None:
+        db = SessionLocal()
+        try:
+            if not self.renew(db, job.id, worker_id, **values):
+                raise LeaseLost(f"Job {job.id} is no longer held by {worker_id}")
+        finally:
+            db.close()
+
+    def check_lease(self, db: Session, job: ProcessingJob, worker_id: str) -> None:
+        """
+        Lock the job row in db's transaction and make sure worker_id holds it
+
+        Until db commits, no other worker can claim the job, so a handler
+        calls this right before committing its results. Raises LeaseLost.
+        """
+        locked_by = db.query(ProcessingJob.locked_by).filter(
+            ProcessingJob.id == job.id
+        ).with_for_update().scalar()
+        if locked_by != worker_id:
+            raise LeaseLost(f"Job {job.id} is now held by {locked_by or 'no worker'}")
+
+    def complete(self, db: Session, job: ProcessingJob, worker_id: str, output_data: Dict = None) -> None:
+        self.check_lease(db, job, worker_id)
+        job.status = "completed"
+        job.output_data = output_data
+        job.error_message = None
+        job.completed_at = utcnow()
+        job.locked_by = None
+        job.lease_expires_at = None
+        if job.total_items is not None:
+            job.processed_items = job.total_items
+        db.commit()
+
+    def fail(self, db: Session, job: ProcessingJob, worker_id: str, error: str) -> bool:
+        """
+        Record a failed attempt
+
+        Returns:
+            True if a retry was scheduled, False if the job is now failed
+        """
+        self.check_lease(db, job, worker_id)
+        now = utcnow()
+        job.retry_count = (job.retry_count or 0) + 1
+        job.error_message = error
+        job.locked_by = None
+        job.lease_expires_at = None
+
+        if job.retry_count > job.max_retries:
+            self._finish_failed(db, job, error, now)
+            db.commit()
+            return False
+
+        job.status = "queued"
+        job.run_after = now + timedelta(seconds=min(self.retry_backoff_seconds * 2 ** (job.retry_count - 1), 3600))
+        self._update_document(db, job, status="pending", error_message=error)
+        db.commit()
+        return True
+
+    def latest_for_document(self, db: Session, document_id: Any) -> Optional[ProcessingJob]:
+        return db.query(ProcessingJob).filter(
+            ProcessingJob.document_id == document_id
+        ).order_by(ProcessingJob.created_at.desc()).first()
+
+    def _finish_failed(self, db: Session, job: ProcessingJob, error: str, now: datetime) -> None:
+        job.status = "failed"
+        job.error_message = error
+        job.completed_at = now
+        job.locked_by = None
+        job.lease_expires_at = None
+        self._update_document(db, job, status="failed", error_message=error)
+
+    def _update_document(self, db: Session, job: ProcessingJob, **values) -> None:
+        if job.document_id is None:
+            return
+        db.query(Document).filter(Document.id == job.document_id).update(
+            {**values, "retry_count": job.retry_count},
+            synchronize_session=False
+        )
+
+
+class Heartbeat:
+    """
+    Keep a claimed job's lease alive while its handler runs
+
+    A thread renews the lease every third of lease_seconds on a session of
+    its own, so long stretches between progress updates (extracting a large
+    PDF, waiting for embeddings) never let it lapse. It stops once the
+    renewal finds the job held by another worker.
+    """
+
+    def __init__(self, queue: JobQueue, job_id: Any, worker_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = max(queue.lease_seconds / 3, 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{job_id}", daemon=True)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                if not self.queue.renew(db, self.job_id, self.worker_id):
+                    print(f"⚠️ Job {self.job_id}: lease lost to another worker")
+                    return
+            except Exception as e:
+                # Try again next interval; the lease outlasts two misses
+                print(f"⚠️ Job {self.job_id}: lease renewal failed: {e}")
+            finally:
+                db.close()
+
+
+# Global instance
+job_queue = JobQueue()
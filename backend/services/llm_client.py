@@ -2,9 +2,83 @@
 Universal LLM Client - 支持多個 LLM 提供商
 """
 import os
-from typing import Optional, Dict, Any, List
-import requests
+import asyncio
+from typing import Optional, Dict, Any, List, Tuple, Callable, AsyncIterator
+import httpx
 import json
+from services.http_pool import http_pool
+from services.embedding_batcher import AdaptiveBatcher
+
+
+OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_EMBEDDINGS_URL = "https://openrouter.ai/api/v1/embeddings"
+GROK_CHAT_URL = "https://api.x.ai/v1/chat/completions"
+GOOGLE_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+
+# OpenAI 相容的 JSON 模式（OpenAI、Grok、OpenRouter）
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+# 供應商拒絕 JSON 模式時，錯誤內容會提及的參數
+JSON_MODE_PARAMETERS = ("response_format", "json_object", "responseMimeType")
+
+
+def is_json_mode_rejection(error: Exception) -> bool:
+    """請求是否因 JSON 模式參數被拒（HTTP 400 且錯誤內容提及該參數）"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status != 400:
+        return False
+    
+    try:
+        detail = response.text if response is not None else ""
+    except Exception:
+        detail = ""
+    detail = f"{error} {detail}"
+    return any(name in detail for name in JSON_MODE_PARAMETERS)
+
+
+def _openai_sse_delta(data: Dict) -> Optional[str]:
+    """從 OpenAI 相容的 SSE 事件中取出文字增量"""
+    choices = data.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def _gemini_sse_delta(data: Dict) -> Optional[str]:
+    """從 Gemini streamGenerateContent 事件中取出文字增量"""
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts) or None
+
+
+def _parse_sse_line(line: str) -> Optional[Dict]:
+    """解析單行 SSE，非資料行或 [DONE] 回傳 None"""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if not data or data == "[DONE]":
+        return None
+    return json.loads(data)
+
+
+def _fallback_embeddings(texts: List[str]) -> List[List[float]]:
+    """對於不支持嵌入的提供商，使用簡單的文本哈希作為替代"""
+    import hashlib
+    import numpy as np
+    
+    embeddings = []
+    for text in texts:
+        # 使用文本哈希創建偽嵌入
+        hash_obj = hashlib.sha256(text.encode())
+        hash_bytes = hash_obj.digest()
+        # 轉換為 1536 維向量（與 OpenAI 嵌入維度匹配）
+        embedding = np.frombuffer(hash_bytes * 48, dtype=np.float32)[:1536].tolist()
+        embeddings.append(embedding)
+    
+    return embeddings
 
 
 class UniversalLLMClient:
@@ -24,6 +98,14 @@ class UniversalLLMClient:
         self.grok_model = os.getenv("GROK_MODEL", "grok-beta")
         self.openrouter_model = os.getenv("OPENROUTER_MODEL", "google/gemini-2.0-flash-exp:free")
         self.openai_model = os.getenv("LLM_MODEL", "gpt-4o-mini")
+        self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+        
+        # Pooled HTTP clients (one per provider) and a lazily built OpenAI client
+        self.http_pool = http_pool
+        self._openai_client = None
+        
+        # Concurrent, adaptive embedding batches (shared with the async client)
+        self.embedding_batcher = AdaptiveBatcher()
         
         print(f"✅ LLM Provider: {self.provider}")
     
@@ -31,24 +113,35 @@ class UniversalLLMClient:
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        json_mode: bool = False
     ) -> str:
-        """統一的聊天完成接口"""
+        """統一的聊天完成接口（json_mode：要求提供商只輸出 JSON 物件）"""
         
         if self.provider == "google":
-            return self._google_chat(messages, temperature, max_tokens)
+            return self._google_chat(messages, temperature, max_tokens, json_mode)
         elif self.provider == "grok":
-            return self._grok_chat(messages, temperature, max_tokens)
+            return self._grok_chat(messages, temperature, max_tokens, json_mode)
         elif self.provider == "openrouter":
-            return self._openrouter_chat(messages, temperature, max_tokens)
+            return self._openrouter_chat(messages, temperature, max_tokens, json_mode)
         elif self.provider == "openai":
-            return self._openai_chat(messages, temperature, max_tokens)
+            return self._openai_chat(messages, temperature, max_tokens, json_mode)
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
     
-    def _google_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
-        """Google AI (Gemini) API"""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.google_model}:generateContent?key={self.google_api_key}"
+    def _google_request(
+        self,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        stream: bool = False,
+        json_mode: bool = False
+    ) -> Tuple[str, Dict, Dict]:
+        """Google AI (Gemini) request: (url, headers, payload)"""
+        if stream:
+            url = f"{GOOGLE_BASE_URL}/{self.google_model}:streamGenerateContent?alt=sse&key={self.google_api_key}"
+        else:
+            url = f"{GOOGLE_BASE_URL}/{self.google_model}:generateContent?key={self.google_api_key}"
         
         # 轉換消息格式
         contents = []
@@ -66,17 +159,20 @@ class UniversalLLMClient:
                 "maxOutputTokens": max_tokens
             }
         }
+        if json_mode:
+            payload["generationConfig"]["responseMimeType"] = "application/json"
         
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        
-        result = response.json()
-        return result["candidates"][0]["content"]["parts"][0]["text"]
+        return url, {}, payload
     
-    def _grok_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
-        """Grok API (xAI)"""
-        url = "https://api.x.ai/v1/chat/completions"
-        
+    def _grok_request(
+        self,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        stream: bool = False,
+        json_mode: bool = False
+    ) -> Tuple[str, Dict, Dict]:
+        """Grok API (xAI) request: (url, headers, payload)"""
         headers = {
             "Authorization": f"Bearer {self.grok_api_key}",
             "Content-Type": "application/json"
@@ -88,19 +184,22 @@ class UniversalLLMClient:
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        if stream:
+            payload["stream"] = True
+        if json_mode:
+            payload["response_format"] = JSON_OBJECT_FORMAT
         
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        return GROK_CHAT_URL, headers, payload
     
-    def _openrouter_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
-        """OpenRouter API"""
-        import time
-        
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        
+    def _openrouter_request(
+        self,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        stream: bool = False,
+        json_mode: bool = False
+    ) -> Tuple[str, Dict, Dict]:
+        """OpenRouter API request: (url, headers, payload)"""
         headers = {
             "Authorization": f"Bearer {self.openrouter_api_key}",
             "Content-Type": "application/json",
@@ -114,13 +213,59 @@ class UniversalLLMClient:
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        if stream:
+            payload["stream"] = True
+        if json_mode:
+            payload["response_format"] = JSON_OBJECT_FORMAT
+        
+        return OPENROUTER_CHAT_URL, headers, payload
+    
+    def _openrouter_embeddings_request(self, batch: List[str]) -> Tuple[str, Dict, Dict]:
+        """OpenRouter embeddings request: (url, headers, payload)"""
+        headers = {
+            "Authorization": f"Bearer {self.openrouter_api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": self.embedding_model,  # OpenRouter 支持 OpenAI 嵌入模型
+            "input": batch
+        }
+        
+        return OPENROUTER_EMBEDDINGS_URL, headers, payload
+    
+    def _google_chat(self, messages: List[Dict], temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        """Google AI (Gemini) API"""
+        url, headers, payload = self._google_request(messages, temperature, max_tokens, json_mode=json_mode)
+        
+        response = self.http_pool.get("google").post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result["candidates"][0]["content"]["parts"][0]["text"]
+    
+    def _grok_chat(self, messages: List[Dict], temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        """Grok API (xAI)"""
+        url, headers, payload = self._grok_request(messages, temperature, max_tokens, json_mode=json_mode)
+        
+        response = self.http_pool.get("grok").post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result["choices"][0]["message"]["content"]
+    
+    def _openrouter_chat(self, messages: List[Dict], temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        """OpenRouter API"""
+        import time
+        
+        url, headers, payload = self._openrouter_request(messages, temperature, max_tokens, json_mode=json_mode)
         
         max_retries = 3
         retry_delay = 1
         
         for attempt in range(max_retries + 1):
             try:
-                response = requests.post(url, headers=headers, json=payload)
+                response = self.http_pool.get("openrouter").post(url, headers=headers, json=payload)
                 
                 if response.status_code == 429:
                     if attempt < max_retries:
@@ -133,8 +278,8 @@ class UniversalLLMClient:
                 response.raise_for_status()
                 result = response.json()
                 return result["choices"][0]["message"]["content"]
-                
-            except requests.exceptions.HTTPError as e:
+            
+            except httpx.HTTPStatusError as e:
                 # If it's a 429 but we've exhausted retries or some other error
                 if response.status_code == 429:
                      raise Exception(f"OpenRouter Rate Limit Exceeded after {max_retries} retries. Please try again later.")
@@ -148,92 +293,280 @@ class UniversalLLMClient:
         
         raise Exception("Failed to get response from OpenRouter")
     
-    def _openai_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    def _openai_chat(self, messages: List[Dict], temperature: float, max_tokens: int, json_mode: bool = False) -> str:
         """OpenAI API"""
-        from openai import OpenAI
-        
-        client = OpenAI(api_key=self.openai_api_key)
+        client = self._get_openai_client()
         
+        extra = {"response_format": JSON_OBJECT_FORMAT} if json_mode else {}
         response = client.chat.completions.create(
             model=self.openai_model,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            **extra
         )
         
         return response.choices[0].message.content
     
+    def _stream_request(
+        self,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int
+    ) -> Tuple[str, Dict, Dict, Callable[[Dict], Optional[str]]]:
+        """SSE 串流請求：(url, headers, payload, 增量解析函式)"""
+        if self.provider == "google":
+            url, headers, payload = self._google_request(messages, temperature, max_tokens, stream=True)
+            return url, headers, payload, _gemini_sse_delta
+        elif self.provider == "grok":
+            url, headers, payload = self._grok_request(messages, temperature, max_tokens, stream=True)
+            return url, headers, payload, _openai_sse_delta
+        elif self.provider == "openrouter":
+            url, headers, payload = self._openrouter_request(messages, temperature, max_tokens, stream=True)
+            return url, headers, payload, _openai_sse_delta
+        else:
+            raise ValueError(f"Unsupported provider: {self.provider}")
+    
+    def _get_openai_client(self):
+        """重用單一 OpenAI 客戶端，底層共用連線池"""
+        if self._openai_client is None:
+            from openai import OpenAI
+            
+            self._openai_client = OpenAI(
+                api_key=self.openai_api_key,
+                http_client=self.http_pool.get("openai"),
+                timeout=self.http_pool.timeout
+            )
+        
+        return self._openai_client
+    
+    @property
+    def chat_model_id(self) -> str:
+        """對話模型識別（供抽取結果快取鍵使用）"""
+        models = {
+            "google": self.google_model,
+            "grok": self.grok_model,
+            "openrouter": self.openrouter_model,
+            "openai": self.openai_model,
+        }
+        return f"{self.provider}:{models.get(self.provider, '')}"
+    
+    @property
+    def embedding_model_id(self) -> str:
+        """嵌入來源識別（供快取鍵使用），哈希替代嵌入不可與真實嵌入混用"""
+        if self.provider in ("openrouter", "openai"):
+            return self.embedding_model
+        return "hash-fallback"
+    
     def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """創建文本嵌入（目前僅支持 OpenAI 和 OpenRouter）"""
+        """創建文本嵌入（目前僅支持 OpenAI 和 OpenRouter），批次並行送出"""
+        
+        if self.provider in ("openrouter", "openai"):
+            return self.embedding_batcher.run(texts, self._embed_batch)
         
+        else:
+            # 這不是真正的語義嵌入，但可以作為臨時解決方案
+            print(f"⚠️ Warning: {self.provider} doesn't support embeddings, using fallback")
+            return _fallback_embeddings(texts)
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """送出單一嵌入批次"""
         if self.provider == "openrouter":
             # OpenRouter 支持嵌入模型
-            url = "https://openrouter.ai/api/v1/embeddings"
-            
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "Content-Type": "application/json"
-            }
+            url, headers, payload = self._openrouter_embeddings_request(batch)
             
-            all_embeddings = []
-            batch_size = 100
+            response = self.http_pool.get("openrouter").post(url, headers=headers, json=payload)
+            response.raise_for_status()
             
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
+            result = response.json()
+            return [item["embedding"] for item in result["data"]]
+        
+        # 重試由 AdaptiveBatcher 處理（429 時拆分批次），SDK 不自行重試
+        client = self._get_openai_client().with_options(max_retries=0)
+        response = client.embeddings.create(
+            model=self.embedding_model,
+            input=batch
+        )
+        
+        return [item.embedding for item in response.data]
+
+
+class AsyncUniversalLLMClient:
+    """UniversalLLMClient 的原生 asyncio 版本（聊天、嵌入、串流）"""
+    
+    def __init__(self, sync_client: UniversalLLMClient):
+        # 共用同步客戶端的設定與請求建構器
+        self.sync_client = sync_client
+        self.provider = sync_client.provider
+        self.http_pool = sync_client.http_pool
+        self._openai_client = None
+    
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> str:
+        """統一的非同步聊天完成接口"""
+        
+        if self.provider == "google":
+            return await self._google_chat(messages, temperature, max_tokens)
+        elif self.provider == "grok":
+            return await self._grok_chat(messages, temperature, max_tokens)
+        elif self.provider == "openrouter":
+            return await self._openrouter_chat(messages, temperature, max_tokens)
+        elif self.provider == "openai":
+            return await self._openai_chat(messages, temperature, max_tokens)
+        else:
+            raise ValueError(f"Unsupported provider: {self.provider}")
+    
+    async def _google_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """Google AI (Gemini) API"""
+        url, headers, payload = self.sync_client._google_request(messages, temperature, max_tokens)
+        
+        response = await self.http_pool.get_async("google").post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result["candidates"][0]["content"]["parts"][0]["text"]
+    
+    async def _grok_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """Grok API (xAI)"""
+        url, headers, payload = self.sync_client._grok_request(messages, temperature, max_tokens)
+        
+        response = await self.http_pool.get_async("grok").post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result["choices"][0]["message"]["content"]
+    
+    async def _openrouter_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """OpenRouter API"""
+        url, headers, payload = self.sync_client._openrouter_request(messages, temperature, max_tokens)
+        
+        max_retries = 3
+        retry_delay = 1
+        
+        for attempt in range(max_retries + 1):
+            try:
+                response = await self.http_pool.get_async("openrouter").post(url, headers=headers, json=payload)
                 
-                payload = {
-                    "model": "text-embedding-3-small",  # OpenRouter 支持 OpenAI 嵌入模型
-                    "input": batch
-                }
+                if response.status_code == 429:
+                    if attempt < max_retries:
+                        await asyncio.sleep(retry_delay)
+                        retry_delay *= 2  # Exponential backoff
+                        continue
+                    else:
+                        response.raise_for_status()
                 
-                response = requests.post(url, headers=headers, json=payload)
                 response.raise_for_status()
-                
                 result = response.json()
-                embeddings = [item["embedding"] for item in result["data"]]
-                all_embeddings.extend(embeddings)
+                return result["choices"][0]["message"]["content"]
             
-            return all_embeddings
+            except httpx.HTTPStatusError as e:
+                if response.status_code == 429:
+                    raise Exception(f"OpenRouter Rate Limit Exceeded after {max_retries} retries. Please try again later.")
+                raise e
+            except Exception as e:
+                if attempt < max_retries:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+                raise e
         
-        elif self.provider == "openai":
-            from openai import OpenAI
-            
-            client = OpenAI(api_key=self.openai_api_key)
-            
-            all_embeddings = []
-            batch_size = 100
-            
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                
-                response = client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=batch
-                )
-                
-                embeddings = [item.embedding for item in response.data]
-                all_embeddings.extend(embeddings)
+        raise Exception("Failed to get response from OpenRouter")
+    
+    async def _openai_chat(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """OpenAI API"""
+        client = self._get_openai_client()
+        
+        response = await client.chat.completions.create(
+            model=self.sync_client.openai_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        return response.choices[0].message.content
+    
+    def _get_openai_client(self):
+        """重用單一 AsyncOpenAI 客戶端，底層共用非同步連線池"""
+        if self._openai_client is None:
+            from openai import AsyncOpenAI
             
-            return all_embeddings
+            self._openai_client = AsyncOpenAI(
+                api_key=self.sync_client.openai_api_key,
+                http_client=self.http_pool.get_async("openai"),
+                timeout=self.http_pool.timeout
+            )
+        
+        return self._openai_client
+    
+    async def stream_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """非同步串流聊天完成，逐一產生文字增量"""
+        
+        if self.provider == "openai":
+            client = self._get_openai_client()
+            stream = await client.chat.completions.create(
+                model=self.sync_client.openai_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            return
+        
+        url, headers, payload, parse_delta = self.sync_client._stream_request(messages, temperature, max_tokens)
+        
+        client = self.http_pool.get_async(self.provider)
+        async with client.stream("POST", url, headers=headers, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                data = _parse_sse_line(line)
+                if data is None:
+                    continue
+                delta = parse_delta(data)
+                if delta:
+                    yield delta
+    
+    async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """非同步創建文本嵌入（目前僅支持 OpenAI 和 OpenRouter），批次並行送出"""
+        
+        if self.provider in ("openrouter", "openai"):
+            return await self.sync_client.embedding_batcher.arun(texts, self._embed_batch)
         
         else:
-            # 對於不支持嵌入的提供商，使用簡單的文本哈希作為替代
-            # 這不是真正的語義嵌入，但可以作為臨時解決方案
             print(f"⚠️ Warning: {self.provider} doesn't support embeddings, using fallback")
-            import hashlib
-            import numpy as np
+            return _fallback_embeddings(texts)
+    
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """送出單一嵌入批次"""
+        if self.provider == "openrouter":
+            url, headers, payload = self.sync_client._openrouter_embeddings_request(batch)
             
-            embeddings = []
-            for text in texts:
-                # 使用文本哈希創建偽嵌入
-                hash_obj = hashlib.sha256(text.encode())
-                hash_bytes = hash_obj.digest()
-                # 轉換為 1536 維向量（與 OpenAI 嵌入維度匹配）
-                embedding = np.frombuffer(hash_bytes * 48, dtype=np.float32)[:1536].tolist()
-                embeddings.append(embedding)
+            response = await self.http_pool.get_async("openrouter").post(url, headers=headers, json=payload)
+            response.raise_for_status()
             
-            return embeddings
+            result = response.json()
+            return [item["embedding"] for item in result["data"]]
+        
+        client = self._get_openai_client().with_options(max_retries=0)
+        response = await client.embeddings.create(
+            model=self.sync_client.embedding_model,
+            input=batch
+        )
+        
+        return [item.embedding for item in response.data]
 
 
 # 全局客戶端實例
 llm_client = UniversalLLMClient()
+async_llm_client = AsyncUniversalLLMClient(llm_client)
@@ -0,0 +1,155 @@
+"""
+LLM JSON - strict, linear-time parsing of JSON objects from LLM responses
+"""
+from typing import Any, List, Optional
+import json
+import re
+
+
+# Give up after this many brace-delimited candidates that are not valid JSON
+MAX_CANDIDATES = 16
+
+_DECODER = json.JSONDecoder()
+_OPEN = re.compile(r'\{')
+_OBJECT_START = re.compile(r'\{\s*["}]')
+_SIGNIFICANT = re.compile(r'[{}"]')
+_STRING_END = re.compile(r'["\\]')
+
+
+class JSONObjectDecoder:
+    """
+    Incremental scanner for the first complete top-level JSON object
+
+    Text is fed in pieces (a whole response or stream deltas). Each piece is
+    scanned once, jumping between braces and string quotes with compiled
+    patterns, so the cost is linear in the input; feed returns the object as
+    soon as its closing brace arrives and ignores anything after it. Braces
+    in surrounding prose give candidates that fail to parse; scanning resumes
+    after them, up to max_candidates that look like objects.
+    """
+
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+        self.candidates = 0
+        self.result: Any = None
+        self.done = False
+
+        self._pieces: List[str] = []  # text of the current candidate
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, piece: str) -> Optional[dict]:
+        """Scan another piece; the object once complete, else None"""
+        if self.done:
+            return self.result
+
+        pos = 0
+        start = None  # where a candidate started in this piece
+
+        while pos < len(piece):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = _STRING_END.search(piece, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                else:
+                    self._in_string = False
+                continue
+
+            match = (_SIGNIFICANT if self._depth else _OPEN).search(piece, pos)
+            if match is None:
+                break
+            pos = match.end()
+
+            if not self._depth:
+                self._depth = 1
+                start = match.start()
+            elif match.group() == '"':
+                self._in_string = True
+            elif match.group() == '{':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    if start is not None:
+                        text = piece[start:pos]
+                    else:
+                        text = "".join(self._pieces) + piece[:pos]
+                    self._pieces = []
+                    start = None
+                    if self._accept(text):
+                        return self.result
+
+        # Carry an unfinished candidate over to the next piece
+        if self._depth:
+            if start is not None:
+                self._pieces = [piece[start:]]
+            else:
+                self._pieces.append(piece)
+        return None
+
+    def _accept(self, text: str) -> bool:
+        """True if a balanced candidate is the object"""
+        if not _OBJECT_START.match(text):
+            # Braces in prose, not counted against max_candidates
+            return False
+
+        try:
+            value = json.loads(text)
+        except ValueError:
+            value = None
+
+        if isinstance(value, dict):
+            self.result = value
+            self.done = True
+            return True
+
+        self.candidates += 1
+        if self.candidates >= self.max_candidates:
+            raise ValueError(f"No valid JSON object in the first {self.candidates} candidates")
+        return False
+
+
+def parse_json_response(response: str) -> Any:
+    """
+    JSON from an LLM response
+
+    A response that is exactly JSON (the usual case with JSON mode) is
+    decoded directly. Otherwise (markdown fences, prose around the object)
+    the first object is decoded in place from the first brace that opens
+    one (a key or "}" follows it, so a stray "{" in prose is skipped), and
+    only if that fails is the response scanned for the first valid object. An
+    unbalanced object (truncated output) is an error, never one of the
+    objects nested in it.
+    """
+    text = response.strip()
+    if text[:1] in ("{", "["):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+
+    match = _OBJECT_START.search(text)
+    if match is None:
+        raise ValueError("Could not parse JSON from LLM response")
+    first = match.start()
+
+    try:
+        value, _ = _DECODER.raw_decode(text, first)
+        if isinstance(value, dict):
+            return value
+    except ValueError:
+        pass
+
+    decoder = JSONObjectDecoder()
+    result = decoder.feed(text[first:])
+    if result is None:
+        raise ValueError("Could not parse JSON from LLM response")
+    return result
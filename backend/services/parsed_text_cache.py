@@ -0,0 +1,209 @@
+"""
+Parsed Text Cache - cleaned document text keyed by file content hash and parser version
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from config import settings
+
+
+# Segments are compressed together in blocks of about this many characters
+BLOCK_CHARS = 64 * 1024
+
+Segment = Tuple[Optional[int], str]  # (page number, cleaned text)
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 of a file (same digest as documents.content_hash)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedTextCache:
+    """
+    SQLite store of cleaned text segments with their page numbers
+
+    Entries are keyed by (content hash, parser version), so retries and
+    re-indexing of an unchanged file never run the PDF/DOCX parser again,
+    and a parser change simply misses. Segments are zlib-compressed in
+    blocks and read back block by block. The store is shared by all worker
+    processes and evicts least recently used documents beyond its budget.
+    """
+
+    def __init__(self, path: str = None, max_disk_bytes: int = None):
+        self.path = path or settings.parsed_text_cache_path
+        self.max_disk_bytes = max_disk_bytes or settings.parsed_text_cache_max_bytes
+        self._lock = threading.Lock()
+
+        # Counters (this process)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = self._connect()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS parsed_documents (
+                key TEXT PRIMARY KEY,
+                size_bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS parsed_blocks (
+                key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (key, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_parsed_documents_last_access ON parsed_documents(last_access);
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(content_hash: str, parser_version: str) -> str:
+        return f"{content_hash}:{parser_version}"
+
+    def get(self, key: str) -> Optional[Iterator[Segment]]:
+        """
+        Cached segments for key, or None on a miss
+
+        The returned iterator reads one block at a time from the snapshot
+        the lookup was made in, so a concurrent eviction cannot cut it short.
+        """
+        conn = None
+        try:
+            # Own connection: the read transaction spans the whole iteration
+            conn = self._connect()
+            conn.execute("BEGIN")
+            found = conn.execute("SELECT 1 FROM parsed_documents WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Parsed text cache read failed: {e}")
+            found = None
+
+        with self._lock:
+            if not found:
+                self.misses += 1
+                if conn is not None:
+                    conn.close()
+                return None
+            self.hits += 1
+
+            try:
+                self._conn.execute("UPDATE parsed_documents SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+            except sqlite3.Error:
+                pass
+
+        return self._read(conn, key)
+
+    def put_through(self, key: str, segments: Iterable[Segment]) -> Iterator[Segment]:
+        """
+        Pass segments through, storing them under key once the iteration
+        completes (an abandoned or failed iteration stores nothing)
+
+        Only the compressed blocks are held until then.
+        """
+        blocks: List[bytes] = []
+        block: List[Segment] = []
+        block_chars = 0
+
+        for segment in segments:
+            block.append(segment)
+            block_chars += len(segment[1])
+            if block_chars >= BLOCK_CHARS:
+                blocks.append(self._compress(block))
+                block = []
+                block_chars = 0
+            yield segment
+
+        if block:
+            blocks.append(self._compress(block))
+
+        try:
+            self._store(key, blocks)
+        except sqlite3.Error as e:
+            print(f"⚠️ Parsed text cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, disk_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM parsed_documents"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "disk_bytes": disk_bytes,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, key: str) -> Iterator[Segment]:
+        try:
+            for (data,) in conn.execute("SELECT data FROM parsed_blocks WHERE key = ? ORDER BY seq", (key,)):
+                for page, text in json.loads(zlib.decompress(data)):
+                    yield page, text
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _compress(block: List[Segment]) -> bytes:
+        return zlib.compress(json.dumps(block, ensure_ascii=False).encode("utf-8"), 6)
+
+    def _store(self, key: str, blocks: List[bytes]) -> None:
+        size = sum(len(data) for data in blocks)
+        if size > self.max_disk_bytes:
+            return
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM parsed_blocks WHERE key = ?", (key,))
+                self._conn.executemany(
+                    "INSERT INTO parsed_blocks (key, seq, data) VALUES (?, ?, ?)",
+                    [(key, seq, data) for seq, data in enumerate(blocks)]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO parsed_documents (key, size_bytes, last_access) VALUES (?, ?, ?)",
+                    (key, size, time.time())
+                )
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used documents until the store is under 90% of its budget"""
+        (disk_bytes,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM parsed_documents"
+        ).fetchone()
+        if disk_bytes <= self.max_disk_bytes:
+            return
+
+        target = int(self.max_disk_bytes * 0.9)
+        victims = []
+        for key, size in self._conn.execute(
+            "SELECT key, size_bytes FROM parsed_documents ORDER BY last_access ASC"
+        ).fetchall():
+            if disk_bytes <= target:
+                break
+            victims.append((key,))
+            disk_bytes -= size
+
+        self._conn.executemany("DELETE FROM parsed_blocks WHERE key = ?", victims)
+        self._conn.executemany("DELETE FROM parsed_documents WHERE key = ?", victims)
+        self.evictions += len(victims)
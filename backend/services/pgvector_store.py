@@ -0,0 +1,415 @@
+"""
+pgvector Store - chunk embeddings in chunks.embedding, next to the chunk rows
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+import csv
+import io
+import json
+import threading
+import uuid
+from sqlalchemy import text
+from config import settings
+from database import engine
+from services.vector_store import VectorStore
+
+
+INDEX_NAMES = {
+    "hnsw": "idx_chunks_embedding_hnsw",
+    "ivfflat": "idx_chunks_embedding_ivfflat",
+}
+
+# Filter fields stored as columns (documents columns are indexed); others are chunk_metadata keys
+_COLUMNS = {
+    "document_id": ("c.document_id", "uuid"),
+    "chunk_index": ("c.chunk_index", "integer"),
+    "document_type": ("d.document_type", "text"),
+    "status": ("d.status", "text"),
+}
+
+_COMPARE = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return json.dumps([float(value) for value in embedding], separators=(",", ":"))
+
+
+class _WhereCompiler:
+    """Chroma-style filter -> SQL condition with bound parameters"""
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        self.join_documents = False
+
+    def compile(self, where: Dict) -> str:
+        parts = []
+        for key, condition in where.items():
+            if key == "$and":
+                parts.append("(" + " AND ".join(self.compile(clause) for clause in condition) + ")")
+            elif key == "$or":
+                parts.append("(" + " OR ".join(self.compile(clause) for clause in condition) + ")")
+            else:
+                if not isinstance(condition, dict):
+                    condition = {"$eq": condition}
+                parts.extend(self._compare(key, op, value) for op, value in condition.items())
+        return " AND ".join(parts) or "TRUE"
+
+    def _param(self, value: Any) -> str:
+        name = f"p{len(self.params)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def _compare(self, key: str, op: str, value: Any) -> str:
+        if key in _COLUMNS:
+            column, sql_type = _COLUMNS[key]
+            if column.startswith("d."):
+                self.join_documents = True
+            if op in ("$in", "$nin"):
+                values = [str(item) if sql_type == "uuid" else item for item in value]
+                operand = f"CAST({self._param(values)} AS {sql_type}[])"
+            else:
+                operand = f"CAST({self._param(str(value) if sql_type == 'uuid' else value)} AS {sql_type})"
+        else:
+            column = f"(c.chunk_metadata -> CAST({self._param(key)} AS text))"
+            if op in _COMPARE:
+                # Numeric comparison; values that are not JSON numbers never match
+                column = (
+                    f"(CASE WHEN jsonb_typeof({column}) = 'number' "
+                    f"THEN CAST({column} #>> '{{}}' AS float8) END)"
+                )
+                operand = f"CAST({self._param(float(value))} AS float8)"
+            elif op in ("$in", "$nin"):
+                values = [json.dumps(item, ensure_ascii=False) for item in value]
+                operand = f"CAST({self._param(values)} AS jsonb[])"
+            else:
+                operand = f"CAST({self._param(json.dumps(value, ensure_ascii=False))} AS jsonb)"
+
+        if op == "$eq":
+            return f"{column} = {operand}"
+        elif op == "$ne":
+            return f"{column} IS DISTINCT FROM {operand}"
+        elif op == "$in":
+            return f"COALESCE({column} = ANY({operand}), false)"
+        elif op == "$nin":
+            return f"NOT COALESCE({column} = ANY({operand}), false)"
+        elif op in _COMPARE:
+            return f"{column} {_COMPARE[op]} {operand}"
+        raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class PgVectorStore(VectorStore):
+    """
+    Vectors as a pgvector column of the chunks table
+
+    The chunk rows are the vector store: each row carries its vector store
+    ID (vector_id) and embedding, so chunks are stored once and every
+    uvicorn worker and ingestion process shares one Postgres cluster.
+    Writes are bulk loaded (COPY into a temporary table, then one
+    INSERT ... ON CONFLICT) on the caller's session connection, so they
+    commit or roll back with the document row. Queries are ordered by
+    cosine distance on an HNSW or IVFFlat index; document_type and status
+    filters join documents and use its indexes. The extension and columns
+    are created on first use; the ANN index is only ever built by
+    rebuild_index (CONCURRENTLY, so writes to chunks carry on), and
+    queries fall back to exact scans until it exists.
+    """
+
+    joins_transaction = True
+
+    def __init__(self):
+        self.dimension = settings.pgvector_dimension
+        self.index_type = settings.pgvector_index
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def upsert(self, ids, embeddings, documents, metadatas, db=None) -> None:
+        """Load rows through db's connection (not committed), or in a transaction of their own without db"""
+        if not ids:
+            return
+        self._ensure_schema()
+
+        buffer = io.StringIO()
+        # Quote every string so an empty string is not read as NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for chunk_id, embedding, chunk_text, metadata in zip(ids, embeddings, documents, metadatas):
+            if len(embedding) != self.dimension:
+                raise ValueError(f"Embedding dimension {len(embedding)} does not match vector({self.dimension})")
+            writer.writerow((
+                chunk_id,
+                str(uuid.uuid4()),
+                str(metadata['document_id']),
+                int(metadata.get('chunk_index', 0)),
+                chunk_text,
+                json.dumps(metadata, ensure_ascii=False),
+                _vector_literal(embedding)
+            ))
+        buffer.seek(0)
+
+        if db is not None:
+            # Same transaction as the session's other writes (like ChunkStore._copy)
+            self._load(db.connection().connection, buffer)
+            return
+
+        connection = engine.raw_connection()
+        try:
+            self._load(connection, buffer)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _load(self, connection, buffer: io.StringIO) -> None:
+        """COPY the CSV rows into a temporary table and merge them into chunks (not committed)"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f"""
+                CREATE TEMP TABLE chunk_vectors_load (
+                    vector_id VARCHAR(200), id UUID, document_id UUID, chunk_index INTEGER,
+                    chunk_text TEXT, chunk_metadata JSONB, embedding vector({self.dimension})
+                ) ON COMMIT DROP
+                """
+            )
+            cursor.copy_expert("COPY chunk_vectors_load FROM STDIN WITH (FORMAT csv)", buffer)
+            # A chunk at the same position under another ID (an earlier version) is replaced
+            cursor.execute(
+                """
+                DELETE FROM chunks c USING chunk_vectors_load l
+                WHERE c.document_id = l.document_id AND c.chunk_index = l.chunk_index
+                  AND c.vector_id IS DISTINCT FROM l.vector_id
+                """
+            )
+            cursor.execute(
+                """
+                INSERT INTO chunks (id, vector_id, document_id, chunk_index, chunk_text, chunk_metadata, embedding)
+                SELECT DISTINCT ON (vector_id) id, vector_id, document_id, chunk_index, chunk_text, chunk_metadata, embedding
+                FROM chunk_vectors_load
+                ON CONFLICT (vector_id) DO UPDATE SET
+                    document_id = EXCLUDED.document_id,
+                    chunk_index = EXCLUDED.chunk_index,
+                    chunk_text = EXCLUDED.chunk_text,
+                    chunk_metadata = EXCLUDED.chunk_metadata,
+                    embedding = EXCLUDED.embedding
+                """
+            )
+            # Several loads may share one transaction
+            cursor.execute("DROP TABLE chunk_vectors_load")
+        finally:
+            cursor.close()
+
+    def query(self, embedding, top_k, where=None) -> List[Dict[str, Any]]:
+        self._ensure_schema()
+        params: Dict[str, Any] = {"q": _vector_literal(embedding), "k": top_k}
+        condition, join = self._where_sql(where, params)
+
+        sql = f"""
+            SELECT c.vector_id, c.chunk_text, c.chunk_metadata,
+                   1 - (c.embedding <=> CAST(:q AS vector)) AS score
+            FROM chunks c {join}
+            WHERE c.embedding IS NOT NULL AND {condition}
+            ORDER BY c.embedding <=> CAST(:q AS vector)
+            LIMIT :k
+        """
+        with engine.begin() as conn:
+            for statement in self._search_settings(top_k, filtered=bool(where)):
+                conn.execute(text(statement))
+            rows = conn.execute(text(sql), params).fetchall()
+
+        return [
+            {'id': chunk_id, 'text': chunk_text, 'metadata': metadata or {}, 'score': float(score)}
+            for chunk_id, chunk_text, metadata, score in rows
+        ]
+
+    def get(self, where: Dict) -> Dict[str, List]:
+        self._ensure_schema()
+        params: Dict[str, Any] = {}
+        condition, join = self._where_sql(where, params)
+
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT c.vector_id, c.chunk_text, c.chunk_metadata FROM chunks c {join} "
+                    f"WHERE c.vector_id IS NOT NULL AND {condition} ORDER BY c.chunk_index"
+                ),
+                params
+            ).fetchall()
+
+        return {
+            'ids': [row[0] for row in rows],
+            'documents': [row[1] for row in rows],
+            'metadatas': [row[2] or {} for row in rows],
+        }
+
+    def update_metadata(self, ids, metadatas, db=None) -> None:
+        if not ids:
+            return
+        self._ensure_schema()
+
+        with self._connection(db) as conn:
+            # Positions may be permuted: move them out of the way of the
+            # (document_id, chunk_index) constraint first (unless begin_rewrite already did)
+            conn.execute(
+                text("UPDATE chunks SET chunk_index = -1 - chunk_index WHERE vector_id = ANY(:ids) AND chunk_index >= 0"),
+                {"ids": list(ids)}
+            )
+            conn.execute(
+                text(
+                    """
+                    UPDATE chunks AS c
+                    SET chunk_index = u.chunk_index, chunk_metadata = CAST(u.chunk_metadata AS jsonb)
+                    FROM unnest(CAST(:ids AS text[]), CAST(:indexes AS integer[]), CAST(:metadatas AS text[]))
+                        AS u(vector_id, chunk_index, chunk_metadata)
+                    WHERE c.vector_id = u.vector_id
+                    """
+                ),
+                {
+                    "ids": list(ids),
+                    "indexes": [int(metadata.get('chunk_index', 0)) for metadata in metadatas],
+                    "metadatas": [json.dumps(metadata, ensure_ascii=False) for metadata in metadatas],
+                }
+            )
+
+    def delete(self, ids: List[str], db=None) -> None:
+        if not ids:
+            return
+        self._ensure_schema()
+
+        with self._connection(db) as conn:
+            conn.execute(text("DELETE FROM chunks WHERE vector_id = ANY(:ids)"), {"ids": list(ids)})
+
+    def begin_rewrite(self, document_id: str, db=None) -> None:
+        """Park the document's rows at negative positions, so batches can take any position"""
+        self._ensure_schema()
+
+        with self._connection(db) as conn:
+            conn.execute(
+                text("UPDATE chunks SET chunk_index = -1 - chunk_index WHERE document_id = :document_id AND chunk_index >= 0"),
+                {"document_id": str(document_id)}
+            )
+
+    @contextmanager
+    def _connection(self, db=None):
+        """db's connection (not committed), or a transaction of its own without db"""
+        if db is not None:
+            yield db.connection()
+            return
+        with engine.begin() as conn:
+            yield conn
+
+    def stats(self) -> Dict[str, Any]:
+        self._ensure_schema()
+        with engine.begin() as conn:
+            chunks = conn.execute(text("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL")).scalar()
+            indexes = conn.execute(
+                text(
+                    "SELECT indexname, pg_relation_size(CAST(indexname AS regclass)) FROM pg_indexes "
+                    "WHERE tablename = 'chunks' AND indexname = ANY(:names)"
+                ),
+                {"names": list(INDEX_NAMES.values())}
+            ).fetchall()
+
+        return {
+            "backend": "pgvector",
+            "chunks": chunks,
+            "dimension": self.dimension,
+            "index": self.index_type,
+            "index_bytes": {name: size for name, size in indexes},
+        }
+
+    def rebuild_index(self) -> Dict[str, Any]:
+        """
+        (Re)build the configured ANN index without blocking writes
+
+        The new index is built CONCURRENTLY next to the old one and swapped
+        in by name; indexes of the other type are dropped. Run it after bulk
+        loading (IVFFlat lists are trained on the rows present).
+        """
+        self._ensure_schema()
+
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # Session-level on a pooled connection: reset before it goes back to the pool
+            conn.execute(
+                text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                {"value": settings.pgvector_maintenance_work_mem}
+            )
+            try:
+                for index_type, name in INDEX_NAMES.items():
+                    if index_type != self.index_type:
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+                if self.index_type != "none":
+                    name = INDEX_NAMES[self.index_type]
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}_new"))
+                    conn.execute(text(self._index_ddl(f"{name}_new", concurrently=True)))
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    conn.execute(text(f"ALTER INDEX {name}_new RENAME TO {name}"))
+            finally:
+                conn.execute(text("RESET maintenance_work_mem"))
+
+        print(f"✅ Rebuilt pgvector index ({self.index_type})")
+        return self.stats()
+
+    def _ensure_schema(self) -> None:
+        """Extension, columns and the vector_id index, once per process (cheap DDL only)"""
+        if self._schema_ready:
+            return
+
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+                conn.execute(text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS vector_id VARCHAR(200)"))
+                conn.execute(text(f"ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding vector({self.dimension})"))
+                conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_vector_id ON chunks(vector_id)"))
+                missing = self.index_type != "none" and not conn.execute(
+                    text("SELECT 1 FROM pg_indexes WHERE tablename = 'chunks' AND indexname = :name"),
+                    {"name": INDEX_NAMES[self.index_type]}
+                ).first()
+
+            if missing:
+                print(
+                    f"⚠️ No {self.index_type} index on chunks.embedding yet (exact scans); "
+                    f"build it with POST /api/admin/vector-index/rebuild"
+                )
+            self._schema_ready = True
+
+    def _index_ddl(self, name: str, concurrently: bool = False) -> str:
+        options = "CONCURRENTLY " if concurrently else ""
+        if self.index_type == "hnsw":
+            return (
+                f"CREATE INDEX {options}IF NOT EXISTS {name} ON chunks "
+                f"USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {int(settings.pgvector_hnsw_m)}, ef_construction = {int(settings.pgvector_hnsw_ef_construction)})"
+            )
+        return (
+            f"CREATE INDEX {options}IF NOT EXISTS {name} ON chunks "
+            f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {int(settings.pgvector_ivfflat_lists)})"
+        )
+
+    def _search_settings(self, top_k: int, filtered: bool) -> List[str]:
+        """SET LOCAL statements for one query transaction"""
+        statements = []
+        if self.index_type == "hnsw":
+            ef_search = min(max(int(settings.pgvector_hnsw_ef_search), top_k), 1000)
+            statements.append(f"SET LOCAL hnsw.ef_search = {ef_search}")
+            if filtered and settings.pgvector_iterative_scan:
+                statements.append("SET LOCAL hnsw.iterative_scan = relaxed_order")
+        elif self.index_type == "ivfflat":
+            statements.append(f"SET LOCAL ivfflat.probes = {int(settings.pgvector_ivfflat_probes)}")
+            if filtered and settings.pgvector_iterative_scan:
+                statements.append("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+        return statements
+
+    @staticmethod
+    def _where_sql(where: Optional[Dict], params: Dict[str, Any]) -> Tuple[str, str]:
+        """(condition, join) for a filter"""
+        if not where:
+            return "TRUE", ""
+        compiler = _WhereCompiler(params)
+        condition = compiler.compile(where)
+        join = "JOIN documents d ON d.id = c.document_id" if compiler.join_documents else ""
+        return condition, join
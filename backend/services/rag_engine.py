@@ -1,11 +1,23 @@
 """
 RAG Engine - Retrieval Augmented Generation for document Q&A
 """
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Set, Tuple, Optional
+from datetime import datetime, timezone
 from config import settings
+from database import SessionLocal
+from models import Document
 from services.embedding_service import EmbeddingService
-from services.llm_client import llm_client
+from services.llm_client import llm_client, async_llm_client
+from services.tokenizer import token_counter
+from services.answer_cache import AnswerCache, query_key
+from services.document_metadata import document_metadata_cache
+from services.single_flight import SingleFlight, AsyncSingleFlight
+import asyncio
 import time
+import uuid
+
+
+ANSWER_ERROR_PREFIX = "Error generating answer: "
 
 
 class RAGEngine:
@@ -13,10 +25,14 @@ class RAGEngine:
     
     def __init__(self):
         self.client = llm_client
+        self.async_client = async_llm_client
         self.embedding_service = EmbeddingService()
         self.model = settings.llm_model
         self.temperature = settings.llm_temperature
         self.max_tokens = settings.max_tokens
+        self.answer_cache = AnswerCache() if settings.enable_answer_cache else None
+        self._flight = SingleFlight()
+        self._aflight = AsyncSingleFlight()
     
     def query(
         self,
@@ -36,25 +52,51 @@ class RAGEngine:
         Returns:
             Dictionary with answer, sources, and timing info
         """
+        top_k = top_k or settings.default_top_k
+        
+        if not settings.enable_request_coalescing:
+            return self._query(query_text, top_k, filters, db)
+        
+        # Concurrent identical queries wait for one shared execution
+        result = self._flight.do(
+            query_key(query_text, filters, top_k),
+            lambda: self._shared_query(query_text, top_k, filters)
+        )
+        return dict(result)
+    
+    def _shared_query(self, query_text: str, top_k: int, filters: Dict) -> Dict[str, Any]:
+        """
+        Coalesced execution: its result is reused by every merged caller, so it
+        runs on its own session rather than the session of the request that started it
+        """
+        db = SessionLocal()
+        try:
+            return self._query(query_text, top_k, filters, db)
+        finally:
+            db.close()
+    
+    def _query(self, query_text: str, top_k: int, filters: Dict, db: Any) -> Dict[str, Any]:
         start_time = time.time()
         
+        # Level 1 cache: exact normalized query
+        cached = self._cached_exact(query_text, filters, top_k, start_time, db)
+        if cached:
+            return cached
+        
         # Step 1: Retrieve relevant chunks
         retrieval_start = time.time()
-        sources = self.embedding_service.search_similar(
-            query_text=query_text,
-            top_k=top_k or settings.default_top_k,
-            filter_metadata=filters
-        )
+        query_embedding = self.embedding_service.embed_query(query_text)
+        
+        # Level 2 cache: semantically equivalent query
+        cached = self._cached_similar(query_embedding, filters, top_k, start_time, db)
+        if cached:
+            return cached
+        
+        sources = self.embedding_service.search_by_embedding(query_embedding, top_k, filters)
         retrieval_time = int((time.time() - retrieval_start) * 1000)
         
         if not sources:
-            return {
-                'answer': "I couldn't find any relevant information to answer your question.",
-                'sources': [],
-                'retrieval_time_ms': retrieval_time,
-                'llm_time_ms': 0,
-                'total_time_ms': int((time.time() - start_time) * 1000)
-            }
+            return self._no_sources_result(retrieval_time, start_time)
         
         # Step 2: Build context from sources
         context = self._build_context(sources)
@@ -64,15 +106,178 @@ class RAGEngine:
         answer = self._generate_answer(query_text, context, sources)
         llm_time = int((time.time() - llm_start) * 1000)
         
-        total_time = int((time.time() - start_time) * 1000)
-        
-        return {
+        result = {
             'answer': answer,
             'sources': self._format_sources(sources, db),
             'retrieval_time_ms': retrieval_time,
             'llm_time_ms': llm_time,
-            'total_time_ms': total_time
+            'total_time_ms': int((time.time() - start_time) * 1000)
         }
+        self._cache_answer(query_text, filters, top_k, query_embedding, result, sources, start_time)
+        
+        return result
+    
+    async def aquery(
+        self,
+        query_text: str,
+        top_k: int = None,
+        filters: Dict = None,
+        db: Any = None
+    ) -> Dict[str, Any]:
+        """
+        Async variant of query: LLM and embedding calls are awaited on the
+        event loop, vector search and DB lookups run in worker threads
+        """
+        top_k = top_k or settings.default_top_k
+        
+        if not settings.enable_request_coalescing:
+            return await self._aquery(query_text, top_k, filters, db)
+        
+        result = await self._aflight.do(
+            query_key(query_text, filters, top_k),
+            lambda: self._ashared_query(query_text, top_k, filters)
+        )
+        return dict(result)
+    
+    async def _ashared_query(self, query_text: str, top_k: int, filters: Dict) -> Dict[str, Any]:
+        """
+        Async variant of _shared_query: the shielded task may outlive the
+        request that started it, so it must not use that request's session
+        """
+        db = SessionLocal()
+        try:
+            return await self._aquery(query_text, top_k, filters, db)
+        finally:
+            await asyncio.to_thread(db.close)
+    
+    async def _aquery(self, query_text: str, top_k: int, filters: Dict, db: Any) -> Dict[str, Any]:
+        start_time = time.time()
+        
+        cached = await asyncio.to_thread(self._cached_exact, query_text, filters, top_k, start_time, db)
+        if cached:
+            return cached
+        
+        # Step 1: Retrieve relevant chunks
+        retrieval_start = time.time()
+        query_embedding = await self.embedding_service.aembed_query(query_text)
+        
+        cached = await asyncio.to_thread(self._cached_similar, query_embedding, filters, top_k, start_time, db)
+        if cached:
+            return cached
+        
+        sources = await asyncio.to_thread(
+            self.embedding_service.search_by_embedding, query_embedding, top_k, filters
+        )
+        retrieval_time = int((time.time() - retrieval_start) * 1000)
+        
+        if not sources:
+            return self._no_sources_result(retrieval_time, start_time)
+        
+        # Step 2: Build context from sources
+        context = self._build_context(sources)
+        
+        # Step 3: Generate answer using LLM
+        llm_start = time.time()
+        answer = await self._agenerate_answer(query_text, context)
+        llm_time = int((time.time() - llm_start) * 1000)
+        
+        formatted_sources = await asyncio.to_thread(self._format_sources, sources, db)
+        
+        result = {
+            'answer': answer,
+            'sources': formatted_sources,
+            'retrieval_time_ms': retrieval_time,
+            'llm_time_ms': llm_time,
+            'total_time_ms': int((time.time() - start_time) * 1000)
+        }
+        self._cache_answer(query_text, filters, top_k, query_embedding, result, sources, start_time)
+        
+        return result
+    
+    def _no_sources_result(self, retrieval_time: int, start_time: float) -> Dict[str, Any]:
+        return {
+            'answer': "I couldn't find any relevant information to answer your question.",
+            'sources': [],
+            'retrieval_time_ms': retrieval_time,
+            'llm_time_ms': 0,
+            'total_time_ms': int((time.time() - start_time) * 1000)
+        }
+    
+    def _cached_exact(
+        self, query_text: str, filters: Dict, top_k: int, start_time: float, db: Any = None
+    ) -> Optional[Dict[str, Any]]:
+        """Level 1 answer cache lookup"""
+        if self.answer_cache is None:
+            return None
+        result = self.answer_cache.get_exact(query_text, filters, top_k, self._is_current(db))
+        return self._mark_cached(result, start_time)
+    
+    def _cached_similar(
+        self, query_embedding: List[float], filters: Dict, top_k: int, start_time: float, db: Any = None
+    ) -> Optional[Dict[str, Any]]:
+        """Level 2 answer cache lookup"""
+        if self.answer_cache is None:
+            return None
+        result = self.answer_cache.get_similar(query_embedding, filters, top_k, self._is_current(db))
+        return self._mark_cached(result, start_time)
+    
+    def _is_current(self, db: Any):
+        """
+        Cache hit check against the documents table: an answer is stale once
+        one of its documents is deleted or processed again (processed_date
+        is set by the ingestion worker in the same commit as the new chunks)
+        """
+        if db is None:
+            return None
+        
+        def is_current(document_ids: Set[str], created_at: float) -> bool:
+            uuids = []
+            for doc_id in document_ids:
+                try:
+                    uuids.append(uuid.UUID(doc_id))
+                except ValueError:
+                    continue
+            if not uuids:
+                return True
+            
+            built = datetime.fromtimestamp(created_at, timezone.utc)
+            rows = db.query(Document.processed_date).filter(Document.id.in_(uuids)).all()
+            return len(rows) == len(uuids) and all(
+                processed_date is None or processed_date < built for (processed_date,) in rows
+            )
+        
+        return is_current
+    
+    def _mark_cached(self, result: Optional[Dict[str, Any]], start_time: float) -> Optional[Dict[str, Any]]:
+        """Report the cache hit's own timings instead of the original ones"""
+        if result is None:
+            return None
+        result['cached'] = True
+        result['retrieval_time_ms'] = 0
+        result['llm_time_ms'] = 0
+        result['total_time_ms'] = int((time.time() - start_time) * 1000)
+        return result
+    
+    def _cache_answer(
+        self,
+        query_text: str,
+        filters: Dict,
+        top_k: int,
+        query_embedding: List[float],
+        result: Dict[str, Any],
+        sources: List[Dict],
+        start_time: float = None
+    ) -> None:
+        """Cache a successful answer, linked to the documents it was built from"""
+        if self.answer_cache is None or result['answer'].startswith(ANSWER_ERROR_PREFIX):
+            return
+        document_ids = {source.get('document_id') for source in sources if source.get('document_id')}
+        self.answer_cache.put(query_text, filters, top_k, query_embedding, result, list(document_ids), start_time)
+    
+    def invalidate_document(self, document_id: str) -> None:
+        """Drop cached answers built from a deleted or re-indexed document"""
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_document(document_id)
     
     def _build_context(self, sources: List[Dict]) -> str:
         """Build context string from retrieved sources"""
@@ -88,6 +293,9 @@ class RAGEngine:
                 f"[Source {i+1}] (Document: {doc_id}, Chunk: {chunk_idx}, Relevance: {score:.2f})\n{text}"
             )
         
+        if settings.chunk_unit == "tokens":
+            return self._fit_context_tokens(sources, context_parts)
+        
         context = "\n\n---\n\n".join(context_parts)
         
         # Truncate if too long
@@ -96,13 +304,24 @@ class RAGEngine:
         
         return context
     
-    def _generate_answer(
-        self,
-        query: str,
-        context: str,
-        sources: List[Dict]
-    ) -> str:
-        """Generate answer using LLM with context"""
+    def _fit_context_tokens(self, sources: List[Dict], context_parts: List[str]) -> str:
+        """Keep whole sources, in relevance order, within max_context_tokens"""
+        budget = settings.max_context_tokens
+        kept = []
+        
+        for source, part in zip(sources, context_parts):
+            # Chunk token counts are cached from chunking; the header is ~30 tokens
+            tokens = token_counter.count(source.get('text', '')) + 30
+            if kept and tokens > budget:
+                kept.append("...[truncated]")
+                break
+            kept.append(part)
+            budget -= tokens
+        
+        return "\n\n---\n\n".join(kept)
+    
+    def _build_answer_messages(self, query: str, context: str) -> List[Dict[str, str]]:
+        """Build the chat messages used to answer a question from context"""
         
         system_prompt = """You are a helpful AI assistant for document search and Q&A.
 Your task is to answer questions based ONLY on the provided context from documents.
@@ -122,12 +341,21 @@ Question: {query}
 
 Please provide a clear, accurate answer based on the context above. Cite your sources."""
         
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _generate_answer(
+        self,
+        query: str,
+        context: str,
+        sources: List[Dict]
+    ) -> str:
+        """Generate answer using LLM with context"""
         try:
             answer = self.client.chat_completion(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=self._build_answer_messages(query, context),
                 temperature=self.temperature,
                 max_tokens=self.max_tokens
             )
@@ -135,39 +363,38 @@ Please provide a clear, accurate answer based on the context above. Cite your so
             return answer
             
         except Exception as e:
-            return f"Error generating answer: {str(e)}"
+            return f"{ANSWER_ERROR_PREFIX}{str(e)}"
+    
+    async def _agenerate_answer(self, query: str, context: str) -> str:
+        """Async variant of _generate_answer"""
+        try:
+            return await self.async_client.chat_completion(
+                messages=self._build_answer_messages(query, context),
+                temperature=self.temperature,
+                max_tokens=self.max_tokens
+            )
+            
+        except Exception as e:
+            return f"{ANSWER_ERROR_PREFIX}{str(e)}"
     
     def _format_sources(self, sources: List[Dict], db: Any = None) -> List[Dict]:
         """Format sources for response"""
-        formatted = []
-        
-        # Cache for document filenames to avoid repeated DB queries
-        doc_filename_cache = {}
+        # One batched lookup for every distinct document (cached across requests)
+        try:
+            filenames = document_metadata_cache.filenames(
+                db, (source.get('document_id') for source in sources)
+            )
+        except Exception:
+            # Fallback to doc_id if any error occurs
+            filenames = {}
         
+        formatted = []
         for source in sources:
             doc_id = source.get('document_id')
-            filename = doc_id
-            
-            # Look up original filename if DB session is available
-            if db and doc_id:
-                if doc_id in doc_filename_cache:
-                    filename = doc_filename_cache[doc_id]
-                else:
-                    try:
-                        from models import Document
-                        import uuid
-                        doc_uuid = uuid.UUID(doc_id)
-                        document = db.query(Document).filter(Document.id == doc_uuid).first()
-                        if document:
-                            filename = document.original_filename
-                            doc_filename_cache[doc_id] = filename
-                    except:
-                        # Fallback to doc_id if any error occurs
-                        pass
             
             formatted.append({
-                'document_id': str(doc_id),           # Return original UUID
-                'filename': filename,                 # Return resolved filename for display
+                'document_id': str(doc_id),                      # Return original UUID
+                'filename': filenames.get(str(doc_id), doc_id),  # Return resolved filename for display
                 'chunk_index': source.get('chunk_index'),
                 'text': source.get('text'),
                 'score': round(source.get('score', 0), 3),
@@ -176,67 +403,100 @@ Please provide a clear, accurate answer based on the context above. Cite your so
         
         return formatted
     
-    def stream_query(
+    async def astream_query(
         self,
         query_text: str,
         top_k: int = None,
-        filters: Dict = None
+        filters: Dict = None,
+        db: Any = None
     ):
         """
         Stream RAG query response (for real-time UI updates)
         
-        Yields chunks of the answer as they're generated
+        Yields a 'sources' event first, then 'answer_chunk' events as the
+        provider sends tokens, and finally a 'done' event with timings
         """
-        # Retrieve sources
-        sources = self.embedding_service.search_similar(
-            query_text=query_text,
-            top_k=top_k or settings.default_top_k,
-            filter_metadata=filters
+        start_time = time.time()
+        top_k = top_k or settings.default_top_k
+        
+        cached = await asyncio.to_thread(self._cached_exact, query_text, filters, top_k, start_time, db)
+        if cached:
+            for event in self._result_events(cached):
+                yield event
+            return
+        
+        retrieval_start = time.time()
+        query_embedding = await self.embedding_service.aembed_query(query_text)
+        
+        cached = await asyncio.to_thread(self._cached_similar, query_embedding, filters, top_k, start_time, db)
+        if cached:
+            for event in self._result_events(cached):
+                yield event
+            return
+        
+        sources = await asyncio.to_thread(
+            self.embedding_service.search_by_embedding, query_embedding, top_k, filters
         )
+        retrieval_time = int((time.time() - retrieval_start) * 1000)
         
         if not sources:
-            yield {
-                'type': 'answer',
-                'content': "I couldn't find any relevant information."
-            }
+            for event in self._result_events(self._no_sources_result(retrieval_time, start_time)):
+                yield event
             return
         
-        # Yield sources first
+        formatted_sources = await asyncio.to_thread(self._format_sources, sources, db)
         yield {
             'type': 'sources',
-            'content': self._format_sources(sources)
+            'content': formatted_sources
         }
         
-        # Build context
         context = self._build_context(sources)
-        
-        # Stream answer
-        system_prompt = """You are a helpful AI assistant for document search and Q&A.
-Answer questions based ONLY on the provided context from documents."""
-        
-        user_prompt = f"""Context:\n{context}\n\nQuestion: {query_text}\n\nAnswer:"""
+        llm_start = time.time()
+        answer_parts = []
         
         try:
-            stream = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+            async for delta in self.async_client.stream_chat_completion(
+                messages=self._build_answer_messages(query_text, context),
                 temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                stream=True
-            )
-            
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield {
-                        'type': 'answer_chunk',
-                        'content': chunk.choices[0].delta.content
-                    }
+                max_tokens=self.max_tokens
+            ):
+                answer_parts.append(delta)
+                yield {
+                    'type': 'answer_chunk',
+                    'content': delta
+                }
         
         except Exception as e:
             yield {
                 'type': 'error',
                 'content': str(e)
             }
+            return
+        
+        result = {
+            'answer': "".join(answer_parts),
+            'sources': formatted_sources,
+            'retrieval_time_ms': retrieval_time,
+            'llm_time_ms': int((time.time() - llm_start) * 1000),
+            'total_time_ms': int((time.time() - start_time) * 1000)
+        }
+        self._cache_answer(query_text, filters, top_k, query_embedding, result, sources, start_time)
+        
+        yield self._done_event(result)
+    
+    def _result_events(self, result: Dict[str, Any]):
+        """Replay a complete (cached or empty) result as stream events"""
+        yield {'type': 'sources', 'content': result['sources']}
+        yield {'type': 'answer_chunk', 'content': result['answer']}
+        yield self._done_event(result)
+    
+    def _done_event(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'type': 'done',
+            'content': {
+                'retrieval_time_ms': result['retrieval_time_ms'],
+                'llm_time_ms': result['llm_time_ms'],
+                'total_time_ms': result['total_time_ms'],
+                'cached': result.get('cached', False)
+            }
+        }
@@ -0,0 +1,78 @@
+"""
+Single-flight request coalescing - concurrent identical calls share one execution
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Thread-based coalescing: followers block until the leader's call finishes"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio coalescing: the first caller starts a task, later callers await
+    the same task. The task is shielded, so a cancelled caller does not
+    cancel the work the others are waiting on.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
@@ -0,0 +1,298 @@
+"""
+Template Registry - precompiled extraction templates, loaded from extraction_templates
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import threading
+import time
+from sqlalchemy import func
+from config import settings
+from database import SessionLocal
+from models import ExtractionTemplate
+
+
+BASE_FIELDS = [
+    {"name": "title", "type": "string", "description": "Document title"},
+    {"name": "date", "type": "string", "description": "Document date (ISO format)"},
+    {"name": "summary", "type": "string", "description": "Brief summary (max 200 chars)"},
+]
+
+# Built-in schemas, used for document types without an active template
+DEFAULT_SCHEMAS: Dict[str, Dict] = {
+    "general": {"fields": BASE_FIELDS},
+    "contract": {
+        "fields": BASE_FIELDS + [
+            {"name": "parties", "type": "array", "description": "List of contracting parties"},
+            {"name": "contract_amounts", "type": "array", "description": "Contract amounts with currency"},
+            {"name": "effective_date", "type": "string", "description": "Contract effective date"},
+            {"name": "expiry_date", "type": "string", "description": "Contract expiry date"},
+            {"name": "key_terms", "type": "array", "description": "Key contract terms"},
+        ]
+    },
+    "sop": {
+        "fields": BASE_FIELDS + [
+            {"name": "department", "type": "string", "description": "Responsible department"},
+            {"name": "version", "type": "string", "description": "SOP version number"},
+            {"name": "approval_date", "type": "string", "description": "Approval date"},
+            {"name": "sections", "type": "array", "description": "Main section titles"},
+            {"name": "procedures", "type": "array", "description": "Key procedures"},
+        ]
+    },
+    "official_document": {
+        "fields": BASE_FIELDS + [
+            {"name": "document_number", "type": "string", "description": "Official document number"},
+            {"name": "sender", "type": "string", "description": "Sender organization/person"},
+            {"name": "recipient", "type": "string", "description": "Recipient organization/person"},
+            {"name": "subject", "type": "string", "description": "Document subject"},
+            {"name": "action_required", "type": "string", "description": "Required action if any"},
+        ]
+    },
+}
+
+# extraction_templates.system_prompt replaces this preamble; the schema and rules always follow
+DEFAULT_SYSTEM_PROMPT = """You are a precise document metadata extractor.
+Extract information from documents according to the provided schema.
+Output ONLY valid JSON matching the schema. Do not include explanations or markdown."""
+
+RULES = """Rules:
+1. Extract only information explicitly stated in the document
+2. Use null for missing fields
+3. Format dates as ISO 8601 (YYYY-MM-DD)
+4. Be concise and accurate
+5. Output must be valid JSON"""
+
+SECTION_RULES = """
+6. The text is one section of a longer document: use null for fields not stated in this section
+7. Add a "_confidence" object mapping every non-null field to your confidence (0 to 1) that the value is correct for the whole document"""
+
+BATCH_RULES = """
+6. The input contains several independent documents, each marked "=== Document N ==="
+7. Output {"documents": [{"document_id": N, ...fields}, ...]} with one object per document, extracting each document on its own"""
+
+# extraction_templates.user_prompt_template placeholders: {fields} and {text}
+DEFAULT_USER_PROMPT_TEMPLATE = """Extract the following fields from this document:
+{fields}
+
+Document text:
+---
+{text}
+---
+
+Output JSON:"""
+
+# Text beyond this is truncated in single-call prompts (room for schema and response)
+MAX_PROMPT_TEXT = 8000
+
+
+def _to_string(value: Any) -> Any:
+    return value if isinstance(value, str) else str(value)
+
+
+def _to_array(value: Any) -> Any:
+    if isinstance(value, list):
+        return value
+    return [value] if value else []
+
+
+def _to_number(value: Any) -> Any:
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_COERCE: Dict[str, Callable[[Any], Any]] = {
+    "string": _to_string,
+    "array": _to_array,
+    "number": _to_number,
+}
+
+
+class CompiledTemplate:
+    """
+    An extraction schema with everything derived from it built once: the
+    field list, the system prompts for single, section and batch calls, and
+    one type coercion per field for validation
+
+    A template's own user_prompt_template is used for every call: section
+    and batch prompts put their marked-up text in its {text} placeholder.
+    Without one, each call has its built-in prompt.
+    """
+
+    def __init__(
+        self,
+        schema: Dict,
+        name: str = "default",
+        document_type: str = "general",
+        system_prompt: Optional[str] = None,
+        user_prompt_template: Optional[str] = None
+    ):
+        self.schema = schema
+        self.name = name
+        self.document_type = document_type
+        self.fields = schema["fields"]
+        self.field_names = [f["name"] for f in self.fields]
+        self.field_list = ", ".join(self.field_names)
+
+        self.system_prompt = (
+            f"{system_prompt or DEFAULT_SYSTEM_PROMPT}\n\n"
+            f"Schema:\n{json.dumps(schema, indent=2)}\n\n"
+            f"{RULES}"
+        )
+        self.section_system_prompt = self.system_prompt + SECTION_RULES
+        self.batch_system_prompt = self.system_prompt + BATCH_RULES
+        self._user_prompt = (user_prompt_template or DEFAULT_USER_PROMPT_TEMPLATE).replace("{fields}", self.field_list)
+        self._custom_user_prompt = bool(user_prompt_template)
+
+        # (field name, coercion or None) in schema order
+        self._validators: List[Tuple[str, Optional[Callable[[Any], Any]]]] = [
+            (f["name"], _COERCE.get(f.get("type"))) for f in self.fields
+        ]
+
+    def user_prompt(self, text: str) -> str:
+        """Single-call prompt with the document text"""
+        if len(text) > MAX_PROMPT_TEXT:
+            text = text[:MAX_PROMPT_TEXT] + "\n...[truncated]"
+        return self._user_prompt.replace("{text}", text)
+
+    def section_prompt(self, text: str, index: int, total: int) -> str:
+        """Prompt for one section of a longer document (map step)"""
+        if self._custom_user_prompt:
+            return self._user_prompt.replace("{text}", f"[Section {index + 1} of {total}]\n{text}")
+
+        return f"""Extract the following fields from section {index + 1} of {total} of this document:
+{self.field_list}
+
+Document section:
+---
+{text}
+---
+
+Output JSON:"""
+
+    def batch_prompt(self, texts: List[str]) -> str:
+        """Prompt with several documents"""
+        documents = "\n".join(
+            f"=== Document {number} ===\n{text}" for number, text in enumerate(texts, start=1)
+        )
+        if self._custom_user_prompt:
+            return self._user_prompt.replace("{text}", f"{documents}\n=== End ===")
+
+        return f"""Extract the following fields from each of these {len(texts)} documents:
+{self.field_list}
+
+{documents}
+=== End ===
+
+Output JSON:"""
+
+    def validate(self, metadata: Dict) -> Dict:
+        """Schema fields only, each coerced to its declared type"""
+        validated = {}
+        for field_name, coerce in self._validators:
+            value = metadata.get(field_name)
+            if value is not None and coerce is not None:
+                value = coerce(value)
+            validated[field_name] = value
+        return validated
+
+
+class TemplateRegistry:
+    """
+    Compiled templates per document type
+
+    Active rows of extraction_templates override the built-in schemas; the
+    highest priority template of a type wins. Edits are picked up by a
+    version check (row count and latest updated_at, kept current by the
+    table's trigger) run at most every check_interval seconds, so documents
+    in between cost a dictionary lookup.
+    """
+
+    def __init__(self, check_interval: float = None):
+        self.check_interval = settings.template_check_interval_seconds if check_interval is None else check_interval
+        self._lock = threading.Lock()
+        self._defaults = {
+            document_type: CompiledTemplate(schema, name=f"default:{document_type}", document_type=document_type)
+            for document_type, schema in DEFAULT_SCHEMAS.items()
+        }
+        self._templates: Dict[str, CompiledTemplate] = {}
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self, document_type: str) -> CompiledTemplate:
+        """Template for a document type (the general schema if there is none)"""
+        self._refresh()
+        templates = self._templates
+        return (
+            templates.get(document_type)
+            or self._defaults.get(document_type)
+            or templates.get("general")
+            or self._defaults["general"]
+        )
+
+    def compile(self, schema: Dict) -> CompiledTemplate:
+        """Template for an ad hoc schema (not registered)"""
+        return CompiledTemplate(schema, name="custom")
+
+    def reload(self) -> None:
+        """Force a version check on the next lookup"""
+        with self._lock:
+            self._checked_at = 0.0
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+
+            db = SessionLocal()
+            try:
+                version = db.query(
+                    func.count(ExtractionTemplate.id),
+                    func.max(ExtractionTemplate.updated_at)
+                ).one()
+                version = tuple(version)
+                if version == self._version:
+                    return
+
+                rows = (
+                    db.query(ExtractionTemplate)
+                    .filter(ExtractionTemplate.is_active == True)
+                    .order_by(ExtractionTemplate.priority.desc(), ExtractionTemplate.template_name)
+                    .all()
+                )
+                self._templates = self._compile_rows(rows)
+                self._version = version
+                print(f"✅ Loaded {len(self._templates)} extraction templates")
+            except Exception as e:
+                print(f"⚠️ Extraction template reload failed: {e}")
+            finally:
+                db.close()
+
+    @staticmethod
+    def _compile_rows(rows: List[ExtractionTemplate]) -> Dict[str, CompiledTemplate]:
+        templates = {}
+        for row in rows:
+            if row.document_type in templates:
+                continue
+            try:
+                templates[row.document_type] = CompiledTemplate(
+                    row.schema,
+                    name=row.template_name,
+                    document_type=row.document_type,
+                    system_prompt=row.system_prompt,
+                    user_prompt_template=row.user_prompt_template
+                )
+            except (KeyError, TypeError) as e:
+                print(f"⚠️ Skipping extraction template {row.template_name}: invalid schema ({e})")
+        return templates
+
+
+# Global instance
+template_registry = TemplateRegistry()
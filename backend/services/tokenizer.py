@@ -0,0 +1,120 @@
+"""
+Tokenizers - pluggable token counting for chunking, batching and context budgets
+"""
+from typing import Callable, Dict, List
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import threading
+
+
+# CJK ideographs, kana, hangul and full-width forms: roughly one token per character
+_CJK = r"\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef"
+_REGEX_TOKEN_RE = re.compile(
+    rf"[{_CJK}]|[A-Za-z\u00c0-\u024f]{{1,4}}|\d{{1,3}}|\S"
+)
+
+
+class RegexTokenizer:
+    """
+    Fast offline approximation of a BPE tokenizer for mixed Chinese / English:
+    one token per CJK character, Latin words in pieces of up to four letters,
+    numbers in groups of three, and one token per other symbol
+    """
+
+    name = "regex"
+
+    def token_offsets(self, text: str) -> List[int]:
+        """Character offset at which each token starts"""
+        return [match.start() for match in _REGEX_TOKEN_RE.finditer(text)]
+
+    def count(self, text: str) -> int:
+        return len(_REGEX_TOKEN_RE.findall(text))
+
+
+class TiktokenTokenizer:
+    """Exact OpenAI tokenization through tiktoken (optional dependency)"""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("tiktoken is required for the 'tiktoken' tokenizer") from e
+
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+
+    def token_offsets(self, text: str) -> List[int]:
+        _, offsets = self.encoding.decode_with_offsets(self.encoding.encode(text))
+        return offsets
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+
+# Tokenizer registry: name -> factory(argument after ":" or None)
+TOKENIZERS: Dict[str, Callable] = {
+    "regex": lambda arg=None: RegexTokenizer(),
+    "tiktoken": lambda arg=None: TiktokenTokenizer(arg or "cl100k_base"),
+}
+
+
+def register_tokenizer(name: str, factory: Callable) -> None:
+    """Register a tokenizer factory; it must return an object with token_offsets() and count()"""
+    TOKENIZERS[name] = factory
+
+
+def get_tokenizer(spec: str = "regex"):
+    """Build a tokenizer from a spec such as 'regex' or 'tiktoken:o200k_base'"""
+    name, _, arg = spec.partition(":")
+    if name not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer: {name}")
+    return TOKENIZERS[name](arg or None)
+
+
+def _text_key(text: str) -> bytes:
+    """LRU key: a 16-byte digest, so the cache does not keep whole chunk texts alive"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCounter:
+    """LRU cache of token counts so no text is tokenized twice in the pipeline"""
+
+    def __init__(self, tokenizer, max_entries: int = 50000):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str) -> int:
+        key = _text_key(text)
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        n = self.tokenizer.count(text)
+        self._store(key, n)
+        return n
+
+    def remember(self, text: str, n: int) -> None:
+        """Record a count that was already computed elsewhere (e.g. while chunking)"""
+        self._store(_text_key(text), n)
+
+    def _store(self, key: bytes, n: int) -> None:
+        with self._lock:
+            self._counts[key] = n
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+
+# 全局 tokenizer / 計數快取
+tokenizer = get_tokenizer(os.getenv("TOKENIZER", "regex"))
+token_counter = TokenCounter(tokenizer)
@@ -0,0 +1,144 @@
+"""
+Vector Store - the chunk vector database behind EmbeddingService
+"""
+from typing import Any, Dict, List, Optional
+from config import settings
+
+
+class VectorStore:
+    """
+    Chunk vectors with their text and metadata, addressed by chunk ID
+
+    Filters (where) use the Chroma syntax: {"field": value},
+    {"field": {"$eq" | "$ne" | "$gt" | "$gte" | "$lt" | "$lte" | "$in" | "$nin": value}},
+    {"$and": [...]} and {"$or": [...]}. Scores are cosine similarities.
+    """
+
+    # Backends in the application database write in the caller's transaction
+    joins_transaction = False
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        db: Any = None
+    ) -> None:
+        """db: the caller's Session (used when joins_transaction, ignored otherwise)"""
+        raise NotImplementedError
+
+    def query(
+        self,
+        embedding: List[float],
+        top_k: int,
+        where: Optional[Dict] = None
+    ) -> List[Dict[str, Any]]:
+        """Nearest chunks, best first: [{'id', 'text', 'metadata', 'score'}]"""
+        raise NotImplementedError
+
+    def get(self, where: Dict) -> Dict[str, List]:
+        """Matching chunks without vectors: {'ids', 'documents', 'metadatas'}"""
+        raise NotImplementedError
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]], db: Any = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str], db: Any = None) -> None:
+        raise NotImplementedError
+
+    def begin_rewrite(self, document_id: str, db: Any = None) -> None:
+        """
+        Called before a document's chunks are rewritten batch by batch under
+        new positions (its stale chunks are deleted afterwards)
+        """
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__}
+
+    def rebuild_index(self) -> Dict[str, Any]:
+        """Rebuild the ANN index (backends that have one); returns stats()"""
+        raise NotImplementedError(f"{type(self).__name__} has no index to rebuild")
+
+
+class ChromaVectorStore(VectorStore):
+    """ChromaDB collection with cosine HNSW (embedded or a shared server)"""
+
+    def __init__(self):
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
+        if settings.chromadb_host:
+            # Shared server: writes from worker processes are visible to the API
+            self.client = chromadb.HttpClient(
+                host=settings.chromadb_host,
+                port=settings.chromadb_port,
+                settings=ChromaSettings(anonymized_telemetry=False)
+            )
+        else:
+            self.client = chromadb.PersistentClient(
+                path=settings.chromadb_path,
+                settings=ChromaSettings(anonymized_telemetry=False)
+            )
+        self.collection = self.client.get_or_create_collection(
+            name="document_chunks",
+            metadata={"hnsw:space": "cosine"}
+        )
+
+    def upsert(self, ids, embeddings, documents, metadatas, db=None) -> None:
+        self.collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=documents,
+            metadatas=metadatas
+        )
+
+    def query(self, embedding, top_k, where=None) -> List[Dict[str, Any]]:
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=top_k,
+            where=where
+        )
+        return [
+            {
+                'id': chunk_id,
+                'text': text,
+                'metadata': metadata,
+                'score': 1 - distance  # Convert distance to similarity
+            }
+            for chunk_id, text, metadata, distance in zip(
+                results['ids'][0], results['documents'][0], results['metadatas'][0], results['distances'][0]
+            )
+        ]
+
+    def get(self, where: Dict) -> Dict[str, List]:
+        results = self.collection.get(where=where, include=["documents", "metadatas"])
+        return {
+            'ids': results['ids'],
+            'documents': results['documents'],
+            'metadatas': results['metadatas'],
+        }
+
+    def update_metadata(self, ids, metadatas, db=None) -> None:
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids: List[str], db=None) -> None:
+        self.collection.delete(ids=ids)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "chromadb", "chunks": self.collection.count()}
+
+
+def create_vector_store() -> VectorStore:
+    """The backend selected by settings.vector_db_type"""
+    if settings.vector_db_type == "chromadb":
+        return ChromaVectorStore()
+    elif settings.vector_db_type == "flat":
+        from services.flat_index import FlatVectorStore
+        return FlatVectorStore()
+    elif settings.vector_db_type == "pgvector":
+        from services.pgvector_store import PgVectorStore
+        return PgVectorStore()
+    else:
+        # Pinecone initialization would go here
+        raise NotImplementedError("Pinecone support not yet implemented")
@@ -0,0 +1,103 @@
+"""
+Answer cache invalidation tests
+
+Usage (from backend/):
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.answer_cache import AnswerCache  # noqa: E402
+
+
+FILTERS = {"document_type": "contract"}
+
+
+def make_cache():
+    return AnswerCache(ttl_seconds=3600, max_entries=100, similarity_threshold=0.95)
+
+
+def checker(processed):
+    """
+    is_current over processed: {document_id: processed_date timestamp or None},
+    the check RAGEngine runs against documents.processed_date (a missing
+    document has been deleted)
+    """
+    def is_current(document_ids, created_at):
+        return all(
+            doc_id in processed and (processed[doc_id] is None or processed[doc_id] < created_at)
+            for doc_id in document_ids
+        )
+    return is_current
+
+
+def put(cache, query="What is the contract term?", embedding=(1.0, 0.0, 0.0), document_ids=("d1",), created_at=None):
+    cache.put(query, FILTERS, 4, list(embedding), {"answer": f"answer to {query}", "sources": []}, list(document_ids), created_at)
+
+
+def test_hit_while_documents_unchanged():
+    cache = make_cache()
+    processed = {"d1": time.time() - 60, "d2": None}
+    put(cache, document_ids=("d1", "d2"))
+
+    assert cache.get_exact("what is  the contract TERM?", FILTERS, 4, checker(processed))["answer"] == "answer to What is the contract term?"
+    assert cache.get_similar([0.99, 0.05, 0.0], FILTERS, 4, checker(processed)) is not None
+    assert cache.stats()["entries"] == 1
+
+
+def test_reprocessed_document_invalidates_exact_hit():
+    cache = make_cache()
+    processed = {"d1": time.time() - 60}
+    put(cache)
+
+    processed["d1"] = time.time() + 1
+    assert cache.get_exact("What is the contract term?", FILTERS, 4, checker(processed)) is None
+    # The stale entry is dropped, not just skipped
+    assert cache.stats()["entries"] == 0
+
+
+def test_reprocessed_document_invalidates_semantic_hit():
+    cache = make_cache()
+    processed = {"d1": None}
+    put(cache)
+
+    processed["d1"] = time.time() + 1
+    assert cache.get_similar([1.0, 0.01, 0.0], FILTERS, 4, checker(processed)) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_processing_committed_during_retrieval_makes_the_answer_stale():
+    cache = make_cache()
+    retrieval_started = time.time() - 5
+    # The worker committed new chunks after retrieval read the old ones
+    processed = {"d1": retrieval_started + 1}
+    put(cache, created_at=retrieval_started)
+
+    assert cache.get_exact("What is the contract term?", FILTERS, 4, checker(processed)) is None
+
+
+def test_deleted_document_invalidates():
+    cache = make_cache()
+    put(cache, document_ids=("d1", "d2"))
+
+    assert cache.get_exact("What is the contract term?", FILTERS, 4, checker({"d1": None})) is None
+
+
+def test_invalidate_document_drops_only_its_answers():
+    cache = make_cache()
+    put(cache, query="first question", embedding=(1.0, 0.0, 0.0), document_ids=("d1",))
+    put(cache, query="second question", embedding=(0.0, 1.0, 0.0), document_ids=("d1", "d2"))
+    put(cache, query="third question", embedding=(0.0, 0.0, 1.0), document_ids=("d3",))
+
+    assert cache.invalidate_document("d1") == 2
+    assert cache.get_exact("first question", FILTERS, 4) is None
+    assert cache.get_exact("second question", FILTERS, 4) is None
+    assert cache.get_exact("third question", FILTERS, 4) is not None
@@ -0,0 +1,96 @@
+"""
+Chunker regression tests: streamed input must chunk exactly like the joined text
+
+Usage (from backend/):
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.chunker import TextChunker, TokenChunker  # noqa: E402
+from services.tokenizer import RegexTokenizer, TokenCounter  # noqa: E402
+
+
+WORDS = ["contract", "term", "party", "合約", "有效期限", "報告", "2024", "section", "的", "SOP"]
+ENDINGS = [". ", "。", "! ", "？", "\n\n", "\n", " ", ", "]
+
+
+def make_text(seed, length):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < length:
+        part = rng.choice(WORDS) + rng.choice(ENDINGS)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def split(text, seed):
+    """Cut text at random offsets, including empty pieces and single characters"""
+    rng = random.Random(seed)
+    pieces = []
+    position = 0
+    while position < len(text):
+        step = rng.choice([0, 1, 2, 7, 50, 300, 2000])
+        pieces.append(text[position:position + step])
+        position += step
+    return pieces
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap,min_chunk_size", [(1000, 200, 100), (120, 30, 10), (50, 0, 1)])
+@pytest.mark.parametrize("seed", range(5))
+def test_text_chunker_streamed_matches_chunk_text(chunk_size, chunk_overlap, min_chunk_size, seed):
+    chunker = TextChunker(chunk_size, chunk_overlap, min_chunk_size)
+    text = make_text(seed, 6000)
+
+    expected = chunker.chunk_text(text, {"document_id": "d"})
+    assert expected
+    assert list(chunker.iter_chunks(split(text, seed), {"document_id": "d"})) == expected
+
+
+def test_text_chunker_positions_index_the_joined_text():
+    chunker = TextChunker(200, 40, 20)
+    text = make_text(7, 3000)
+
+    chunks = list(chunker.iter_chunks(split(text, 7)))
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        metadata = chunk["metadata"]
+        assert text[metadata["start_pos"]:metadata["end_pos"]].strip() == chunk["chunk_text"]
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap,min_chunk_size", [(300, 60, 20), (40, 8, 1)])
+@pytest.mark.parametrize("seed", range(5))
+def test_token_chunker_streamed_matches_chunk_text(chunk_size, chunk_overlap, min_chunk_size, seed):
+    tokenizer = RegexTokenizer()
+    chunker = TokenChunker(tokenizer, chunk_size, chunk_overlap, min_chunk_size)
+    text = make_text(seed, 6000)
+
+    expected = chunker.chunk_text(text)
+    assert expected
+    assert list(chunker.iter_chunks(split(text, seed))) == expected
+    for chunk in expected:
+        assert chunk["token_count"] <= chunk_size
+        assert tokenizer.count(chunk["chunk_text"]) == chunk["token_count"]
+
+
+def test_token_chunker_records_counts():
+    tokenizer = RegexTokenizer()
+    counter = TokenCounter(tokenizer)
+    chunker = TokenChunker(tokenizer, 50, 10, 1, counter=counter)
+
+    for chunk in chunker.chunk_text(make_text(3, 1000)):
+        assert counter.count(chunk["chunk_text"]) == chunk["token_count"]
+
+
+def test_overlap_must_let_the_window_advance():
+    with pytest.raises(ValueError):
+        TextChunker(100, 100, 1).chunk_text(make_text(0, 500))
+    with pytest.raises(ValueError):
+        TokenChunker(RegexTokenizer(), 20, 20, 1).chunk_text(make_text(0, 500))
@@ -0,0 +1,67 @@
+"""
+LLM JSON parsing tests
+
+Usage (from backend/):
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.llm_json import MAX_CANDIDATES, JSONObjectDecoder, parse_json_response  # noqa: E402
+
+
+def test_plain_and_fenced_object():
+    assert parse_json_response(' {"title": "合約", "pages": 3}\n') == {"title": "合約", "pages": 3}
+    assert parse_json_response('```json\n{"a": [1, 2]}\n```') == {"a": [1, 2]}
+
+
+def test_list_is_returned_as_is():
+    # The caller (AIExtractor._complete_json) rejects anything but a dict
+    assert parse_json_response('[{"a": 1}, {"b": 2}]') == [{"a": 1}, {"b": 2}]
+    assert parse_json_response("[]") == []
+
+
+def test_stray_brace_in_prose_before_the_object():
+    response = 'Fields use {curly} placeholders. Result: {"a": {"b": 2}, "c": "x } y {"} Hope this helps }'
+    assert parse_json_response(response) == {"a": {"b": 2}, "c": "x } y {"}
+
+
+def test_unbalanced_stray_brace_before_the_object():
+    assert parse_json_response('Here { is the JSON: {"a": 1}') == {"a": 1}
+
+
+def test_truncated_object_is_an_error():
+    # Never one of the complete objects nested in it
+    with pytest.raises(ValueError):
+        parse_json_response('{"parties": {"name": "A"}, "summary": "The agreement')
+    with pytest.raises(ValueError):
+        parse_json_response('Sure! ```json\n{"a": {"b": 1}, "c": [1, 2')
+
+
+def test_no_object():
+    with pytest.raises(ValueError):
+        parse_json_response("I could not find any metadata.")
+    with pytest.raises(ValueError):
+        parse_json_response("")
+
+
+def test_invalid_candidates_are_bounded():
+    response = '{"a" 1} ' * MAX_CANDIDATES + '{"a": 1}'
+    with pytest.raises(ValueError):
+        parse_json_response("Result: " + response)
+
+
+def test_decoder_streamed_one_character_at_a_time():
+    response = 'prefix {not json} {"text": "say \\"hi\\" {", "n": [1, {"m": 2}]} suffix'
+    decoder = JSONObjectDecoder()
+    results = [decoder.feed(character) for character in response]
+    expected = {"text": 'say "hi" {', "n": [1, {"m": 2}]}
+
+    assert results[-1] == expected
+    # Returned as soon as the closing brace arrives
+    assert results[response.index("} suffix")] == expected
+    assert results[response.index("} suffix") - 1] is None
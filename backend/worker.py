@@ -0,0 +1,90 @@
+"""
+Ingestion Worker Pool - runs queued document processing jobs outside the API process
+
+Usage:
+    python worker.py                 # MAX_CONCURRENT_UPLOADS worker processes
+    python worker.py --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+from config import settings
+
+
+def shares_vector_store() -> bool:
+    """Whether the workers and the API process can use the configured vector store at once"""
+    if settings.vector_db_type == "chromadb":
+        # Embedded Chroma (CHROMADB_PATH) is a single-process store; the Chroma server is not
+        return bool(settings.chromadb_host)
+    # flat: file-locked log; pgvector / pinecone: database servers
+    return True
+
+
+def run_worker(stop_event) -> None:
+    """Worker process entry point"""
+    # The parent handles Ctrl+C / SIGTERM and sets stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # Imported here so every process builds its own DB engine, HTTP pools and vector DB client
+    from services.ingestion import IngestionWorker
+
+    IngestionWorker().run_forever(stop_event)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Document ingestion worker pool")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=settings.max_concurrent_uploads,
+        help="Number of worker processes (default: MAX_CONCURRENT_UPLOADS)"
+    )
+    args = parser.parse_args()
+
+    # The API process always has the store open as well, so even one worker needs a shared store
+    if not shares_vector_store():
+        parser.error(
+            "ingestion workers cannot share the embedded Chroma store with the API: "
+            "set CHROMADB_HOST (Chroma server) or use VECTOR_DB_TYPE=flat, pgvector or pinecone"
+        )
+
+    # Inherited by the spawned workers: their PDF pools split the CPU cores between them
+    # (services.document_processor.WORKER_PROCESSES_ENV)
+    os.environ["INGEST_WORKER_PROCESSES"] = str(args.processes)
+
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+
+    def start(index: int):
+        process = ctx.Process(target=run_worker, args=(stop_event,), name=f"ingest-worker-{index}")
+        process.start()
+        return process
+
+    workers = [start(i) for i in range(args.processes)]
+    print(f"✅ Started {args.processes} ingestion workers")
+
+    def shutdown(signum, frame):
+        print("🛑 Stopping ingestion workers (running jobs finish first)")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    while not stop_event.is_set():
+        # Replace crashed workers; their jobs are reclaimed when the lease expires
+        for i, process in enumerate(workers):
+            if not process.is_alive() and not stop_event.is_set():
+                print(f"⚠️ {process.name} exited with code {process.exitcode}, restarting")
+                workers[i] = start(i)
+        time.sleep(1)
+
+    for process in workers:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@
 
 -- Enable required-- Extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
--- CREATE EXTENSION IF NOT EXISTS "vector";  -- Not needed, using ChromaDB for vectors  -- pgvector for embeddings (optional if using external vector DB)
+-- CREATE EXTENSION IF NOT EXISTS "vector";  -- pgvector: created on first use when VECTOR_DB_TYPE=pgvector
 
 -- Documents table: stores main document metadata
 CREATE TABLE documents (
@@ -12,6 +12,7 @@ CREATE TABLE documents (
     original_filename VARCHAR(500) NOT NULL,
     file_path TEXT NOT NULL,
     file_size_bytes BIGINT NOT NULL,
+    content_hash VARCHAR(64),  -- SHA-256 of the file, for duplicate detection
     mime_type VARCHAR(100),
     
     -- Document classification
@@ -45,6 +46,7 @@ CREATE TABLE documents (
 CREATE INDEX idx_documents_status ON documents(status);
 CREATE INDEX idx_documents_document_type ON documents(document_type);
 CREATE INDEX idx_documents_upload_date ON documents(upload_date DESC);
+CREATE INDEX idx_documents_content_hash ON documents(content_hash);
 CREATE INDEX idx_documents_metadata ON documents USING GIN(doc_metadata);
 CREATE INDEX idx_documents_full_text ON documents USING GIN(to_tsvector('english', full_text));
 
@@ -55,7 +57,8 @@ CREATE TABLE chunks (
     chunk_index INTEGER NOT NULL,
     chunk_text TEXT NOT NULL,
     
-    -- Embedding vector (if using pgvector)
+    -- Embedding vector (if using pgvector; added on first use by services/pgvector_store.py)
+    -- vector_id VARCHAR(200),  -- vector store chunk ID (unique)
     -- embedding vector(1536),  -- OpenAI text-embedding-3-small dimension
     
     -- Chunk metadata
@@ -71,7 +74,8 @@ CREATE TABLE chunks (
 -- Indexes for chunks table
 CREATE INDEX idx_chunks_document_id ON chunks(document_id);
 CREATE INDEX idx_chunks_chunk_index ON chunks(chunk_index);
--- CREATE INDEX idx_chunks_embedding ON chunks USING ivfflat(embedding vector_cosine_ops);  -- if using pgvector
+-- CREATE UNIQUE INDEX idx_chunks_vector_id ON chunks(vector_id);  -- if using pgvector
+-- CREATE INDEX CONCURRENTLY idx_chunks_embedding_hnsw ON chunks USING hnsw(embedding vector_cosine_ops);  -- or ivfflat (PGVECTOR_INDEX); see POST /api/admin/vector-index/rebuild
 
 -- Extraction templates: configurable schemas for different document types
 CREATE TABLE extraction_templates (
@@ -144,6 +148,14 @@ CREATE TABLE processing_jobs (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     job_type VARCHAR(50) NOT NULL,  -- document_upload, batch_process, reindex, etc.
     status VARCHAR(50) NOT NULL DEFAULT 'queued',  -- queued, running, completed, failed
+    document_id UUID REFERENCES documents(id) ON DELETE CASCADE,
+    
+    -- Queue / lease
+    retry_count INTEGER DEFAULT 0,
+    max_retries INTEGER DEFAULT 3,
+    run_after TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,  -- earliest (re)try time
+    locked_by VARCHAR(200),  -- worker holding the lease
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
     
     -- Job details
     input_data JSONB,
@@ -166,6 +178,8 @@ CREATE TABLE processing_jobs (
 -- Indexes for processing_jobs
 CREATE INDEX idx_processing_jobs_status ON processing_jobs(status);
 CREATE INDEX idx_processing_jobs_created_at ON processing_jobs(created_at DESC);
+CREATE INDEX idx_processing_jobs_queue ON processing_jobs(status, run_after);
+CREATE INDEX idx_processing_jobs_document_id ON processing_jobs(document_id);
 
 -- System configuration table
 CREATE TABLE system_config (
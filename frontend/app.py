@@ -176,6 +176,20 @@ def search_documents(query, top_k=4):
     response = requests.post(f"{API_BASE_URL}/api/search/query", json=payload)
     return response.json() if response.status_code == 200 else None
 
+def stream_search(query, top_k=4):
+    """Search documents using RAG, yielding server-sent events as they arrive"""
+    payload = {"query": query, "top_k": top_k}
+    with requests.post(
+        f"{API_BASE_URL}/api/search/stream",
+        json=payload,
+        stream=True,
+        timeout=(5, 300)
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data:"):
+                yield json.loads(line[5:].strip())
+
 def get_stats():
     """Get system statistics"""
     response = requests.get(f"{API_BASE_URL}/api/stats")
@@ -355,49 +369,80 @@ elif page == "🔍 智能搜尋":
             top_k = st.slider("檢索段落數", 1, 10, 4)
         
         if st.button("🔍 搜尋", type="primary") and query.strip():
-            with st.spinner("搜尋中..."):
-                result = search_documents(query, top_k)
+            # Summary is filled in once the answer is complete
+            st.markdown("### 📝 摘要")
+            summary_box = st.empty()
+            st.markdown("### 💡 完整回答")
+            answer_box = st.empty()
+            
+            result = {"answer": "", "sources": []}
+            try:
+                with st.spinner("搜尋中..."):
+                    events = stream_search(query, top_k)
+                    # Wait for retrieval before the spinner disappears
+                    for event in events:
+                        if event["type"] == "sources":
+                            result["sources"] = event["content"]
+                            break
+                        if event["type"] == "error":
+                            raise RuntimeError(event["content"])
                 
-                if result and "answer" in result:
-                    # Display summary
-                    st.markdown("### 📝 摘要")
-                    summary_lines = result["answer"].split("\\n")[:3]  # First 3 lines as summary
-                    st.info("\\n".join(summary_lines))
-                    
-                    # Display full answer
-                    st.markdown("### 💡 完整回答")
-                    st.markdown(f'<div class="source-box">{result["answer"]}</div>', unsafe_allow_html=True)
+                # Render tokens as they arrive
+                for event in events:
+                    if event["type"] == "answer_chunk":
+                        result["answer"] += event["content"]
+                        answer_box.markdown(f'<div class="source-box">{result["answer"]}▌</div>', unsafe_allow_html=True)
+                    elif event["type"] == "done":
+                        result.update(event["content"])
+                    elif event["type"] == "error":
+                        raise RuntimeError(event["content"])
+            except Exception as e:
+                if result["answer"]:
+                    # Part of the answer is already on screen: keep it and report the error
+                    st.error(f"❌ 回答產生中斷: {e}")
+                else:
+                    # Nothing streamed yet: fall back to the non-streaming endpoint
+                    with st.spinner("搜尋中..."):
+                        result = search_documents(query, top_k)
+            
+            if result and result.get("answer"):
+                # Display summary
+                summary_lines = result["answer"].split("\\n")[:3]  # First 3 lines as summary
+                summary_box.info("\\n".join(summary_lines))
+                
+                # Display full answer
+                answer_box.markdown(f'<div class="source-box">{result["answer"]}</div>', unsafe_allow_html=True)
+                
+                # Display performance metrics
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("檢索時間", f"{result.get('retrieval_time_ms', 0)} ms")
+                with col2:
+                    st.metric("生成時間", f"{result.get('llm_time_ms', 0)} ms")
+                with col3:
+                    st.metric("總時間", f"{result.get('total_time_ms', 0)} ms")
+                
+                # Display sources
+                st.markdown("### 📚 依據片段")
+                sources = result.get('sources', [])
+                for i, source in enumerate(sources):
+                    doc_id = source.get('document_id', '')
+                    filename = source.get('filename', doc_id) # API now returns filename
                     
-                    # Display performance metrics
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("檢索時間", f"{result.get('retrieval_time_ms', 0)} ms")
-                    with col2:
-                        st.metric("生成時間", f"{result.get('llm_time_ms', 0)} ms")
-                    with col3:
-                        st.metric("總時間", f"{result.get('total_time_ms', 0)} ms")
+                    # Use filename for display, doc_id (UUID) for link if valid
+                    display_name = filename if filename else "未知文件"
                     
-                    # Display sources
-                    st.markdown("### 📚 依據片段")
-                    sources = result.get('sources', [])
-                    for i, source in enumerate(sources):
-                        doc_id = source.get('document_id', '')
-                        filename = source.get('filename', doc_id) # API now returns filename
-                        
-                        # Use filename for display, doc_id (UUID) for link if valid
-                        display_name = filename if filename else "未知文件"
-                        
-                        # Check if doc_id looks like a UUID to build link
-                        download_link = ""
-                        if len(doc_id) > 10: # Simple heuristic check for UUID
-                             download_link = f" [📥 開啟檔案]({API_BASE_URL}/api/documents/{doc_id}/content)"
+                    # Check if doc_id looks like a UUID to build link
+                    download_link = ""
+                    if len(doc_id) > 10: # Simple heuristic check for UUID
+                         download_link = f" [📥 開啟檔案]({API_BASE_URL}/api/documents/{doc_id}/content)"
 
-                        with st.expander(f"來源 {i+1} - {display_name} (相似度: {source.get('score', 0):.3f})"):
-                            st.markdown(f"**文件**: {display_name} {download_link}")
-                            st.markdown(f"**文本塊**: {source.get('chunk_index', 'N/A')}")
-                            st.markdown(source.get('text', ''))
-                else:
-                    st.error("搜尋失敗或無結果，請稍後再試")
+                    with st.expander(f"來源 {i+1} - {display_name} (相似度: {source.get('score', 0):.3f})"):
+                        st.markdown(f"**文件**: {display_name} {download_link}")
+                        st.markdown(f"**文本塊**: {source.get('chunk_index', 'N/A')}")
+                        st.markdown(source.get('text', ''))
+            else:
+                st.error("搜尋失敗或無結果，請稍後再試")
 
 # Page: Admin
 elif page == "📊 管理後台":
@@ -9,6 +9,7 @@ import pandas as pd
 import streamlit as st
 import chromadb
 from typing import List, Dict, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -87,6 +88,9 @@ class UniversalLLMClient:
         self.provider = self._get_config("LLM_PROVIDER", "openrouter").lower()
         self.openrouter_api_key = self._get_config("OPENROUTER_API_KEY")
         self.openrouter_model = self._get_config("OPENROUTER_MODEL", "google/gemini-2.0-flash-exp:free")
+        self.embedding_concurrency = int(self._get_config("EMBEDDING_CONCURRENCY", 4))
+        # Keep-alive session shared by all requests
+        self.session = requests.Session()
         
     def _get_config(self, key, default=None):
         if hasattr(st, "secrets") and key in st.secrets:
@@ -135,28 +139,56 @@ class UniversalLLMClient:
             # We assume key is present.
             return [[0.0]*1536 for _ in texts] # Fallback if no key
 
+        # Token-bounded batches, sent concurrently; results stay in input order
+        batches = self._plan_embedding_batches(texts)
+        with ThreadPoolExecutor(max_workers=self.embedding_concurrency) as executor:
+            results = list(executor.map(self._embed_batch, batches))
+        
+        all_embeddings = []
+        for embeddings in results:
+            all_embeddings.extend(embeddings)
+        return all_embeddings
+
+    def _plan_embedding_batches(self, texts, max_items=20, max_tokens=8000):
+        # Rough token estimate: CJK ~1 token/char, others ~4 chars/token
+        batches, batch, used = [], [], 0
+        for text in texts:
+            cjk = sum(1 for ch in text if ch >= "\u2e80")
+            tokens = cjk + (len(text) - cjk) // 4 + 1
+            if batch and (len(batch) >= max_items or used + tokens > max_tokens):
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append(text)
+            used += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, batch, attempt=0):
         url = "https://openrouter.ai/api/v1/embeddings"
         headers = {
             "Authorization": f"Bearer {self.openrouter_api_key}",
             "Content-Type": "application/json"
         }
-        
-        all_embeddings = []
-        # Batching
-        for i in range(0, len(texts), 20):
-            batch = texts[i:i+20]
-            payload = {"model": "text-embedding-3-small", "input": batch}
-            try:
-                res = requests.post(url, headers=headers, json=payload, timeout=30)
-                if res.status_code == 200:
-                    data = res.json()
-                    all_embeddings.extend([item["embedding"] for item in data["data"]])
-                else:
-                    # Fallback random/zeros
-                    all_embeddings.extend([[0.0]*1536 for _ in batch])
-            except:
-                 all_embeddings.extend([[0.0]*1536 for _ in batch])
-        return all_embeddings
+        payload = {"model": "text-embedding-3-small", "input": batch}
+        try:
+            res = self.session.post(url, headers=headers, json=payload, timeout=30)
+            if res.status_code in (413, 429) and attempt < 4:
+                # Too large / rate limited: split the batch and retry both halves
+                if res.status_code == 429:
+                    time.sleep(2 ** attempt)
+                if len(batch) == 1:
+                    return self._embed_batch(batch, attempt + 1)
+                middle = len(batch) // 2
+                return (self._embed_batch(batch[:middle], attempt + 1)
+                        + self._embed_batch(batch[middle:], attempt + 1))
+            if res.status_code == 200:
+                data = res.json()
+                return [item["embedding"] for item in data["data"]]
+            # Fallback random/zeros
+            return [[0.0]*1536 for _ in batch]
+        except:
+            return [[0.0]*1536 for _ in batch]
 
 # ==========================================
 # RAG System (Core)